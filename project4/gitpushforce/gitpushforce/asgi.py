@@ -0,0 +1,149 @@
+"""
+ASGI config for gitpushforce project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+Server-sent event streams (see umoc.streams) are served directly by the event
+loop. Every other request is passed to the WSGI application in a thread pool,
+so all existing views work unchanged.
+
+Run it as a single process, e.g. ``uvicorn gitpushforce.asgi:application``:
+events are published in-process, so only the process that handles a request
+can push its events to open pages. For the same reason, while it runs it
+delivers queued notifications itself (see umoc.notifications), so they reach
+open pages as soon as they are delivered.
+"""
+
+import asyncio
+import io
+import logging
+import os
+import sys
+
+from django.conf import settings
+from django.core.wsgi import get_wsgi_application
+from django.db import connections
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "gitpushforce.settings")
+
+wsgi_application = get_wsgi_application()
+
+from umoc.notifications import deliver_queued_notifications
+from umoc.streams import find_stream
+
+logger = logging.getLogger(__name__)
+
+# seconds between checks of an empty notification outbox
+OUTBOX_POLL_INTERVAL = 1
+
+
+def build_environ(scope, body):
+    """
+    Returns a WSGI environ for the given ASGI HTTP scope and request body.
+    """
+    server_name, server_port = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        # WSGI expects paths as bytes decoded as latin-1
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server_name,
+        'SERVER_PORT': str(server_port),
+        'SERVER_PROTOCOL': 'HTTP/{}'.format(scope.get('http_version', '1.1')),
+        'REMOTE_ADDR': scope['client'][0] if scope.get('client') else '',
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            name = 'HTTP_' + name
+        environ[name] = environ[name] + ',' + value if name in environ else value
+    return environ
+
+
+def call_wsgi(environ):
+    """
+    Runs the WSGI application on environ, returning (status code, headers, body chunks).
+    """
+    response = {}
+
+    def start_response(status, headers, exc_info=None):
+        response['status'] = int(status.split(' ', 1)[0])
+        response['headers'] = [(name.encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+
+    result = wsgi_application(environ, start_response)
+    try:
+        chunks = list(result)
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+    return response['status'], response['headers'], chunks
+
+
+def deliver_notifications():
+    """
+    Delivers one batch of queued notifications, returning how many were delivered. Runs in a worker thread.
+    """
+    try:
+        return deliver_queued_notifications()
+    except Exception:
+        # e.g. the database is locked: try again next time
+        logger.exception('Could not deliver queued notifications')
+        return 0
+    finally:
+        connections.close_all()
+
+
+async def drain_outbox():
+    """
+    Delivers queued notifications until cancelled, like ``manage.py drain_outbox --loop``.
+    """
+    loop = asyncio.get_event_loop()
+    while True:
+        if not await loop.run_in_executor(None, deliver_notifications):
+            await asyncio.sleep(OUTBOX_POLL_INTERVAL)
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        outbox = None
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                if getattr(settings, 'NOTIFICATION_OUTBOX', True):
+                    outbox = asyncio.ensure_future(drain_outbox())
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if outbox:
+                    outbox.cancel()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+    elif scope['type'] != 'http':
+        raise ValueError('Unsupported ASGI scope type {}'.format(scope['type']))
+
+    stream = find_stream(scope['path'])
+    if stream:
+        handler, kwargs = stream
+        await handler(scope, receive, send, **kwargs)
+        return
+
+    # read the whole request body, then run the view in a worker thread
+    body = b''
+    more_body = True
+    while more_body:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
+        body += message.get('body', b'')
+        more_body = message.get('more_body', False)
+
+    status, headers, chunks = await asyncio.get_event_loop().run_in_executor(None, call_wsgi, build_environ(scope, body))
+    await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': b''.join(chunks)})
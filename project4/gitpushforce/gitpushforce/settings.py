@@ -82,6 +82,29 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/2.0/topics/cache/
+# Pick a backend with the UMOC_CACHE environment variable:
+#   locmem     (default) memory of each server process. Fine for a single process
+#   file       files in UMOC_CACHE_LOCATION (default /var/tmp/umoc_cache), shared by every process on this machine
+#   memcached  a memcached-compatible server at UMOC_CACHE_LOCATION (default 127.0.0.1:11211). Needs python-memcached
+
+CACHE_BACKENDS = {
+    'locmem': ('django.core.cache.backends.locmem.LocMemCache', 'umoc'),
+    'file': ('django.core.cache.backends.filebased.FileBasedCache', '/var/tmp/umoc_cache'),
+    'memcached': ('django.core.cache.backends.memcached.MemcachedCache', '127.0.0.1:11211'),
+}
+CACHE_BACKEND, CACHE_LOCATION = CACHE_BACKENDS[os.environ.get('UMOC_CACHE', 'locmem')]
+
+CACHES = {
+    'default': {
+        'BACKEND': CACHE_BACKEND,
+        'LOCATION': os.environ.get('UMOC_CACHE_LOCATION', CACHE_LOCATION),
+        'KEY_PREFIX': 'gitpushforce',
+    }
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/2.0/ref/settings/#auth-password-validators
 
@@ -131,3 +154,11 @@ MEDIA_URL = 'media/'
 LOGIN_REDIRECT_URL = '/dashboard'
 LOGOUT_REDIRECT_URL = '/'
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
+
+# Notifications are queued in an outbox and delivered by `python manage.py drain_outbox --loop`, run next to the server.
+# The ASGI application (gitpushforce/asgi.py) also delivers them itself, which lets it push them to open pages right away.
+# Set to False to deliver them during the request instead.
+NOTIFICATION_OUTBOX = True
+
+# Also email delivered notifications through EMAIL_BACKEND
+NOTIFICATION_EMAIL = False
@@ -1,9 +1,26 @@
 from django.contrib import admin
-from .models import UserProfile, Trip, Comment, Notification
+from .models import UserProfile, Trip, Comment, Notification, Waitlist, LotteryEntry, ArchivedComment, ArchivedNotification
+from .search import filter_search
 
 class TripAdmin(admin.ModelAdmin):
-	list_display = ('name', 'description', 'num_seats', 'tag')
-	search_fields = ('name', 'num_seats', 'tag')
+	list_display = ('name', 'description', 'participant_count', 'capacity', 'tag')
+	search_fields = ('name', 'description')
+	
+	# finds trips by name and description with the full-text index, rather than a LIKE scan per search field
+	def get_search_results(self, request, queryset, search_term):
+		if not search_term:
+			return queryset, False
+		return queryset.filter(filter_search(search_term)), False
+
+class ArchivedCommentAdmin(admin.ModelAdmin):
+	list_display = ('trip', 'author', 'text', 'time_stamp')
+	list_select_related = ('trip', 'author')
+	search_fields = ('text', 'trip__name')
+
+class ArchivedNotificationAdmin(admin.ModelAdmin):
+	list_display = ('recipient', 'message', 'time_stamp')
+	list_select_related = ('recipient',)
+	search_fields = ('message',)
 
 class UserAdmin(admin.ModelAdmin):
 	list_display = ('first_name', 'last_name')
@@ -15,5 +32,9 @@ admin.site.register(UserProfile, UserAdmin)
 admin.site.register(Trip, TripAdmin) 
 admin.site.register(Comment)
 admin.site.register(Notification)
+admin.site.register(Waitlist)
+admin.site.register(LotteryEntry)
+admin.site.register(ArchivedComment, ArchivedCommentAdmin)
+admin.site.register(ArchivedNotification, ArchivedNotificationAdmin)
 
 admin.site.site_header = 'UMOC Administration'
\ No newline at end of file
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class UmocConfig(AppConfig):
     name = 'umoc'
+
+    def ready(self):
+        # connect signal handlers
+        from . import signals
@@ -0,0 +1,52 @@
+"""
+Moves old rows out of the tables read on every page, so they (and their indexes) stay small. Run by the archive_old_data command.
+Dismissed notifications move to ArchivedNotification, which is only shown in the admin. All comments on a trip that ended long ago move to ArchivedComment at once, and the trip's comment section is then served from there (see get_comment_model in views.py).
+Rows keep their ids, so links to comments and thread paths stay valid.
+"""
+from django.db import transaction
+from datetime import datetime, timezone
+
+from .caching import bump_trips_version
+from .models import Trip, Comment, Notification, ArchivedComment, ArchivedNotification
+
+
+# most rows copied and deleted by one statement
+ARCHIVE_BATCH_SIZE = 500
+
+NOTIFICATION_FIELDS = ['id', 'recipient_id', 'message', 'seen', 'link', 'time_stamp', 'kind', 'count', 'actors']
+COMMENT_FIELDS = ['id', 'author_id', 'parent_id', 'text', 'time_stamp', 'trip_id', 'depth', 'path']
+
+
+def archive_notifications(before, batch_size=ARCHIVE_BATCH_SIZE):
+	"""
+	Moves up to batch_size notifications dismissed before the given datetime to ArchivedNotification, in one transaction. Returns the number moved: call again until it returns 0.
+	"""
+	with transaction.atomic():
+		rows = list(Notification.objects.filter(dismissed=True, time_stamp__lt=before).order_by('id').values(*NOTIFICATION_FIELDS)[:batch_size])
+		ArchivedNotification.objects.bulk_create([ArchivedNotification(**row) for row in rows])
+		Notification.objects.filter(id__in=[row['id'] for row in rows]).delete()
+	return len(rows)
+
+
+def archive_trip_comments(trip, batch_size=ARCHIVE_BATCH_SIZE):
+	"""
+	Moves all comments on the given Trip to ArchivedComment and marks the trip's comments archived, in one transaction so its comment section is never shown half moved. Rows are moved batch_size at a time, newest first, so replies always leave before their parents (deleting a parent would unlink them). Returns the number moved.
+	"""
+	moved = 0
+	with transaction.atomic():
+		# mark first, so comments can't be added while the old ones are moved
+		if not Trip.objects.filter(pk=trip.pk, comments_archived=False).update(comments_archived=True, updated_at=datetime.now(timezone.utc)):
+			return 0
+		trip.comments_archived = True
+		# trip pages say when comments are archived
+		bump_trips_version()
+		
+		while True:
+			rows = list(Comment.objects.filter(trip_id=trip.pk).order_by('-id').values(*COMMENT_FIELDS)[:batch_size])
+			if not rows:
+				break
+			# a reply may point at a parent archived in a later batch. Foreign keys are only checked when the transaction commits
+			ArchivedComment.objects.bulk_create([ArchivedComment(**row) for row in rows])
+			Comment.objects.filter(id__in=[row['id'] for row in rows]).delete()
+			moved += len(rows)
+	return moved
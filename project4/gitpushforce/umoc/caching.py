@@ -0,0 +1,128 @@
+"""
+Caching of pages and page fragments that show trips. Everything cached here is keyed on the trips version, which bump_trips_version() changes whenever a Trip, its roster or a user's name changes (see the handlers in signals.py), so a cancellation or a filled seat shows up on the next request instead of when the cache expires.
+Logged-out visitors all see the same HTML, so cache_anonymous_page serves them whole pages from the cache. Logged-in users always get a freshly rendered page, with their own navbar, buttons and notifications, and the trip list entries in dashboard.html are cached as fragments for them instead.
+"""
+from functools import wraps
+import re
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+
+
+# cache key of the trips version
+TRIPS_VERSION_KEY = 'umoc:trips:version'
+# cache key of the trip names version, which only changes when a trip is created, renamed or deleted
+TRIP_NAMES_VERSION_KEY = 'umoc:trips:names:version'
+# seconds a page stays cached. Pages also change with time alone (upcoming trips start, lotteries close), which no version change catches
+PAGE_CACHE_TIMEOUT = 60
+# seconds a cached count stays marked as changed after a change found it missing (see adjust_cached_count). Longer than counting it takes
+COUNT_CHANGED_TIMEOUT = 10
+# stands in for the CSRF token in cached pages, so each visitor gets their own
+CSRF_PLACEHOLDER = '__umoc_csrf_token__'
+CSRF_TOKEN_PATTERN = re.compile(r'name="csrfmiddlewaretoken" value="([^"]+)"')
+
+
+def get_version(key):
+	"""
+	Returns the version cached under the given key, a string that changes whenever bump_version() is called with that key. If it was evicted from the cache, starts a new one, which can't match any older version.
+	"""
+	version = cache.get(key)
+	if version is None:
+		cache.add(key, str(time.time()), None)
+		version = cache.get(key)
+	return version
+
+
+# once the current transaction commits, changes the version cached under the given key
+def bump_version(key):
+	transaction.on_commit(lambda: cache.set(key, str(time.time()), None))
+
+
+# returns the current trips version, which changes whenever anything shown about trips does
+def get_trips_version():
+	return get_version(TRIPS_VERSION_KEY)
+
+
+# once the current transaction commits, changes the trips version, so every cached page and fragment showing trips is rendered again
+def bump_trips_version():
+	bump_version(TRIPS_VERSION_KEY)
+
+
+# returns the current trip names version, which changes whenever the set of trip names might
+def get_trip_names_version():
+	return get_version(TRIP_NAMES_VERSION_KEY)
+
+
+# once the current transaction commits, changes the trip names version, so every process rebuilds its autocomplete index (see search.py)
+def bump_trip_names_version():
+	bump_version(TRIP_NAMES_VERSION_KEY)
+
+
+# returns cache key of the page at given path for the current trips version
+def page_cache_key(path):
+	return 'umoc:page:{}:{}'.format(get_trips_version(), path)
+
+
+def cache_anonymous_page(view):
+	"""
+	Decorator serving the view's page to logged-out visitors from the cache, for up to PAGE_CACHE_TIMEOUT or until the trips version changes. Only successful GET responses are cached. The CSRF token of the navbar's login form is replaced with the visitor's own each time the page is served.
+	"""
+	@wraps(view)
+	def wrapper(request, *args, **kwargs):
+		if request.method != 'GET' or request.user.is_authenticated:
+			return view(request, *args, **kwargs)
+
+		key = page_cache_key(request.get_full_path())
+		content = cache.get(key)
+		if content is None:
+			response = view(request, *args, **kwargs)
+			if response.status_code != 200 or response.streaming:
+				return response
+			content = response.content.decode(response.charset)
+			match = CSRF_TOKEN_PATTERN.search(content)
+			if match:
+				content = content.replace(match.group(1), CSRF_PLACEHOLDER)
+			cache.set(key, content, PAGE_CACHE_TIMEOUT)
+
+		return HttpResponse(content.replace(CSRF_PLACEHOLDER, get_token(request)))
+	return wrapper
+
+
+# returns cache key of the mark left on the count cached under key when a change found it missing
+def count_changed_key(key):
+	return key + ':changed'
+
+
+def add_cached_count(key, count, timeout):
+	"""
+	Caches count, just computed from the database, under key for timeout seconds, unless a count was cached (and maybe adjusted) in the meantime. If a change found the count missing or dropped it while it was computed (see adjust_cached_count and drop_cached_count), it may have been missed, so nothing is cached and the count is computed again when next asked for.
+	"""
+	cache.add(key, count, timeout)
+	# checked after adding, as drop_cached_count marks the count before dropping it
+	if cache.get(count_changed_key(key)):
+		cache.delete(key)
+
+
+def adjust_cached_count(key, change):
+	"""
+	Adds change to the count cached under key. Call it once the change has committed. If the count isn't cached, one being computed may not include the change, so marks it changed and drops any count cached since, which add_cached_count won't keep either.
+	"""
+	try:
+		if change > 0:
+			cache.incr(key, change)
+		elif change < 0:
+			cache.decr(key, -change)
+	except ValueError:
+		# not cached
+		drop_cached_count(key)
+
+
+def drop_cached_count(key):
+	"""
+	Drops the count cached under key, so it is computed again when next asked for. Marks it changed first, so a count being computed right now, which may not include the change, isn't kept by add_cached_count either.
+	"""
+	cache.set(count_changed_key(key), True, COUNT_CHANGED_TIMEOUT)
+	cache.delete(key)
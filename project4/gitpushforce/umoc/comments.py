@@ -0,0 +1,64 @@
+"""
+Threads of trip comments, as rendered by trip_comments.html. Shared by the comment views and the comment event stream (see signals.py), which render new comments the same way.
+"""
+from django.template.loader import render_to_string
+
+
+class ProcessedComment:
+	# initialize with a Comment var. Comment's author should already be loaded (select_related)
+	def __init__(self, comment, parent=None):
+		self.id = comment.id
+		self.author = comment.author
+		self.text = comment.text
+		self.time_stamp = comment.time_stamp
+		self.depth = comment.depth
+		self.path = comment.path
+		self.href = comment.author.get_absolute_url() if comment.author else ''
+		self.replies = []
+		self.parent = parent
+		# set on the last comment shown in a thread when more of the thread can be loaded: id of the comment whose thread it is
+		self.more_replies = None
+		
+	def get_padding(self):
+		return self.depth * 30
+		
+	def __repr__(self):
+		return 'ProcessedComment(id="{}", author="{}", text="{}", time_stamp="{}". {} replies'.format(self.id, self.author, self.text, self.time_stamp, len(self.replies))
+
+
+def build_comment_threads(comments):
+	"""
+	Takes an iterable of Comments in thread-path order (which is also rendering order) and returns the matching list of ProcessedComments, with each reply linked to its parent. Runs in one linear pass.
+	"""
+	# map id->ProcessedComment
+	processed_comments = {}
+	ordered_comments = []
+	
+	for comment in comments:
+		# create ProcessedComment wrapper and add to dictionary
+		processed = ProcessedComment(comment)
+		processed_comments[comment.id] = processed
+		ordered_comments.append(processed)
+		
+		# use parent_id so the parent row is never fetched. Parent always comes before its replies in path order
+		parent = processed_comments.get(comment.parent_id) if comment.parent_id else None
+		if parent:
+			processed.parent = parent
+			parent.replies.append(processed)
+		elif comment.parent_id:
+			# parent was rendered in an earlier page. Requires parent__author to be selected with the comment
+			processed.parent = ProcessedComment(comment.parent)
+			
+	return ordered_comments
+
+
+def serialize_comment(processed):
+	"""
+	Returns a dict describing a single new ProcessedComment for live updates: its 'id', 'parent' (id, or 0 if top-level), thread 'path' and rendered 'html'. Used by trip_comments 'since' requests and the comment event stream.
+	"""
+	return {
+		'id': processed.id,
+		'parent': processed.parent.id if processed.parent else 0,
+		'path': processed.path,
+		'html': render_to_string('trip_comments.html', {'comments': [processed]}),
+	}
@@ -0,0 +1,86 @@
+"""
+Conditional GETs of trip pages. Each page's ETag and Last-Modified are worked out from Trip.updated_at with one indexed lookup, so a browser or proxy that already has the current page gets a 304 without the view loading anything or rendering its template.
+Besides updated_at, an ETag covers the trips version (see caching.py), which changes when trips are deleted or users renamed, and the requesting user, since logged-in users each get their own page.
+"""
+from calendar import timegm
+from functools import wraps
+import hashlib
+
+from django.core.cache import cache
+from django.db.models import Max
+from django.utils.cache import get_conditional_response, patch_cache_control, quote_etag
+from django.utils.http import http_date
+from datetime import datetime, timezone
+
+from .caching import get_trips_version
+from .models import Trip
+
+
+# seconds the start time of the next trip stays cached
+NEXT_START_TIMEOUT = 24 * 60 * 60
+
+
+def conditional_page(get_state):
+	"""
+	Decorator answering GET and HEAD requests with a 304 when the page hasn't changed since the client's copy. Responses are marked no-cache, so clients ask again each time instead of reusing their copy unchecked. get_state(request, *args, **kwargs) is given the view's arguments, and returns (when the page last changed, tuple of anything else the page depends on), or None to always run the view (e.g. to let it 404).
+	"""
+	def decorator(view):
+		@wraps(view)
+		def wrapper(request, *args, **kwargs):
+			if request.method not in ('GET', 'HEAD'):
+				return view(request, *args, **kwargs)
+			state = get_state(request, *args, **kwargs)
+			if state is None:
+				return view(request, *args, **kwargs)
+				
+			updated_at, extra = state
+			user = request.user.pk if request.user.is_authenticated else 0
+			etag = quote_etag(hashlib.md5(repr((updated_at, extra, get_trips_version(), user)).encode()).hexdigest())
+			last_modified = timegm(updated_at.utctimetuple()) if updated_at else None
+			
+			response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+			if response is None:
+				response = view(request, *args, **kwargs)
+			if response.status_code in (200, 304):
+				response['ETag'] = etag
+				if last_modified:
+					response['Last-Modified'] = http_date(last_modified)
+				# revalidate every time, rather than let browsers guess how long the page stays fresh. Logged-in users' pages are their own, so shared caches mustn't keep them
+				if request.user.is_authenticated:
+					patch_cache_control(response, no_cache=True, private=True)
+				else:
+					patch_cache_control(response, no_cache=True)
+			return response
+		return wrapper
+	return decorator
+
+
+def get_next_start():
+	"""
+	Returns the start time of the next trip to start, or None if there is none. Cached until that trip starts or the trips version changes, so it is usually found without a query.
+	"""
+	key = 'umoc:trips:next_start:{}'.format(get_trips_version())
+	now = datetime.now(timezone.utc)
+	next_start = cache.get(key)
+	if next_start is None or (next_start and next_start < now):
+		next_start = Trip.objects.filter(start_time__gte=now).order_by('start_time').values_list('start_time', flat=True).first() or ''
+		cache.set(key, next_start, NEXT_START_TIMEOUT)
+	return next_start or None
+
+
+# state of the dashboard: when any trip last changed, and the next trip to start, which leaves the dashboard when it does
+def get_dashboard_state(request):
+	return Trip.objects.aggregate(updated_at=Max('updated_at'))['updated_at'], (get_next_start(),)
+	
+	
+# state of the list of all trips: when any trip last changed
+def get_all_trips_state(request):
+	return Trip.objects.aggregate(updated_at=Max('updated_at'))['updated_at'], ()
+	
+	
+# state of the page of the trip of given id: when it last changed, and whether it is over and its lottery open, which change with time alone. None if the trip doesn't exist
+def get_trip_state(request, pk):
+	trip = Trip.objects.filter(pk=pk).only('updated_at', 'end_time', 'lottery_closes', 'lottery_drawn').first()
+	if trip is None:
+		return None
+	return trip.updated_at, (trip.is_over(), trip.is_lottery_open())
@@ -0,0 +1,66 @@
+"""
+In-process publish/subscribe used to push server-sent events to open pages. Event streams (see umoc.streams) subscribe to a channel and wait on a queue, and any thread in the same process can publish to it. There is no external broker, so events only reach streams served by the process that published them: run the ASGI application as a single process.
+"""
+import asyncio
+import threading
+from collections import defaultdict
+
+
+# most events held for one subscriber before newer ones are dropped (the page reloads what it missed when it reconnects)
+SUBSCRIBER_QUEUE_SIZE = 100
+
+
+# returns name of channel carrying new notifications for the UserProfile of given id
+def notification_channel(profile_id):
+	return 'notifications:{}'.format(profile_id)
+
+
+# returns name of channel carrying new comments on the Trip of given id
+def comment_channel(trip_id):
+	return 'comments:{}'.format(trip_id)
+
+
+# puts item on queue, dropping it if the subscriber has fallen too far behind. Runs on the queue's event loop
+def offer(queue, item):
+	try:
+		queue.put_nowait(item)
+	except asyncio.QueueFull:
+		pass
+
+
+class EventBroker:
+	"""
+	Maps channel names to the queues of the streams subscribed to them. subscribe() and unsubscribe() must be called from a running event loop. publish() is thread-safe and may be called from anywhere, e.g. a view running in a worker thread.
+	"""
+	def __init__(self):
+		# channel->set of (event loop, asyncio.Queue)
+		self.subscribers = defaultdict(set)
+		self.lock = threading.Lock()
+
+	# returns a new queue that receives (event, data) tuples published to channel
+	def subscribe(self, channel):
+		queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+		with self.lock:
+			self.subscribers[channel].add((asyncio.get_event_loop(), queue))
+		return queue
+
+	def unsubscribe(self, channel, queue):
+		with self.lock:
+			self.subscribers[channel].discard((asyncio.get_event_loop(), queue))
+			if not self.subscribers[channel]:
+				del self.subscribers[channel]
+
+	# returns whether anything is listening on channel, so publishers can skip building events nobody will see
+	def has_subscribers(self, channel):
+		return channel in self.subscribers
+
+	# sends event with given name and data (a string) to every queue subscribed to channel
+	def publish(self, channel, event, data):
+		with self.lock:
+			subscribers = list(self.subscribers.get(channel, ()))
+		for loop, queue in subscribers:
+			loop.call_soon_threadsafe(offer, queue, (event, data))
+
+
+# broker shared by the whole process
+broker = EventBroker()
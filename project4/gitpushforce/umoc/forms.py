@@ -29,10 +29,11 @@ class AdminTripForm(ModelForm):
 	start_time = forms.DateTimeField(input_formats=['%Y-%m-%d %I:%M %p'], help_text='Select Start Date/Time of the Trip. Format: year-month-day hour:minute am/pm. Example: 2019-02-16 2:30 pm', error_messages={'required': 'Please enter a date'})
 	end_time = forms.DateTimeField(input_formats=['%Y-%m-%d %I:%M %p'], help_text='Select End Date/Time of the Trip. Format: year-month-day hour:minute am/pm. Example: 2019-02-16 3:30 pm', error_messages={'required': 'Please enter a date'})
 	leader = forms.ModelChoiceField(queryset=UserProfile.objects.filter(admin_level='l'), help_text='Select a user to be in charge of organizing and leading this trip', error_messages={'required': 'Please enter the leader\'s name'})
+	lottery_closes = forms.DateTimeField(required=False, input_formats=['%Y-%m-%d %I:%M %p'], help_text='Optional. For popular trips, select when the sign-up lottery closes: users enter until then, and seats are drawn at random. Format: year-month-day hour:minute am/pm. Leave blank for first-come sign-up')
 	
 	class Meta:
 		model = Trip
-		fields = ('name', 'description', 'capacity', 'start_time', 'end_time', 'tag', 'leader')
+		fields = ('name', 'description', 'capacity', 'start_time', 'end_time', 'tag', 'leader', 'lottery_closes')
 
 class AdminUpdateTripForm(ModelForm):
 	name = forms.CharField(max_length=20, help_text='Enter Trip Name', error_messages={'required': 'Please enter your name'})
@@ -42,10 +43,11 @@ class AdminUpdateTripForm(ModelForm):
 	start_time = forms.DateTimeField(input_formats=['%Y-%m-%d %I:%M %p'], help_text='Select Start Date/Time of the Trip. Format: year-month-day hour:minute am/pm. Example: 2019-02-16 2:30 pm', error_messages={'required': 'Please enter a date'})
 	end_time = forms.DateTimeField(input_formats=['%Y-%m-%d %I:%M %p'], help_text='Select End Date/Time of the Trip. Format: year-month-day hour:minute am/pm. Example: 2019-02-16 3:30 pm', error_messages={'required': 'Please enter a date'})
 	leader = forms.ModelChoiceField(queryset=UserProfile.objects.filter(admin_level='l'), help_text='Select a user to be in charge of organizing and leading this trip', error_messages={'required': 'Please enter the leader\'s name'})
+	lottery_closes = forms.DateTimeField(required=False, input_formats=['%Y-%m-%d %I:%M %p'], help_text='Optional. For popular trips, select when the sign-up lottery closes: users enter until then, and seats are drawn at random. Format: year-month-day hour:minute am/pm. Leave blank for first-come sign-up')
 	
 	class Meta:
 		model = Trip
-		fields = ('name', 'description', 'capacity', 'start_time', 'end_time', 'tag', 'leader')
+		fields = ('name', 'description', 'capacity', 'start_time', 'end_time', 'tag', 'leader', 'lottery_closes')
 	
 	def __init__(self, *args, **kwargs):
 		self.trip = kwargs.pop('trip', None)
@@ -61,13 +63,28 @@ class AdminUpdateTripForm(ModelForm):
 			self._errors['no_trip'] = 'The trip does not exist.'
 			return False
 		
-		if self.trip.num_seats - self.trip.capacity + self.cleaned_data.get('capacity') < 0:
+		if self.cleaned_data.get('capacity') < self.trip.participant_count:
 			self.add_error('capacity', 'Error. Please enter a new capacity that is larger than or equal to the number of participants.')
 			return False
 		
 		return True
 
 
+class TripFinderForm(forms.Form):
+	CANCELLED_CHOICES = (
+		('', 'Any'),
+		('no', 'Not Cancelled'),
+		('yes', 'Cancelled'),
+	)
+	
+	tag = forms.ChoiceField(required=False, choices=(('', 'Any'),) + Trip.TAG_CHOICES, help_text='Optional. Select the kind of trip')
+	start = forms.DateField(required=False, help_text='Optional. Only show trips starting on or after this date (yyyy-mm-dd). Leave blank for upcoming trips')
+	end = forms.DateField(required=False, help_text='Optional. Only show trips starting on or before this date (yyyy-mm-dd)')
+	leader = forms.ModelChoiceField(required=False, queryset=UserProfile.objects.filter(admin_level__in=['a', 'l']), help_text='Optional. Select the trip leader')
+	cancelled = forms.ChoiceField(required=False, choices=CANCELLED_CHOICES)
+	seats = forms.BooleanField(required=False, help_text='Only show trips with seats remaining')
+
+
 class UpdateProfileForm(forms.Form):
 	first_name = forms.CharField(max_length=30, help_text='Required. Please enter your first name.')
 	last_name = forms.CharField(max_length=30, help_text='Required. Please enter your last name.')
@@ -77,6 +94,7 @@ class UpdateProfileForm(forms.Form):
 	profile_image = forms.ImageField(required=False, help_text='Optional. Please select a new profile picture.')
 	contact_name = forms.RegexField(regex=r'^[A-Z][a-z]+ [A-Z][a-z]+$', help_text='Required. Please enter your contact\'s first and last name.', error_messages={'invalid': 'Please enter a valid first and last name.'})
 	contact_number = forms.RegexField(regex=r'^\d{10}$', help_text='Required. Please enter your contact\'s phone number (ten digits only).', error_messages={'invalid': 'Please enter a valid phone number.'})
+	notification_digest = forms.BooleanField(required=False, label='Daily digest', help_text='Optional. Email me one daily digest of my notifications instead of each as it arrives.')
 
 
 class WaiverForm(forms.Form):
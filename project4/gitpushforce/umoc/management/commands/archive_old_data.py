@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from datetime import datetime, timezone, timedelta
+
+from umoc.archive import archive_notifications, archive_trip_comments, ARCHIVE_BATCH_SIZE
+from umoc.models import Trip
+
+
+class Command(BaseCommand):
+	help = 'Moves dismissed notifications, and comments on trips that ended long ago, to the archive tables. Run it regularly, e.g. nightly from cron.'
+	
+	def add_arguments(self, parser):
+		parser.add_argument('--notification-days', type=int, default=30, help='Archive notifications dismissed and sent more than this many days ago')
+		parser.add_argument('--trip-days', type=int, default=365, help='Archive comments on trips that ended more than this many days ago')
+		parser.add_argument('--batch-size', type=int, default=ARCHIVE_BATCH_SIZE, help='Most rows moved by one statement')
+		
+	def handle(self, *args, **options):
+		now = datetime.now(timezone.utc)
+		
+		notifications = 0
+		before = now - timedelta(days=options['notification_days'])
+		while True:
+			moved = archive_notifications(before, options['batch_size'])
+			if not moved:
+				break
+			notifications += moved
+		self.stdout.write('Archived {} notifications'.format(notifications))
+		
+		comments = 0
+		trips = Trip.objects.filter(comments_archived=False, end_time__lt=now - timedelta(days=options['trip_days']))
+		# load the trips first: SQLite can't reliably iterate over a table while it is written to
+		for trip in list(trips):
+			comments += archive_trip_comments(trip, options['batch_size'])
+		self.stdout.write('Archived {} comments'.format(comments))
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from itertools import cycle, islice
+import time
+
+from umoc.models import UserProfile, Notification
+from umoc.notifications import notify
+
+
+class Command(BaseCommand):
+	help = 'Compares the per-recipient cost of saving notifications one at a time with umoc.notifications.notify(). Both are timed inside a transaction that is rolled back, so it is safe to run against a live database (and save() each leaves out the commit every save makes in a view).'
+	
+	def add_arguments(self, parser):
+		parser.add_argument('--recipients', type=int, nargs='*', default=[1, 10, 60, 500], help='Numbers of recipients to notify')
+		
+	def handle(self, *args, **options):
+		profile_ids = list(UserProfile.objects.values_list('id', flat=True))
+		if not profile_ids:
+			raise CommandError('Needs at least one UserProfile to send notifications to')
+			
+		self.stdout.write('{:>10}  {:>22}  {:>22}'.format('recipients', 'save() each', 'notify()'))
+		for count in options['recipients']:
+			recipient_ids = list(islice(cycle(profile_ids), count))
+			self.stdout.write('{:>10}  {:>22}  {:>22}'.format(count, self.measure(self.save_each, recipient_ids), self.measure(self.fan_out, recipient_ids)))
+			
+	def save_each(self, recipient_ids):
+		for recipient_id in recipient_ids:
+			Notification(recipient_id=recipient_id, message='Benchmark').save()
+			
+	def fan_out(self, recipient_ids):
+		notify(recipient_ids, 'Benchmark')
+		
+	# runs send(recipient_ids) in a transaction that is then rolled back, returning the time and queries per recipient as text
+	def measure(self, send, recipient_ids):
+		with transaction.atomic():
+			with CaptureQueriesContext(connection) as queries:
+				start = time.perf_counter()
+				send(recipient_ids)
+				elapsed = time.perf_counter() - start
+			transaction.set_rollback(True)
+		return '{:.3f} ms, {:.2f} queries'.format(elapsed * 1000 / len(recipient_ids), len(queries) / len(recipient_ids))
@@ -0,0 +1,62 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from datetime import datetime, timezone, timedelta
+import random
+import time
+
+from umoc.models import Trip
+from umoc.search import search_available, search_trip_ids, filter_icontains, SEARCH_LIMIT
+
+
+# searched-for places, each in one trip in RARITY. Other trips are named from a made-up vocabulary
+PLACES = ['Old Rag', 'Seneca Rocks', 'Mount Washington', 'Quabbin Reservoir', 'Franconia Ridge']
+RARITY = 1000
+ACTIVITIES = ['hike', 'climb', 'paddle', 'ski trip', 'bike ride', 'cabin weekend']
+SYLLABLES = ['ka', 'lo', 'mi', 'ne', 'ru', 'sa', 'to', 'vi', 'da', 'fe', 'go', 'hu']
+
+
+class Command(BaseCommand):
+	help = 'Compares trip search with the full-text index against icontains scans of name and description. Adds the given number of generated trips inside a transaction that is rolled back, so it is safe to run against a live database.'
+	
+	def add_arguments(self, parser):
+		parser.add_argument('--trips', type=int, default=100000, help='Number of trips to generate')
+		parser.add_argument('--queries', nargs='*', default=['Old Rag', 'Seneca Rocks', 'Franc', 'hike', 'kalo'], help='Searches to time')
+		parser.add_argument('--repeat', type=int, default=5, help='Times each search is run')
+		
+	def handle(self, *args, **options):
+		if not search_available():
+			raise CommandError('Trip search uses an FTS5 table, which needs SQLite')
+			
+		with transaction.atomic():
+			start = time.perf_counter()
+			self.add_trips(options['trips'])
+			self.stdout.write('Added {} trips in {:.1f} s'.format(options['trips'], time.perf_counter() - start))
+			
+			self.stdout.write('{:>20}  {:>16}  {:>16}'.format('search', 'full-text', 'icontains'))
+			for query in options['queries']:
+				indexed = self.measure(lambda: search_trip_ids(query), options['repeat'])
+				scanned = self.measure(lambda: list(Trip.objects.filter(filter_icontains(query)).order_by('-start_time').values_list('id', flat=True)[:SEARCH_LIMIT]), options['repeat'])
+				self.stdout.write('{:>20}  {:>16}  {:>16}'.format(query, indexed, scanned))
+			transaction.set_rollback(True)
+			
+	# adds n trips with names and descriptions made up of ACTIVITIES and words of SYLLABLES, one in RARITY of them at one of PLACES
+	def add_trips(self, n):
+		rng = random.Random(0)
+		vocabulary = [a + b + c for a in SYLLABLES for b in SYLLABLES for c in SYLLABLES]
+		start_time = datetime.now(timezone.utc)
+		Trip.objects.bulk_create((
+			Trip(
+				name='{} {}'.format(rng.choice(PLACES) if rng.randrange(RARITY) == 0 else rng.choice(vocabulary).title(), rng.choice(ACTIVITIES)),
+				description=' '.join(rng.choice(vocabulary) for i in range(30)),
+				capacity=10, num_seats=10,
+				start_time=start_time + timedelta(hours=i), end_time=start_time + timedelta(hours=i + 4),
+			)
+			for i in range(n)
+		), batch_size=500)
+		
+	# runs search repeat times, returning the mean time per search as text
+	def measure(self, search, repeat):
+		start = time.perf_counter()
+		for i in range(repeat):
+			search()
+		return '{:.2f} ms'.format((time.perf_counter() - start) * 1000 / repeat)
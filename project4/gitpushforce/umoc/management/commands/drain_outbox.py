@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from django.db import OperationalError
+import time
+
+from umoc.notifications import deliver_queued_notifications, OUTBOX_BATCH_SIZE
+
+
+class Command(BaseCommand):
+	help = 'Delivers notifications queued in the outbox, in batches. Delivers everything queued and exits, or with --loop keeps waiting for more.'
+	
+	def add_arguments(self, parser):
+		parser.add_argument('--batch-size', type=int, default=OUTBOX_BATCH_SIZE, help='Most queued notifications delivered in one transaction')
+		parser.add_argument('--loop', action='store_true', help='Keep running, checking for newly queued notifications')
+		parser.add_argument('--interval', type=float, default=1, help='Seconds to wait before checking again once the outbox is empty (with --loop)')
+		
+	def handle(self, *args, **options):
+		delivered = 0
+		while True:
+			try:
+				count = deliver_queued_notifications(options['batch_size'])
+			except OperationalError as error:
+				# e.g. SQLite's 'database is locked' while the site is busy: try again shortly
+				self.stderr.write('Could not deliver notifications: {}'.format(error))
+				count = 0
+			delivered += count
+			
+			if count:
+				continue
+			elif not options['loop']:
+				break
+			time.sleep(options['interval'])
+			
+		self.stdout.write('Delivered {} queued notifications'.format(delivered))
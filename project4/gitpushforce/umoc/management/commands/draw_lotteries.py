@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from datetime import datetime, timezone
+
+from umoc.models import Trip
+
+
+class Command(BaseCommand):
+	help = 'Draws the sign-up lottery of every uncancelled trip whose entry window has closed. Run it regularly, e.g. every few minutes from cron.'
+	
+	def add_arguments(self, parser):
+		parser.add_argument('--seed', default='0', help='Seed for the random draw. The same seed always draws the same winners from the same entries')
+		parser.add_argument('--trip', type=int, nargs='*', help='Only draw the trips with these ids')
+		
+	def handle(self, *args, **options):
+		trips = Trip.objects.filter(lottery_drawn=False, cancelled=False, lottery_closes__lte=datetime.now(timezone.utc)).order_by('lottery_closes')
+		if options['trip']:
+			trips = trips.filter(pk__in=options['trip'])
+			
+		for trip in trips:
+			result = trip.draw_lottery(options['seed'])
+			if result is not None:
+				self.stdout.write('{}: {} signed up, {} waitlisted'.format(trip.name, *result))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from umoc.search import search_available, create_search_table
+
+
+class Command(BaseCommand):
+	help = 'Recreates the full-text index of trips and the triggers keeping it in sync, then reindexes every trip. Run it after a migration rebuilds the umoc_trip table, or if search results look out of date. SQLite only.'
+	
+	def handle(self, *args, **options):
+		if not search_available():
+			raise CommandError('Trip search uses an FTS5 table, which needs SQLite')
+		with transaction.atomic():
+			create_search_table()
+		self.stdout.write('Reindexed trips')
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+
+from umoc.notifications import send_digests
+
+
+class Command(BaseCommand):
+	help = 'Emails the daily digest of notifications to every user who chose one. Run it once a day, e.g. from cron.'
+	
+	def handle(self, *args, **options):
+		self.stdout.write('Sent {} digests'.format(send_digests()))
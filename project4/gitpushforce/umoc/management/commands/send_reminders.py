@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from django.db import OperationalError
+import time
+
+from umoc.reminders import send_trip_reminders, REMINDER_HOURS
+
+
+class Command(BaseCommand):
+	help = 'Reminds participants and drivers of trips starting soon. Safe to run as often as you like, e.g. every few minutes from cron, or keep it running with --loop.'
+	
+	def add_arguments(self, parser):
+		parser.add_argument('--hours', type=int, nargs='+', default=REMINDER_HOURS, help='Reminder windows, in hours before a trip starts')
+		parser.add_argument('--loop', action='store_true', help='Keep running, checking for trips to remind users of')
+		parser.add_argument('--interval', type=float, default=300, help='Seconds between checks (with --loop)')
+		
+	def handle(self, *args, **options):
+		while True:
+			try:
+				self.stdout.write('Reminded {} users of upcoming trips'.format(send_trip_reminders(reminder_hours=options['hours'])))
+			except OperationalError as error:
+				# e.g. SQLite's 'database is locked' while the site is busy: the next run sends what this one didn't
+				self.stderr.write('Could not send reminders: {}'.format(error))
+				
+			if not options['loop']:
+				break
+			time.sleep(options['interval'])
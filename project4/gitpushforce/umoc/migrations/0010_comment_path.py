@@ -0,0 +1,22 @@
+# Generated by Django 2.2.28 on 2026-10-18 10:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('umoc', '0009_auto_20180429_2235'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='path',
+            field=models.CharField(blank=True, editable=False, max_length=255),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['trip', 'path'], name='umoc_comment_trip_path_idx'),
+        ),
+    ]
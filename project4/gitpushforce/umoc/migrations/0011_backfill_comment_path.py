@@ -0,0 +1,45 @@
+# Generated by Django 2.2.28 on 2026-10-18 10:35
+
+from django.db import migrations
+
+# must match umoc.models.COMMENT_PATH_STEP at the time of this migration
+COMMENT_PATH_STEP = 10
+# most comments written by one UPDATE. Each takes two parameters, and SQLite allows 999 per statement
+BACKFILL_BATCH_SIZE = 400
+
+
+def backfill_comment_paths(apps, schema_editor):
+    """
+    Fills in the thread path of every existing comment. Comments are visited in order of depth, so a
+    comment's parent normally has its path computed first. Older comments were given a default depth,
+    so any comment whose parent hasn't been reached yet is deferred to a later pass. The paths are
+    written with batched UPDATEs once they are all known.
+    """
+    Comment = apps.get_model('umoc', 'Comment')
+    pending = list(Comment.objects.order_by('depth', 'id').values_list('id', 'parent_id'))
+    existing = {comment_id for comment_id, _ in pending}
+    paths = {}
+    while pending:
+        deferred = []
+        for comment_id, parent_id in pending:
+            if parent_id in existing and parent_id not in paths:
+                deferred.append((comment_id, parent_id))
+                continue
+            # comments whose parent was deleted become top-level
+            paths[comment_id] = '{}{:0{}d}'.format(paths.get(parent_id, ''), comment_id, COMMENT_PATH_STEP)
+        if len(deferred) == len(pending):
+            # parent links form a cycle; break it by making the remaining comments top-level
+            existing.difference_update(comment_id for comment_id, _ in deferred)
+        pending = deferred
+    Comment.objects.bulk_update([Comment(pk=comment_id, path=path) for comment_id, path in paths.items()], ['path'], batch_size=BACKFILL_BATCH_SIZE)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('umoc', '0010_comment_path'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_comment_paths, migrations.RunPython.noop),
+    ]
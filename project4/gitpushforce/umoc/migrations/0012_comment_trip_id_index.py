@@ -0,0 +1,17 @@
+# Generated by Django 2.2.28 on 2026-10-18 10:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('umoc', '0011_backfill_comment_path'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['trip', 'id'], name='umoc_comment_trip_id_idx'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 2.2.28 on 2026-10-18 10:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('umoc', '0012_comment_trip_id_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['recipient', 'dismissed', '-time_stamp'], name='umoc_notification_active_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='trip',
+            index=models.Index(fields=['start_time'], name='umoc_trip_start_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userprofile',
+            index=models.Index(fields=['admin_level', 'last_name', 'first_name'], name='umoc_profile_admin_level_idx'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 2.2.28 on 2026-10-18 10:38
+
+from django.db import migrations, models
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
+
+
+def count_participants(apps, schema_editor):
+    """
+    Sets participant_count of every existing trip, and brings num_seats in line with it.
+    """
+    Trip = apps.get_model('umoc', 'Trip')
+    Participant = Trip.participants.through
+    count = Coalesce(Subquery(Participant.objects.filter(trip_id=OuterRef('pk')).values('trip_id').annotate(count=Count('*')).values('count'), output_field=IntegerField()), 0)
+    Trip.objects.update(participant_count=count, num_seats=Greatest(F('capacity') - count, 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('umoc', '0013_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='trip',
+            name='participant_count',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(count_participants, migrations.RunPython.noop),
+    ]
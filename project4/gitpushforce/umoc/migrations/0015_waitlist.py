@@ -0,0 +1,28 @@
+# Generated by Django 2.2.28 on 2026-10-18 10:46
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('umoc', '0014_trip_participant_count'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Waitlist',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.PositiveIntegerField()),
+                ('time_stamp', models.DateTimeField(auto_now_add=True)),
+                ('profile', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='waitlist_entries', to='umoc.UserProfile')),
+                ('trip', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='waitlist', to='umoc.Trip')),
+            ],
+            options={
+                'ordering': ['trip', 'position'],
+                'unique_together': {('trip', 'position'), ('trip', 'profile')},
+            },
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 2.2.28 on 2026-10-18 10:48
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('umoc', '0015_waitlist'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='trip',
+            name='lottery_closes',
+            field=models.DateTimeField(blank=True, help_text='Leave blank for first-come sign-up, or select when the sign-up lottery closes', null=True),
+        ),
+        migrations.AddField(
+            model_name='trip',
+            name='lottery_drawn',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.CreateModel(
+            name='LotteryEntry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('time_stamp', models.DateTimeField(auto_now_add=True)),
+                ('profile', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lottery_entries', to='umoc.UserProfile')),
+                ('trip', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lottery_entries', to='umoc.Trip')),
+            ],
+            options={
+                'verbose_name_plural': 'lottery entries',
+                'unique_together': {('trip', 'profile')},
+            },
+        ),
+    ]
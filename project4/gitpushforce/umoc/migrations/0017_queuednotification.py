@@ -0,0 +1,26 @@
+# Generated by Django 2.2.28 on 2026-10-18 10:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('umoc', '0016_trip_lottery'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QueuedNotification',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('recipient_ids', models.TextField()),
+                ('message', models.TextField()),
+                ('link', models.URLField(blank=True, max_length=100)),
+                ('time_stamp', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['id'],
+            },
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 2.2.28 on 2026-10-18 10:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('umoc', '0017_queuednotification'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notification',
+            name='actors',
+            field=models.TextField(blank=True, default='[]'),
+        ),
+        migrations.AddField(
+            model_name='notification',
+            name='count',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='notification',
+            name='kind',
+            field=models.CharField(blank=True, max_length=10),
+        ),
+        migrations.AddField(
+            model_name='queuednotification',
+            name='actor',
+            field=models.CharField(blank=True, max_length=41),
+        ),
+        migrations.AddField(
+            model_name='queuednotification',
+            name='kind',
+            field=models.CharField(blank=True, max_length=10),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='last_digest',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='notification_digest',
+            field=models.BooleanField(default=False, help_text='Email me one daily digest of my notifications instead of each as it arrives', verbose_name='Daily Digest'),
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 2.2.28 on 2026-10-18 10:57
+
+import django.core.validators
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('umoc', '0018_notification_coalescing'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='trip',
+            name='comments_archived',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.CreateModel(
+            name='ArchivedNotification',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('message', models.TextField()),
+                ('seen', models.BooleanField(default=False)),
+                ('link', models.URLField(blank=True, max_length=100)),
+                ('time_stamp', models.DateTimeField()),
+                ('kind', models.CharField(blank=True, max_length=10)),
+                ('count', models.PositiveIntegerField(default=1)),
+                ('actors', models.TextField(blank=True, default='[]')),
+                ('recipient', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to='umoc.UserProfile')),
+            ],
+            options={
+                'ordering': ['time_stamp'],
+            },
+        ),
+        migrations.CreateModel(
+            name='ArchivedComment',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('text', models.CharField(max_length=280)),
+                ('depth', models.PositiveIntegerField(validators=[django.core.validators.MaxValueValidator(6)])),
+                ('path', models.CharField(blank=True, editable=False, max_length=255)),
+                ('time_stamp', models.DateTimeField()),
+                ('author', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to='umoc.UserProfile')),
+                ('parent', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='umoc.ArchivedComment')),
+                ('trip', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to='umoc.Trip')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='archivednotification',
+            index=models.Index(fields=['recipient', 'time_stamp'], name='umoc_archnotification_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedcomment',
+            index=models.Index(fields=['trip', 'path'], name='umoc_archcomment_path_idx'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 2.2.28 on 2026-10-18 10:58
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('umoc', '0019_archive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TripReminder',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hours', models.PositiveIntegerField()),
+                ('time_stamp', models.DateTimeField(auto_now_add=True)),
+                ('profile', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='trip_reminders', to='umoc.UserProfile')),
+                ('trip', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reminders', to='umoc.Trip')),
+            ],
+            options={
+                'unique_together': {('trip', 'profile', 'hours')},
+            },
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 2.2.28 on 2026-10-18 11:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('umoc', '0020_tripreminder'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='trip',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddIndex(
+            model_name='trip',
+            index=models.Index(fields=['updated_at'], name='umoc_trip_updated_at_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 2.2.28 on 2026-10-18 11:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('umoc', '0021_trip_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='trip',
+            index=models.Index(fields=['tag', 'start_time'], name='umoc_trip_tag_start_idx'),
+        ),
+    ]
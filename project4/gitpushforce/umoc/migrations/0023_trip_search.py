@@ -0,0 +1,46 @@
+# Creates the FTS5 table used for trip search, and the triggers keeping it in sync with umoc_trip. SQLite only: on other databases search falls back to icontains (see umoc.search)
+# The SQL is copied here rather than imported from umoc.search, so later changes to that module don't change what this migration did
+
+from django.db import migrations
+
+
+CREATE_SEARCH_TABLE = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS umoc_trip_search USING fts5(name, description, content='umoc_trip', content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+    """CREATE TRIGGER IF NOT EXISTS umoc_trip_search_insert AFTER INSERT ON umoc_trip BEGIN
+        INSERT INTO umoc_trip_search(rowid, name, description) VALUES (new.id, new.name, new.description);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS umoc_trip_search_delete AFTER DELETE ON umoc_trip BEGIN
+        INSERT INTO umoc_trip_search(umoc_trip_search, rowid, name, description) VALUES ('delete', old.id, old.name, old.description);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS umoc_trip_search_update AFTER UPDATE OF name, description ON umoc_trip BEGIN
+        INSERT INTO umoc_trip_search(umoc_trip_search, rowid, name, description) VALUES ('delete', old.id, old.name, old.description);
+        INSERT INTO umoc_trip_search(rowid, name, description) VALUES (new.id, new.name, new.description);
+    END""",
+    "INSERT INTO umoc_trip_search(umoc_trip_search) VALUES ('rebuild')",
+]
+DROP_SEARCH_TABLE = [
+    'DROP TRIGGER IF EXISTS umoc_trip_search_insert',
+    'DROP TRIGGER IF EXISTS umoc_trip_search_delete',
+    'DROP TRIGGER IF EXISTS umoc_trip_search_update',
+    'DROP TABLE IF EXISTS umoc_trip_search',
+]
+
+
+def run(statements):
+    def operation(apps, schema_editor):
+        if schema_editor.connection.vendor != 'sqlite':
+            return
+        for sql in statements:
+            schema_editor.execute(sql, params=None)
+    return operation
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('umoc', '0022_trip_tag_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(run(CREATE_SEARCH_TABLE), run(DROP_SEARCH_TABLE)),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 2.2.28 on 2026-10-18 11:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('umoc', '0023_trip_search'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='userprofile',
+            index=models.Index(fields=['last_name', 'first_name'], name='umoc_profile_name_idx'),
+        ),
+    ]
@@ -1,8 +1,14 @@
-from django.db import models
+from django.db import models, transaction, IntegrityError
+from django.db.models import F, Max, Subquery
+from django.db.models.functions import Greatest
 from django.urls import reverse
 from django.contrib.auth.models import User
 from django.core.validators import RegexValidator, MaxValueValidator
 from datetime import datetime, timezone
+import json
+import random
+
+from .caching import bump_trips_version
 
 
 # used for validating phone numbers entered (9 digits)
@@ -40,9 +46,19 @@ class UserProfile(models.Model):
 	can_comment = models.BooleanField(help_text='Set whether user can leave comments on trips', default=True)
 	can_join_trip = models.BooleanField(help_text='Allow user to sign up for trips?', default=False)
 	admin_level = models.CharField(max_length=1, choices=ADMIN_LEVELS, default='u')
+	# email one daily summary of notifications instead of each as it is delivered (see the send_digests command)
+	notification_digest = models.BooleanField(default=False, verbose_name='Daily Digest', help_text='Email me one daily digest of my notifications instead of each as it arrives')
+	# when the last digest was sent
+	last_digest = models.DateTimeField(null=True, blank=True, editable=False)
 
 	class Meta:
 		ordering = ['last_name', 'first_name', 'admin_level']	
+		indexes = [
+			# counting admins, and listing leaders in name order
+			models.Index(fields=['admin_level', 'last_name', 'first_name'], name='umoc_profile_admin_level_idx'),
+			# the admin user directory, in name order
+			models.Index(fields=['last_name', 'first_name'], name='umoc_profile_name_idx'),
+		]
     
 	def __str__(self):
 		return '{}, {}'.format(self.last_name, self.first_name)
@@ -67,11 +83,20 @@ class Trip(models.Model):
 	description = models.TextField(help_text='Enter description and informatin for trip')
 	# TODO: DEPRECATE AND REMOVE THIS FIELD.
 	num_seats = models.PositiveSmallIntegerField(verbose_name='Number of seats remaining', help_text='Enter number of seats available for the trip')
+	# number of participants, kept equal to participants.count() by add_participant() and the participants m2m_changed handler (see signals.py)
+	participant_count = models.PositiveSmallIntegerField(default=0, editable=False)
 	capacity = models.PositiveSmallIntegerField(verbose_name='Total Trip Capacity', help_text='Enter number of seats available for the trip')
 	thumbnail = models.ImageField(help_text='Upload an image to show alongside this trip')
 	start_time = models.DateTimeField(help_text='Select Start Time of the Trip')
 	end_time = models.DateTimeField(help_text='Select End Time of the Trip')
 	cancelled = models.BooleanField(default=False, help_text='Click to Cancel')
+	# if set, users enter a lottery until this time instead of joining directly, and seats are drawn by the draw_lotteries command
+	lottery_closes = models.DateTimeField(null=True, blank=True, help_text='Leave blank for first-come sign-up, or select when the sign-up lottery closes')
+	lottery_drawn = models.BooleanField(default=False, editable=False)
+	# whether this trip's comments were moved to ArchivedComment by the archive_old_data command, which makes them read-only
+	comments_archived = models.BooleanField(default=False, editable=False)
+	# when anything shown on this trip's page last changed: its fields, its roster, waitlist or lottery, or its comments. Moved forward by save() and the handlers in signals.py, and read for conditional GETs (see conditional.py)
+	updated_at = models.DateTimeField(auto_now=True)
 
 	# Allowed Tags a trip can have: code - (name, color)
 	TAGS = {
@@ -103,6 +128,14 @@ class Trip(models.Model):
 
 	class Meta:
 		ordering = ['-start_time']
+		indexes = [
+			# upcoming trips in order of start time, and trip listings by date
+			models.Index(fields=['start_time'], name='umoc_trip_start_time_idx'),
+			# when any trip last changed, for conditional GETs of trip listings
+			models.Index(fields=['updated_at'], name='umoc_trip_updated_at_idx'),
+			# Trip Finder results of one tag, in order of start time
+			models.Index(fields=['tag', 'start_time'], name='umoc_trip_tag_start_idx'),
+		]
 		
 	# return whether trip has already ended. Compares using UTC time.
 	def is_over(self):
@@ -110,7 +143,108 @@ class Trip(models.Model):
 		
 	# returns number of seats still open
 	def get_seats_remaining(self):
-		return self.capacity - len(self.participants.all())
+		return max(self.capacity - self.participant_count, 0)
+		
+	# returns whether given UserProfile is signed up for this trip. Uses the index on the participants table instead of loading the roster
+	def has_participant(self, profile):
+		return self.participants.filter(pk=profile.pk).exists()
+		
+	# signs up given UserProfile if a seat is open, returning whether they got one. The seat is claimed with a single conditional UPDATE in the same transaction as the sign-up, so concurrent sign-ups can't overbook the trip. Raises IntegrityError (and claims no seat) if the user is already signed up
+	def add_participant(self, profile):
+		with transaction.atomic():
+			claimed = Trip.objects.filter(pk=self.pk, participant_count__lt=F('capacity')).update(participant_count=F('participant_count') + 1, num_seats=F('capacity') - F('participant_count') - 1)
+			if not claimed:
+				return False
+			# insert directly rather than with participants.add(), which silently skips existing participants
+			Trip.participants.through.objects.create(trip_id=self.pk, userprofile_id=profile.pk)
+		return True
+		
+	# returns whether sign-up for this trip is by a lottery that hasn't been drawn yet. Users can't join or wait for the trip until it is
+	def is_lottery_pending(self):
+		return self.lottery_closes is not None and not self.lottery_drawn
+		
+	# returns whether users can currently enter this trip's lottery
+	def is_lottery_open(self):
+		return self.is_lottery_pending() and datetime.now(timezone.utc) < self.lottery_closes
+		
+	def draw_lottery(self, seed):
+		"""
+		Draws this trip's lottery: entrants are shuffled with a random.Random seeded from seed and the trip's id, so the same seed always gives the same draw. The first are signed up until the trip is full and the rest are put on the waitlist in drawn order, and every entrant is notified. Participants, waitlist entries and notifications are each written with one bulk insert, in one transaction. Returns (number signed up, number waitlisted), or None if the lottery was already drawn or the trip is cancelled.
+		"""
+		with transaction.atomic():
+			# claim the draw, so running it twice (or twice at once) can't sign anyone up twice. Cancelled trips are never drawn
+			if not Trip.objects.filter(pk=self.pk, lottery_drawn=False, cancelled=False).update(lottery_drawn=True):
+				return None
+			self.lottery_drawn = True
+			
+			through = Trip.participants.through
+			signed_up = set(through.objects.filter(trip_id=self.pk).values_list('userprofile_id', flat=True))
+			waiting = set(self.waitlist.values_list('profile_id', flat=True))
+			# sort before shuffling, so the draw depends only on the seed and who entered
+			entrants = [profile_id for profile_id in self.lottery_entries.order_by('profile_id').values_list('profile_id', flat=True) if profile_id not in signed_up and profile_id not in waiting]
+			random.Random('{}:{}'.format(seed, self.pk)).shuffle(entrants)
+			
+			seats = max(self.capacity - len(signed_up), 0)
+			winners, losers = entrants[:seats], entrants[seats:]
+			through.objects.bulk_create([through(trip_id=self.pk, userprofile_id=profile_id) for profile_id in winners])
+			# bulk_create skips the participants signal handlers, so count the new participants and refresh cached trip pages here
+			Trip.objects.filter(pk=self.pk).update(participant_count=F('participant_count') + len(winners), num_seats=Greatest(F('capacity') - F('participant_count') - len(winners), 0), updated_at=datetime.now(timezone.utc))
+			bump_trips_version()
+			
+			last = self.waitlist.aggregate(last=Max('position'))['last'] or 0
+			Waitlist.objects.bulk_create([Waitlist(trip=self, profile_id=profile_id, position=last + i) for i, profile_id in enumerate(losers, 1)])
+			
+			# through send_notifications, so unread counts and open pages are updated too. Imported here, as notifications.py imports this module
+			from .notifications import send_notifications, build_notification
+			link = self.get_absolute_url()
+			send_notifications(
+				[build_notification(profile_id, 'You won a seat on {} in the lottery!'.format(self.name), link) for profile_id in winners] +
+				[build_notification(profile_id, 'You are #{} on the waitlist for {} after the lottery'.format(i, self.name), link) for i, profile_id in enumerate(losers, len(waiting) + 1)]
+			)
+		return len(winners), len(losers)
+		
+	# adds given UserProfile to the end of this trip's waitlist, returning the new Waitlist entry. Raises IntegrityError if they are already on it
+	def join_waitlist(self, profile):
+		for attempt in range(3):
+			try:
+				with transaction.atomic():
+					last = self.waitlist.aggregate(last=Max('position'))['last'] or 0
+					return Waitlist.objects.create(trip=self, profile=profile, position=last + 1)
+			except IntegrityError:
+				# someone else took the same position at the same time, or profile is already waiting
+				if self.waitlist.filter(profile=profile).exists():
+					raise
+		raise IntegrityError('Could not add {} to the waitlist'.format(profile))
+		
+	# returns given UserProfile's place in this trip's waitlist (1 is next in line), or None if they aren't on it. Runs one query, counting over the (trip, position) index
+	def get_waitlist_position(self, profile):
+		own_position = self.waitlist.filter(profile=profile).values('position')
+		return self.waitlist.filter(position__lte=Subquery(own_position)).count() or None
+		
+	# moves users from the head of the waitlist into participants while seats are open, queueing one notification for all of them in the same transaction. Returns list of promoted UserProfiles, which is empty if the trip is cancelled. Each promotion runs a constant number of queries, however long the waitlist is
+	def promote_waitlist(self):
+		promoted = []
+		# nobody moves up into a cancelled trip
+		if self.cancelled:
+			return promoted
+		with transaction.atomic():
+			while True:
+				entry = self.waitlist.select_related('profile').order_by('position').first()
+				if entry is None:
+					break
+				try:
+					if not self.add_participant(entry.profile):
+						break
+				except IntegrityError:
+					# already signed up some other way: just drop them from the waitlist
+					pass
+				else:
+					promoted.append(entry.profile)
+				entry.delete()
+			# queued with one INSERT, like other notifications. Imported here, as notifications.py imports this module
+			from .notifications import enqueue_notification
+			enqueue_notification([profile.id for profile in promoted], 'A seat opened up on {}. You are now signed up!'.format(self.name), self.get_absolute_url())
+		return promoted
 		
 	# return full tag name
 	def get_tag_name(self):
@@ -128,17 +262,90 @@ class Trip(models.Model):
 		return 'Trip "{}", running from {} to {}'.format(self.name, self.start_time, self.end_time)
 
 
-class Comment(models.Model):
+# number of digits used for each comment id in a Comment's thread path
+COMMENT_PATH_STEP = 10
+
+
+# sorts after every digit, so the paths of a comment's replies all fall between path and path + COMMENT_PATH_END
+COMMENT_PATH_END = ':'
+
+
+# returns the thread path of a comment with the given id, replying to a comment with the given path ('' if top-level)
+def make_comment_path(parent_path, comment_id):
+	return '{}{:0{}d}'.format(parent_path, comment_id, COMMENT_PATH_STEP)
+
+
+class Waitlist(models.Model):
+	"""
+	A user waiting for a seat on a full Trip. When a seat opens, the entry with the lowest position is moved into the trip's participants (see Trip.promote_waitlist).
+	"""
+	trip = models.ForeignKey(Trip, on_delete=models.CASCADE, related_name='waitlist')
+	profile = models.ForeignKey(UserProfile, on_delete=models.CASCADE, related_name='waitlist_entries')
+	# order in line. Increases with each entry, but has gaps where entries left or were promoted
+	position = models.PositiveIntegerField()
+	time_stamp = models.DateTimeField(auto_now_add=True)
+	
+	class Meta:
+		ordering = ['trip', 'position']
+		unique_together = (('trip', 'position'), ('trip', 'profile'))
+		
+	def __str__(self):
+		return '{} waiting for trip {} at position {}'.format(self.profile, self.trip.name, self.position)
+
+
+class TripReminder(models.Model):
+	"""
+	Records that a user was reminded of an upcoming Trip, hours ahead of its start, so the reminder scheduler (see umoc/reminders.py) never sends the same reminder twice.
+	"""
+	trip = models.ForeignKey(Trip, on_delete=models.CASCADE, related_name='reminders')
+	profile = models.ForeignKey(UserProfile, on_delete=models.CASCADE, related_name='trip_reminders')
+	# length of the reminder window, in hours before the trip starts
+	hours = models.PositiveIntegerField()
+	time_stamp = models.DateTimeField(auto_now_add=True)
+	
+	class Meta:
+		unique_together = (('trip', 'profile', 'hours'),)
+		
+	def __str__(self):
+		return '{} reminded of trip {} {} hours ahead'.format(self.profile, self.trip.name, self.hours)
+
+
+class LotteryEntry(models.Model):
+	"""
+	A user's entry in the sign-up lottery of a Trip (see Trip.draw_lottery). Entries are only ever inserted while the lottery is open, so entering is one cheap write however many users enter at once.
+	"""
+	trip = models.ForeignKey(Trip, on_delete=models.CASCADE, related_name='lottery_entries')
+	profile = models.ForeignKey(UserProfile, on_delete=models.CASCADE, related_name='lottery_entries')
+	time_stamp = models.DateTimeField(auto_now_add=True)
+	
+	class Meta:
+		verbose_name_plural = 'lottery entries'
+		unique_together = (('trip', 'profile'),)
+		
+	def __str__(self):
+		return '{} entered lottery for trip {}'.format(self.profile, self.trip.name)
+
+
+class BaseComment(models.Model):
 	""" 
-	Represents a comment left by a user on a trip. Has an author (User), a timestamp, a parent comment if it is a reply (can be None), and the Trip it is commenting on.
+	Fields and methods shared by Comment and ArchivedComment. Has an author (User), a timestamp, a parent comment if it is a reply (can be None), and the Trip it is commenting on.
+	Each comment also stores its thread path: the zero-padded ids of its ancestors followed by its own id. Ordering a trip's comments by path returns them in display order (each thread depth-first, replies in order of posting).
 	"""
 	author = models.ForeignKey(UserProfile, on_delete=models.SET_NULL, null=True)
 	parent = models.ForeignKey('self', on_delete=models.SET_NULL, blank=True, null=True)
 	text = models.CharField(max_length=280)
-	time_stamp = models.DateTimeField(auto_now_add=True)
 	trip = models.ForeignKey(Trip, on_delete=models.SET_NULL, null=True)
 	# nested level of this comment. Don't allow to be greater than 6
 	depth = models.PositiveIntegerField(validators=[MaxValueValidator(6)])
+	# materialized thread path, set when the comment is first saved. See make_comment_path()
+	path = models.CharField(max_length=255, blank=True, editable=False)
+	
+	class Meta:
+		abstract = True
+	
+	# returns QuerySet of all replies in this comment's thread (at any depth), in display order. Runs as a range scan on the (trip, path) index
+	def get_descendants(self):
+		return type(self).objects.filter(trip_id=self.trip_id, path__gt=self.path, path__lt=self.path + COMMENT_PATH_END).order_by('path')
 	
 	# route to trip page comment is on
 	def get_absolute_url(self):
@@ -148,6 +355,39 @@ class Comment(models.Model):
 		return 'Comment by {} on trip {}. Replying to {} on {}'.format(self.author.first_name, self.trip.name, self.parent.author.first_name if self.parent else '', self.time_stamp)
 
 
+class Comment(BaseComment):
+	""" 
+	Represents a comment left by a user on a trip. Comments on trips that ended long ago are moved to ArchivedComment by the archive_old_data command.
+	"""
+	time_stamp = models.DateTimeField(auto_now_add=True)
+	
+	class Meta:
+		indexes = [
+			models.Index(fields=['trip', 'path'], name='umoc_comment_trip_path_idx'),
+			models.Index(fields=['trip', 'id'], name='umoc_comment_trip_id_idx'),
+		]
+	
+	# saves comment, filling in its thread path once it has an id. Both happen in one transaction, so a comment is never visible without its path
+	def save(self, *args, **kwargs):
+		with transaction.atomic():
+			super().save(*args, **kwargs)
+			if not self.path:
+				self.path = make_comment_path(self.parent.path if self.parent else '', self.id)
+				Comment.objects.filter(pk=self.pk).update(path=self.path)
+
+
+class ArchivedComment(BaseComment):
+	"""
+	A comment on a trip whose comments were archived (see Trip.comments_archived), with the same id and path it had as a Comment. Read-only: the comment section of an archived trip is served from here, and no new comments can be added.
+	"""
+	time_stamp = models.DateTimeField()
+	
+	class Meta:
+		indexes = [
+			models.Index(fields=['trip', 'path'], name='umoc_archcomment_path_idx'),
+		]
+
+
 class Notification(models.Model):
 	""" 
 	A Notification is sent to a user when something relevant to them occurs. Examples are: one of their comments gets a reply, one of their planned trips is canceled, their trip is coming up soon. A Notification simply stores a reference to the User, a message, a timestamp of when it was sent, and a bool (whether it has been seen yet). It can also include an optional url, which when clicked will direct the user to a relevant page.
@@ -159,9 +399,96 @@ class Notification(models.Model):
 	link = models.URLField(max_length=100, blank=True)
 	# auto_now_add defaults to a timestamp when object is first created
 	time_stamp = models.DateTimeField(auto_now_add=True)
+	# one of COALESCED_KINDS if later notifications of the same kind and link are merged into this one, otherwise blank
+	kind = models.CharField(max_length=10, blank=True)
+	# number of users who caused this notification, counting those merged into it. Only the names in actors are checked for repeats
+	count = models.PositiveIntegerField(default=1)
+	# JSON list of names of the users who caused this notification, most recent first. Holds at most NOTIFICATION_ACTORS_KEPT
+	actors = models.TextField(blank=True, default='[]')
+	
+	# kinds of notification merged while undismissed: kind -> message, with {actors} replaced by who caused them (see coalesce_notifications in notifications.py)
+	COALESCED_KINDS = {
+		'reply': '{actors} replied to your comment',
+		'comment': '{actors} commented on one of your trips',
+	}
+	# most actor names stored on one notification
+	NOTIFICATION_ACTORS_KEPT = 3
+
+	class Meta:
+		ordering = ['time_stamp']
+		indexes = [
+			# a user's active notifications, newest first
+			models.Index(fields=['recipient', 'dismissed', '-time_stamp'], name='umoc_notification_active_idx'),
+		]
+		
+	def __str__(self):
+		return 'Notification for {} on {}: "{}. Dismissed = {}"'.format(self.recipient.first_name, self.time_stamp, self.message, self.dismissed)
+		
+	# returns list of names of users who caused this notification, most recent first
+	def get_actors(self):
+		return json.loads(self.actors or '[]')
+		
+	# merges other (a notification of the same kind and link) into this one, adding its actors, rebuilding the message and marking it unseen. E.g. 'Ann Lee and 19 others replied to your comment'
+	def merge(self, other):
+		actors = self.get_actors()
+		for name in reversed(other.get_actors()):
+			if name in actors:
+				actors.remove(name)
+			else:
+				self.count += 1
+			actors.insert(0, name)
+		self.actors = json.dumps(actors[:self.NOTIFICATION_ACTORS_KEPT])
+		
+		if self.count == 1:
+			names = actors[0]
+		elif self.count == 2:
+			names = '{} and {}'.format(actors[0], actors[1])
+		else:
+			names = '{} and {} others'.format(actors[0], self.count - 1)
+		self.message = self.COALESCED_KINDS[self.kind].format(actors=names)
+		self.time_stamp = other.time_stamp or datetime.now(timezone.utc)
+		self.seen = False
 
+
+class ArchivedNotification(models.Model):
+	"""
+	A dismissed Notification moved out of the Notification table by the archive_old_data command, with the same id, so the table that is read on every page stays small. Kept for the admin.
+	"""
+	recipient = models.ForeignKey(UserProfile, on_delete=models.SET_NULL, null=True)
+	message = models.TextField()
+	seen = models.BooleanField(default=False)
+	link = models.URLField(max_length=100, blank=True)
+	time_stamp = models.DateTimeField()
+	kind = models.CharField(max_length=10, blank=True)
+	count = models.PositiveIntegerField(default=1)
+	actors = models.TextField(blank=True, default='[]')
+	
 	class Meta:
 		ordering = ['time_stamp']
+		indexes = [
+			models.Index(fields=['recipient', 'time_stamp'], name='umoc_archnotification_idx'),
+		]
+		
+	def __str__(self):
+		return 'Archived notification for {} on {}: "{}"'.format(self.recipient, self.time_stamp, self.message)
+
+
+class QueuedNotification(models.Model):
+	"""
+	A notification waiting in the outbox to be delivered to its recipients by the drain_outbox command (see umoc/notifications.py). Queuing one is a single INSERT however many recipients it has, so views that notify many users return right away. Deleted once its Notifications are created.
+	"""
+	# JSON list of ids of the recipient UserProfiles
+	recipient_ids = models.TextField()
+	message = models.TextField()
+	link = models.URLField(max_length=100, blank=True)
+	time_stamp = models.DateTimeField(auto_now_add=True)
+	# copied to the delivered Notifications: see Notification.kind
+	kind = models.CharField(max_length=10, blank=True)
+	# name of the user who caused the notification, if it is of a coalesced kind
+	actor = models.CharField(max_length=41, blank=True)
+	
+	class Meta:
+		ordering = ['id']
 		
 	def __str__(self):
-		return 'Notification for {} on {}: "{}. Dismissed = {}"'.format(self.recipient.first_name, self.time_stamp, self.message, self.dismissed)
\ No newline at end of file
+		return 'Queued notification on {}: "{}"'.format(self.time_stamp, self.message)
@@ -0,0 +1,256 @@
+"""
+Fan-out of Notifications to many recipients at once. Notifications are written with batched INSERTs in one transaction instead of one save() per recipient, so notifying a whole trip costs a few queries however many are signed up.
+Views queue notifications in the outbox with enqueue_notification(), a single INSERT, and a worker (manage.py drain_outbox, or the ASGI application itself) delivers them with deliver_queued_notifications(). Set NOTIFICATION_OUTBOX to False in settings to deliver them during the request instead, and NOTIFICATION_EMAIL to True to also email them through EMAIL_BACKEND (users who chose a daily digest get send_digests() instead).
+Notifications of the kinds in Notification.COALESCED_KINDS are merged into an undismissed one with the same recipient, kind and link from the last COALESCE_WINDOW, so twenty replies to a comment make one 'Ann Lee and 19 others replied to your comment' row.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.db.models import F, Value, DateTimeField
+from django.db.models.functions import Coalesce
+from datetime import datetime, timezone, timedelta
+from collections import Counter
+from itertools import groupby
+import json
+import logging
+
+from .caching import add_cached_count, adjust_cached_count, drop_cached_count
+from .events import broker, notification_channel
+from .models import UserProfile, Notification, QueuedNotification
+
+
+logger = logging.getLogger(__name__)
+
+# most notifications written by one INSERT. The database may lower it (SQLite allows 999 parameters per statement)
+NOTIFICATION_BATCH_SIZE = 500
+# most queued notifications delivered in one transaction
+OUTBOX_BATCH_SIZE = 100
+# most ids in one 'IN (...)' lookup, which SQLite limits
+LOOKUP_BATCH_SIZE = 500
+# how recent an undismissed notification must be for new ones to be merged into it
+COALESCE_WINDOW = timedelta(days=1)
+# how far back the first digest of a user goes
+DIGEST_PERIOD = timedelta(days=1)
+# seconds an unread count stays cached. Counts are adjusted as notifications change, so this only limits how long a miscount could last
+UNREAD_COUNT_TIMEOUT = 60 * 60
+
+
+# returns cache key of the unread count of the UserProfile of given id
+def unread_count_key(profile_id):
+	return 'umoc:unread:{}'.format(profile_id)
+
+
+def get_unread_count(profile_id):
+	"""
+	Returns the number of undismissed notifications the UserProfile of given id hasn't seen. Served from the cache, which is adjusted as notifications change (see adjust_unread_counts), so it only counts rows the first time it is asked, or after the count expires.
+	"""
+	key = unread_count_key(profile_id)
+	count = cache.get(key)
+	if count is None:
+		count = Notification.objects.filter(recipient_id=profile_id, dismissed=False, seen=False).count()
+		add_cached_count(key, count, UNREAD_COUNT_TIMEOUT)
+	return max(count, 0)
+
+
+def adjust_unread_counts(changes):
+	"""
+	Once the current transaction commits, adds each change to the cached unread count of its UserProfile. changes maps profile ids to the number of notifications that became unread (or, if negative, read or dismissed). Counts that aren't cached are left to be counted from the database when next asked for, including any being counted right now, which may have missed the change (see adjust_cached_count).
+	"""
+	def apply():
+		for profile_id, change in changes.items():
+			adjust_cached_count(unread_count_key(profile_id), change)
+	transaction.on_commit(apply)
+
+
+# once the current transaction commits, drops the cached unread count of the UserProfile of given id, so it is counted again when next asked for
+def reset_unread_count(profile_id):
+	transaction.on_commit(lambda: drop_cached_count(unread_count_key(profile_id)))
+
+
+def mark_notifications_seen(profile_id, ids):
+	"""
+	Marks the notifications of given ids seen, if they belong to the UserProfile of given id, with one UPDATE. Returns the number newly marked.
+	"""
+	seen = Notification.objects.filter(recipient_id=profile_id, id__in=ids, seen=False, dismissed=False).update(seen=True)
+	adjust_unread_counts({profile_id: -seen})
+	return seen
+
+
+def dismiss_notifications(profile_id, ids=None):
+	"""
+	Dismisses the notifications of given ids, or all of them if ids is None, if they belong to the UserProfile of given id, with one UPDATE. Returns the number dismissed.
+	"""
+	notifications = Notification.objects.filter(recipient_id=profile_id, dismissed=False)
+	if ids is not None:
+		notifications = notifications.filter(id__in=ids)
+	dismissed = notifications.update(dismissed=True)
+	# the UPDATE doesn't say how many of them were unseen
+	if dismissed:
+		reset_unread_count(profile_id)
+	return dismissed
+
+
+# tells open pages of the given recipients to reload their notifications. bulk_create doesn't send post_save (or, on SQLite, return ids), so there is no single notification to push
+def publish_refresh(recipient_ids):
+	for recipient_id in recipient_ids:
+		broker.publish(notification_channel(recipient_id), 'refresh', '')
+
+
+def coalesce_notifications(notifications):
+	"""
+	Merges each of the given unsaved Notifications that has a kind into an undismissed notification with the same recipient, kind and link from the last COALESCE_WINDOW, or into an earlier one in the list. Saves merged notifications that already existed, marking them unseen. Returns (notifications left to create, list of recipient ids of merged notifications that had been seen). Looks for existing notifications with one query.
+	"""
+	coalesced = [notification for notification in notifications if notification.kind]
+	if not coalesced:
+		return notifications, []
+		
+	targets = {}
+	existing = Notification.objects.filter(
+		recipient_id__in={notification.recipient_id for notification in coalesced},
+		dismissed=False,
+		kind__in={notification.kind for notification in coalesced},
+		link__in={notification.link for notification in coalesced},
+		time_stamp__gte=datetime.now(timezone.utc) - COALESCE_WINDOW,
+	).order_by('time_stamp')
+	# the newest notification with each key wins
+	for notification in existing:
+		targets[(notification.recipient_id, notification.kind, notification.link)] = notification
+		
+	remaining = []
+	merged = {}
+	unseen = []
+	for notification in notifications:
+		key = (notification.recipient_id, notification.kind, notification.link)
+		if not notification.kind:
+			remaining.append(notification)
+		elif key not in targets:
+			targets[key] = notification
+			remaining.append(notification)
+		else:
+			if targets[key].seen:
+				unseen.append(notification.recipient_id)
+			targets[key].merge(notification)
+			if targets[key].pk:
+				merged[targets[key].pk] = targets[key]
+				
+	for notification in merged.values():
+		notification.save(update_fields=['message', 'time_stamp', 'count', 'actors', 'seen'])
+	return remaining, unseen
+
+
+def send_notifications(notifications):
+	"""
+	Saves the given unsaved Notifications with batched INSERTs in one transaction, first merging those of coalesced kinds into existing ones (see coalesce_notifications). Once it commits, recipients' unread counts are adjusted and their open pages are told to reload their notifications. Returns the number of notifications sent.
+	"""
+	notifications = list(notifications)
+	if not notifications:
+		return 0
+
+	with transaction.atomic():
+		created, unseen = coalesce_notifications(notifications)
+		Notification.objects.bulk_create(created, batch_size=NOTIFICATION_BATCH_SIZE)
+		adjust_unread_counts(Counter([notification.recipient_id for notification in created] + unseen))
+		recipient_ids = {notification.recipient_id for notification in notifications}
+		transaction.on_commit(lambda: publish_refresh(recipient_ids))
+	return len(notifications)
+
+
+# returns a new unsaved Notification. If kind is one of Notification.COALESCED_KINDS, actor is the name of the user who caused it
+def build_notification(recipient_id, message, link='', kind='', actor=''):
+	return Notification(recipient_id=recipient_id, message=message, link=link, kind=kind, actors=json.dumps([actor] if actor else []))
+
+
+def notify(recipient_ids, message, link='', kind='', actor=''):
+	"""
+	Sends the same notification to every UserProfile in recipient_ids, e.g. trip.participants.values_list('id', flat=True). See build_notification() for kind and actor. Returns the number of notifications sent.
+	"""
+	return send_notifications(build_notification(recipient_id, message, link, kind, actor) for recipient_id in recipient_ids)
+
+
+def enqueue_notification(recipient_ids, message, link='', kind='', actor=''):
+	"""
+	Queues the same notification for every UserProfile in recipient_ids with one INSERT, to be delivered by deliver_queued_notifications(). See build_notification() for kind and actor. Delivers it right away instead if settings.NOTIFICATION_OUTBOX is False.
+	"""
+	recipient_ids = list(recipient_ids)
+	if not recipient_ids:
+		return
+	elif getattr(settings, 'NOTIFICATION_OUTBOX', True):
+		QueuedNotification.objects.create(recipient_ids=json.dumps(recipient_ids), message=message, link=link, kind=kind, actor=actor)
+	else:
+		notify(recipient_ids, message, link, kind, actor)
+
+
+# returns {id: email} for the UserProfiles of given ids that still exist. The email is blank for those who get a daily digest instead
+def get_recipient_emails(recipient_ids):
+	recipient_ids = list(recipient_ids)
+	emails = {}
+	for start in range(0, len(recipient_ids), LOOKUP_BATCH_SIZE):
+		for recipient_id, email, digest in UserProfile.objects.filter(id__in=recipient_ids[start:start + LOOKUP_BATCH_SIZE]).values_list('id', 'email', 'notification_digest'):
+			emails[recipient_id] = '' if digest else email
+	return emails
+
+
+# emails each Notification to its recipient through EMAIL_BACKEND, using one connection. emails maps recipient ids to addresses
+def send_emails(notifications, emails):
+	messages = [
+		EmailMessage(subject='UMOC: {}'.format(notification.message), body='{}\n{}'.format(notification.message, notification.link), to=[emails[notification.recipient_id]])
+		for notification in notifications if emails.get(notification.recipient_id)
+	]
+	try:
+		get_connection().send_messages(messages)
+	except Exception:
+		# the notifications themselves were delivered, so don't queue them again
+		logger.exception('Could not email %d notifications', len(messages))
+
+
+def deliver_queued_notifications(batch_size=OUTBOX_BATCH_SIZE):
+	"""
+	Delivers up to batch_size of the oldest queued notifications: creates their Notifications with batched INSERTs and removes them from the outbox in one transaction, then emails them if settings.NOTIFICATION_EMAIL is True. Recipients deleted since queuing are skipped. Safe to run from several workers at once: a batch another worker took first is left to it. Returns the number of queued notifications delivered.
+	"""
+	with transaction.atomic():
+		queued = list(QueuedNotification.objects.order_by('id')[:batch_size])
+		# claim the batch by deleting it. If another worker deleted some first, leave the rest to it
+		if not queued or QueuedNotification.objects.filter(pk__in=[item.pk for item in queued]).delete()[0] != len(queued):
+			transaction.set_rollback(True)
+			return 0
+			
+		recipients = [(item, json.loads(item.recipient_ids)) for item in queued]
+		emails = get_recipient_emails({recipient_id for item, recipient_ids in recipients for recipient_id in recipient_ids})
+		notifications = [
+			build_notification(recipient_id, item.message, item.link, item.kind, item.actor)
+			for item, recipient_ids in recipients for recipient_id in recipient_ids if recipient_id in emails
+		]
+		send_notifications(notifications)
+		
+	if getattr(settings, 'NOTIFICATION_EMAIL', False):
+		send_emails(notifications, emails)
+	return len(queued)
+
+
+def send_digests():
+	"""
+	Emails every user who chose a daily digest one summary of their undismissed notifications since their last digest (or the last DIGEST_PERIOD), through one EMAIL_BACKEND connection. Each recipient's last digest is moved to their newest notification it included, so nothing is sent twice or skipped, and users who weren't sent anything keep theirs. Loads the notifications with one query. Returns the number of digests sent.
+	"""
+	now = datetime.now(timezone.utc)
+	notifications = Notification.objects.filter(
+		recipient__notification_digest=True,
+		dismissed=False,
+		time_stamp__gt=Coalesce(F('recipient__last_digest'), Value(now - DIGEST_PERIOD, output_field=DateTimeField())),
+	).select_related('recipient').order_by('recipient_id', 'time_stamp')
+	
+	digests = []
+	recipients = []
+	for recipient, group in groupby(notifications, key=lambda notification: notification.recipient):
+		group = list(group)
+		lines = ['{} ({})'.format(notification.message, notification.link) if notification.link else notification.message for notification in group]
+		if recipient.email:
+			digests.append(EmailMessage(subject='UMOC: your daily digest', body='\n'.join(lines), to=[recipient.email]))
+			# ordered by time_stamp, so the last is the newest
+			recipient.last_digest = group[-1].time_stamp
+			recipients.append(recipient)
+			
+	get_connection().send_messages(digests)
+	# bulk_update sends no post_save, which would change the trips version for every recipient
+	UserProfile.objects.bulk_update(recipients, ['last_digest'], batch_size=LOOKUP_BATCH_SIZE)
+	return len(digests)
@@ -0,0 +1,56 @@
+"""
+Reminds participants and drivers of upcoming trips. Run by the send_reminders command, from cron or as a long-running loop.
+Each reminder window is a number of hours before a trip starts. A user is reminded once per window, the first time the scheduler runs after the trip comes within it; TripReminder rows record who has been reminded, so reruns send nothing new. A user is never sent a reminder for a wider window than one they already got, e.g. when they sign up the day before a trip.
+"""
+from collections import defaultdict
+from datetime import datetime, timezone, timedelta
+from django.db import transaction
+
+from .models import Trip, TripReminder
+from .notifications import enqueue_notification
+
+
+# reminder windows, in hours before a trip starts
+REMINDER_HOURS = [24, 24 * 7]
+# most reminders written by one INSERT
+REMINDER_BATCH_SIZE = 500
+
+
+# returns {trip id: set of ids of UserProfiles going on it}, for trips of given ids. Reads the participants and drivers tables directly, one query each
+def get_trip_members(trip_ids):
+	members = defaultdict(set)
+	for through in (Trip.participants.through, Trip.drivers.through):
+		for trip_id, profile_id in through.objects.filter(trip_id__in=trip_ids).values_list('trip_id', 'userprofile_id'):
+			members[trip_id].add(profile_id)
+	return members
+
+
+def send_trip_reminders(now=None, reminder_hours=REMINDER_HOURS):
+	"""
+	Reminds every participant and driver of each trip starting within one of reminder_hours of now, unless they were already reminded for that window or a narrower one. Trips are found with a range query on the start_time index, and reminders are recorded with bulk INSERTs and queued with one notification per trip, in one transaction. Returns the number of users reminded.
+	"""
+	now = now or datetime.now(timezone.utc)
+	reminded = 0
+	with transaction.atomic():
+		# narrowest window first, so a trip close to starting only gets its nearest reminder
+		for hours in sorted(reminder_hours):
+			trips = {trip.id: trip for trip in Trip.objects.filter(start_time__gte=now, start_time__lt=now + timedelta(hours=hours), cancelled=False).only('id', 'name', 'start_time')}
+			if not trips:
+				continue
+			
+			members = get_trip_members(list(trips))
+			# reminders already sent for this window or a narrower one
+			sent = set(TripReminder.objects.filter(trip_id__in=list(trips), hours__lte=hours).values_list('trip_id', 'profile_id'))
+			
+			reminders = []
+			for trip_id, profile_ids in members.items():
+				recipient_ids = sorted(profile_id for profile_id in profile_ids if (trip_id, profile_id) not in sent)
+				if not recipient_ids:
+					continue
+				trip = trips[trip_id]
+				reminders.extend(TripReminder(trip_id=trip_id, profile_id=profile_id, hours=hours) for profile_id in recipient_ids)
+				enqueue_notification(recipient_ids, 'Reminder: {} starts {}'.format(trip.name, trip.start_time.astimezone(tz=None).strftime('%A, %B %d at %I:%M %p')), trip.get_absolute_url())
+				
+			TripReminder.objects.bulk_create(reminders, batch_size=REMINDER_BATCH_SIZE)
+			reminded += len(reminders)
+	return reminded
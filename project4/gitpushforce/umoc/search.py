@@ -0,0 +1,182 @@
+"""
+Full-text search of trip names and descriptions, and autocomplete of trip names. On SQLite, trips are indexed in umoc_trip_search, an FTS5 table kept in sync with umoc_trip by triggers (created by migration 0023_trip_search), and matches are ranked with bm25, names counting for more than descriptions. Other databases fall back to unindexed icontains scans.
+Autocomplete is served from TripNameIndex, kept in memory by each process.
+Migrations that make SQLite rebuild umoc_trip (e.g. adding a field) drop its triggers. migrate then fails with the missing ones named (see check_search_table): run manage.py rebuild_trip_search, which recreates them and reindexes every trip.
+"""
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from bisect import bisect_left
+from itertools import islice
+import re
+
+from .caching import get_trip_names_version
+from .models import Trip
+
+
+# most trips a search returns
+SEARCH_LIMIT = 50
+# bm25 weights of a match in the name and in the description
+NAME_WEIGHT = 10.0
+DESCRIPTION_WEIGHT = 1.0
+# most names an autocomplete returns
+AUTOCOMPLETE_LIMIT = 10
+# most matching names an autocomplete looks through to find those starting with the prefix
+AUTOCOMPLETE_SCAN = 100
+
+CREATE_SEARCH_TABLE = [
+	# external content table: the text stays in umoc_trip, and only the index is stored here
+	"CREATE VIRTUAL TABLE IF NOT EXISTS umoc_trip_search USING fts5(name, description, content='umoc_trip', content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+	"""CREATE TRIGGER IF NOT EXISTS umoc_trip_search_insert AFTER INSERT ON umoc_trip BEGIN
+		INSERT INTO umoc_trip_search(rowid, name, description) VALUES (new.id, new.name, new.description);
+	END""",
+	"""CREATE TRIGGER IF NOT EXISTS umoc_trip_search_delete AFTER DELETE ON umoc_trip BEGIN
+		INSERT INTO umoc_trip_search(umoc_trip_search, rowid, name, description) VALUES ('delete', old.id, old.name, old.description);
+	END""",
+	# only when the indexed text changes, not on every seat count update
+	"""CREATE TRIGGER IF NOT EXISTS umoc_trip_search_update AFTER UPDATE OF name, description ON umoc_trip BEGIN
+		INSERT INTO umoc_trip_search(umoc_trip_search, rowid, name, description) VALUES ('delete', old.id, old.name, old.description);
+		INSERT INTO umoc_trip_search(rowid, name, description) VALUES (new.id, new.name, new.description);
+	END""",
+]
+# the table and triggers that CREATE_SEARCH_TABLE creates
+SEARCH_OBJECTS = ['umoc_trip_search', 'umoc_trip_search_insert', 'umoc_trip_search_delete', 'umoc_trip_search_update']
+DROP_SEARCH_TABLE = [
+	'DROP TRIGGER IF EXISTS umoc_trip_search_insert',
+	'DROP TRIGGER IF EXISTS umoc_trip_search_delete',
+	'DROP TRIGGER IF EXISTS umoc_trip_search_update',
+	'DROP TABLE IF EXISTS umoc_trip_search',
+]
+
+
+# returns whether trips can be searched with the FTS5 table on the given connection
+def search_available(conn=connection):
+	return conn.vendor == 'sqlite'
+
+
+def create_search_table(conn=connection):
+	"""
+	Creates the FTS5 table and the triggers keeping it in sync, if they don't exist, and indexes every trip. Does nothing on databases other than SQLite.
+	"""
+	if not search_available(conn):
+		return
+	with conn.cursor() as cursor:
+		for sql in CREATE_SEARCH_TABLE:
+			cursor.execute(sql)
+		cursor.execute("INSERT INTO umoc_trip_search(umoc_trip_search) VALUES ('rebuild')")
+
+
+def check_search_table(conn=connection):
+	"""
+	Raises ImproperlyConfigured if the FTS5 table or any of the triggers keeping it in sync are missing, e.g. because a migration rebuilt umoc_trip and dropped them. Does nothing on databases other than SQLite.
+	"""
+	if not search_available(conn):
+		return
+	with conn.cursor() as cursor:
+		cursor.execute('SELECT name FROM sqlite_master WHERE name IN ({})'.format(', '.join(['%s'] * len(SEARCH_OBJECTS))), SEARCH_OBJECTS)
+		found = {row[0] for row in cursor.fetchall()}
+	missing = sorted(set(SEARCH_OBJECTS) - found)
+	if missing:
+		raise ImproperlyConfigured('Trip search is missing {}: run manage.py rebuild_trip_search'.format(', '.join(missing)))
+
+
+def drop_search_table(conn=connection):
+	if not search_available(conn):
+		return
+	with conn.cursor() as cursor:
+		for sql in DROP_SEARCH_TABLE:
+			cursor.execute(sql)
+
+
+def make_match_query(text):
+	"""
+	Returns an FTS5 query matching trips that contain every word of the given text, the last possibly unfinished, or '' if it has no words. Words are quoted, so FTS5 syntax in the text is searched for as-is.
+	"""
+	words = ['"{}"'.format(word) for word in re.findall(r'\w+', text)]
+	if words:
+		words[-1] += '*'
+	return ' '.join(words)
+
+
+def search_trip_ids(text, limit=SEARCH_LIMIT):
+	"""
+	Returns ids of up to limit trips matching every word of the given text, best match first. Runs one query, against the FTS5 index on SQLite.
+	"""
+	query = make_match_query(text)
+	if not query:
+		return []
+	if not search_available():
+		return list(Trip.objects.filter(filter_icontains(text)).order_by('-start_time').values_list('id', flat=True)[:limit])
+
+	with connection.cursor() as cursor:
+		cursor.execute(
+			'SELECT rowid FROM umoc_trip_search WHERE umoc_trip_search MATCH %s ORDER BY bm25(umoc_trip_search, %s, %s) LIMIT %s',
+			[query, NAME_WEIGHT, DESCRIPTION_WEIGHT, limit]
+		)
+		return [row[0] for row in cursor.fetchall()]
+
+
+# returns a Q matching trips whose name or description contains every word of the given text, without an index
+def filter_icontains(text):
+	q = Q()
+	for word in re.findall(r'\w+', text):
+		q &= Q(name__icontains=word) | Q(description__icontains=word)
+	return q
+
+
+def filter_search(text):
+	"""
+	Returns a Q matching every trip that contains every word of the given text, in any order, for filtering a Trip QuerySet. Looks them up in the FTS5 index on SQLite.
+	"""
+	query = make_match_query(text)
+	if not query:
+		return Q(pk__in=[])
+	if not search_available():
+		return filter_icontains(text)
+	return Q(pk__in=RawSQL('SELECT rowid FROM umoc_trip_search WHERE umoc_trip_search MATCH %s', [query]))
+
+
+class TripNameIndex:
+	"""
+	In-process index of trip names for autocomplete: every word of every name, lowercased and followed by the rest of the name, in sorted order, so names with a word starting with a prefix are found by binary search. Rebuilt with one query when the trip names version changes (see caching.py), which it does only when a trip is created, renamed or deleted, not when rosters, waitlists or lotteries change. Trips written with bulk_create or QuerySet.update() send no signals, so they show up once some other trip's name changes.
+	"""
+	def __init__(self):
+		self.version = None
+		# sorted (rest of name from a word on, lowercased; name)
+		self.entries = []
+		
+	# rebuilds the index if trip names changed since it was built
+	def refresh(self):
+		version = get_trip_names_version()
+		if version != self.version:
+			entries = []
+			for name in set(Trip.objects.values_list('name', flat=True)):
+				for match in re.finditer(r'\w+', name):
+					entries.append((name[match.start():].lower(), name))
+			entries.sort()
+			# replaced at once, so concurrent requests see the old index or the new one
+			self.entries, self.version = entries, version
+			
+	def complete(self, prefix, limit=AUTOCOMPLETE_LIMIT):
+		"""
+		Returns up to limit trip names with a word starting with the given prefix (ignoring case), names starting with it first, then in alphabetical order of the matching words.
+		"""
+		prefix = prefix.strip().lower()
+		if not prefix:
+			return []
+		self.refresh()
+		entries = self.entries
+		
+		names = []
+		for key, name in islice(entries, bisect_left(entries, (prefix,)), None):
+			if not key.startswith(prefix) or len(names) == AUTOCOMPLETE_SCAN:
+				break
+			if name not in names:
+				names.append(name)
+		names.sort(key=lambda name: not name.lower().startswith(prefix))
+		return names[:limit]
+
+
+# shared by every request this process serves
+trip_name_index = TripNameIndex()
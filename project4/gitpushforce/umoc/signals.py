@@ -0,0 +1,179 @@
+"""
+Signal handlers for the umoc app. Connected when the app is ready (see UmocConfig.ready).
+"""
+import json
+
+from django.db import connections, transaction
+from django.db.migrations.recorder import MigrationRecorder
+from django.db.models import Count, F, IntegerField, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce, Greatest
+from django.db.models.signals import pre_save, post_save, post_delete, m2m_changed, post_migrate
+from django.dispatch import receiver
+from django.template.loader import render_to_string
+from datetime import datetime, timezone
+
+from .caching import bump_trips_version, bump_trip_names_version
+from .events import broker, notification_channel, comment_channel
+from .models import UserProfile, Trip, Comment, Notification, Waitlist, LotteryEntry
+from .notifications import adjust_unread_counts
+from .search import check_search_table
+from .stats import adjust_site_stat, reset_site_stat
+from .comments import build_comment_threads, serialize_comment
+
+
+# UserProfile fields shown on pages cached by trips version: names of leaders and participants, and what the user's own pages offer them
+TRIP_PAGE_PROFILE_FIELDS = ['first_name', 'last_name']
+OWN_PAGE_PROFILE_FIELDS = ['admin_level', 'can_join_trip']
+
+
+@receiver(post_save, sender=Notification)
+def publish_notification(sender, instance, created, **kwargs):
+	"""
+	Pushes a newly created Notification to its recipient's open pages, rendered the same way as the notifications dropdown.
+	"""
+	channel = notification_channel(instance.recipient_id)
+	if created and broker.has_subscribers(channel):
+		html = render_to_string('notifications.html', {'notifications': [instance]})
+		transaction.on_commit(lambda: broker.publish(channel, 'notification', json.dumps({'id': instance.id, 'html': html})))
+
+
+@receiver(post_save, sender=Notification)
+def count_new_notification(sender, instance, created, **kwargs):
+	"""
+	Counts a Notification saved on its own (not with bulk_create, which adjusts the count itself) towards its recipient's unread count.
+	"""
+	if created and not instance.seen and not instance.dismissed:
+		adjust_unread_counts({instance.recipient_id: 1})
+
+
+@receiver(post_delete, sender=Notification)
+def uncount_deleted_notification(sender, instance, **kwargs):
+	if not instance.seen and not instance.dismissed:
+		adjust_unread_counts({instance.recipient_id: -1})
+
+
+@receiver(post_save, sender=UserProfile)
+def count_saved_profile(sender, instance, created, **kwargs):
+	"""
+	Keeps the cached site statistics (see stats.py) exact as users register or change admin level. Only a new UserProfile changes the number of users, but any save may change the number of admins.
+	"""
+	if created:
+		adjust_site_stat('num_users', 1)
+		if instance.admin_level == 'a':
+			adjust_site_stat('num_admins', 1)
+	else:
+		reset_site_stat('num_admins')
+
+
+@receiver(post_delete, sender=UserProfile)
+def uncount_deleted_profile(sender, instance, **kwargs):
+	adjust_site_stat('num_users', -1)
+	if instance.admin_level == 'a':
+		adjust_site_stat('num_admins', -1)
+
+
+@receiver(post_save, sender=Trip)
+def count_new_trip(sender, instance, created, **kwargs):
+	if created:
+		adjust_site_stat('num_trips', 1)
+
+
+@receiver(post_delete, sender=Trip)
+def uncount_deleted_trip(sender, instance, **kwargs):
+	adjust_site_stat('num_trips', -1)
+
+
+@receiver(post_save, sender=Trip)
+@receiver(post_delete, sender=Trip)
+@receiver(post_save, sender=Trip.participants.through)
+@receiver(post_delete, sender=Trip.participants.through)
+@receiver(post_delete, sender=UserProfile)
+def trips_changed(sender, **kwargs):
+	"""
+	Changes the trips version when a trip or its roster changes, or a user is deleted (which unsets trips' leader without a signal), so cached pages showing trips are rendered again (see caching.py). Rosters edited with participants.add() and remove() are handled by update_participant_count, and users' other changes by profile_changed.
+	"""
+	bump_trips_version()
+
+
+@receiver(pre_save, sender=UserProfile)
+def profile_changed(sender, instance, update_fields, **kwargs):
+	"""
+	Changes the trips version when a user changes in a way trip pages show: what their own pages offer them, or their name if they lead or are signed up for a trip. Other profile edits, and saves that don't write these fields, keep cached trip pages. A new user isn't on any trip yet.
+	"""
+	fields = [field for field in TRIP_PAGE_PROFILE_FIELDS + OWN_PAGE_PROFILE_FIELDS if update_fields is None or field in update_fields]
+	if instance.pk is None or not fields:
+		return
+	saved = UserProfile.objects.filter(pk=instance.pk).values(*fields).first()
+	changed = {field for field in fields if saved is None or saved[field] != getattr(instance, field)}
+	if changed & set(OWN_PAGE_PROFILE_FIELDS) or changed and Trip.objects.filter(Q(leader_id=instance.pk) | Q(participants=instance.pk)).exists():
+		bump_trips_version()
+
+
+@receiver(pre_save, sender=Trip)
+def trip_renamed(sender, instance, update_fields, **kwargs):
+	"""
+	Changes the trip names version when a trip is created or its name changes, so autocomplete indexes are rebuilt (see search.py). Saves that don't write the name run no query.
+	"""
+	if instance.pk is None or (update_fields is None or 'name' in update_fields) and not Trip.objects.filter(pk=instance.pk, name=instance.name).exists():
+		bump_trip_names_version()
+
+
+@receiver(post_delete, sender=Trip)
+def trip_deleted(sender, **kwargs):
+	bump_trip_names_version()
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_save, sender=Waitlist)
+@receiver(post_delete, sender=Waitlist)
+@receiver(post_save, sender=LotteryEntry)
+@receiver(post_delete, sender=LotteryEntry)
+@receiver(post_save, sender=Trip.participants.through)
+@receiver(post_delete, sender=Trip.participants.through)
+def touch_trip(sender, instance, **kwargs):
+	"""
+	Moves Trip.updated_at forward when a comment is posted on the trip, or someone joins or leaves its roster, waitlist or lottery one row at a time. Rosters edited with participants.add() and remove() are handled by update_participant_count.
+	"""
+	if sender is not Comment or kwargs['created']:
+		Trip.objects.filter(pk=instance.trip_id).update(updated_at=datetime.now(timezone.utc))
+
+
+@receiver(post_save, sender=Comment)
+def publish_comment(sender, instance, created, **kwargs):
+	"""
+	Pushes a newly created Comment to pages open on its trip, in the same format as trip_comments 'since' requests. Waits for the transaction in Comment.save() to commit, which fills in the comment's path.
+	"""
+	channel = comment_channel(instance.trip_id)
+	if created and broker.has_subscribers(channel):
+		transaction.on_commit(lambda: broker.publish(channel, 'comment', json.dumps(serialize_comment(build_comment_threads([instance])[0]))))
+
+
+@receiver(m2m_changed, sender=Trip.participants.through)
+def update_participant_count(sender, instance, action, reverse, pk_set, **kwargs):
+	"""
+	Recounts the participants of every trip whose roster changed, so Trip.participant_count (and num_seats) stay exact however the roster is edited, e.g. from the admin. Runs one UPDATE.
+	"""
+	if action not in ('post_add', 'post_remove', 'post_clear'):
+		return
+	
+	if not reverse:
+		trips = Trip.objects.filter(pk=instance.pk)
+	elif action == 'post_clear':
+		# a user was removed from all their trips, which are no longer known: recount every trip
+		trips = Trip.objects.all()
+	else:
+		trips = Trip.objects.filter(pk__in=pk_set)
+	
+	bump_trips_version()
+	count = Coalesce(Subquery(sender.objects.filter(trip_id=OuterRef('pk')).values('trip_id').annotate(count=Count('*')).values('count'), output_field=IntegerField()), 0)
+	trips.update(participant_count=count, num_seats=Greatest(F('capacity') - count, 0), updated_at=datetime.now(timezone.utc))
+
+
+@receiver(post_migrate)
+def check_trip_search(sender, using, **kwargs):
+	"""
+	Makes migrate fail if trip search lost its table or triggers, which SQLite drops when a migration rebuilds umoc_trip, rather than leave search silently out of date. Only checks once migration 0023_trip_search, which creates them, has been applied.
+	"""
+	connection = connections[using]
+	if sender.name == 'umoc' and ('umoc', '0023_trip_search') in MigrationRecorder(connection).applied_migrations():
+		check_search_table(connection)
@@ -1,4 +1,4 @@
-/* Javascript site administration functionality. Supports filtering of <select> for users and populating user data. Manages AJAX calls to get user data and post changes. */
+/* Javascript site administration functionality. Lists users in a <select> a page at a time, searched and filtered server-side, and populates user data. Manages AJAX calls to list users and post changes. */
 
 function getCookie(name) {  // TODO: IMPORT ON ALL SCRIPTS
     var cookieValue = null;
@@ -44,23 +44,65 @@ var selected_level = null;
 var admin_mapping = {'a': 'Admin', 'l': 'Leader', 'u': 'User'};
 
 
-// let user filter shown users by entering text in <user-filter>
+// milliseconds typing in <user-filter> must pause for before users are searched
+var SEARCH_DELAY = 250;
+var searchTimer = null;
+// 'after' of the next page of users, or null if all have been listed
+var next_user = null;
+
+// list the first page of users once the page loads
+$(document).ready(function() {
+	loadUsers(false);
+});
+
+// let user search users by entering text in <user-filter>, once typing pauses
 $('#user-filter').bind('input', function() {
-    // retrieve filter val, case-insensitive
-	var filter = $(this).val().toLowerCase();
-
-	// show items whose name contain a substring of filter text
-    $('.user-select').each(function() {
-		if ($(this).val().toLowerCase().includes(filter)) {
-			$(this).show();
-		} else {
-			$(this).hide();
+	clearTimeout(searchTimer);
+	searchTimer = setTimeout(function() {
+		loadUsers(false);
+	}, SEARCH_DELAY);
+});
+
+// let user filter users by admin level
+$('#user-level-filter').on('change', function() {
+	loadUsers(false);
+});
+
+// list the next page of users
+$('#more-users-btn').on('click', function() {
+	loadUsers(true);
+});
+
+// makes request for a page of users matching the search and level filter, and adds them to the <select>, replacing those listed unless more is true. Users' data is cached, so selecting one needs no request
+function loadUsers(more) {
+	var data = {'q': $('#user-filter').val(), 'admin_level': $('#user-level-filter').val()};
+	if (more)
+		data['after'] = next_user;
+	
+	$.ajax({
+		type: 'GET',
+		url: $('#user-filter').data('url'),
+		data: data,
+		success: function(result) {
+			if (!more)
+				$('#user-listbox').empty();
+			$.each(result.users, function(i, user) {
+				user_cache.set(user.id, user);
+				$('#user-listbox').append($('<option class="user-select">').attr('id', 'user-select-' + user.id).text(user.first_name + ' ' + user.last_name));
+			});
+			next_user = result.next;
+			$('#more-users-btn').toggle(next_user !== null);
+		},
+		error: function(result) {
+			console.log('Received error response:');
+			console.log(result);
+			alert("Couldn't connect to the server. Are you sure you have internet access?");
 		}
 	});
-});
+}
 
-// handle user clicking an item in the <select> element, selecting a user
-$('.user-select').on('click', function() {
+// handle user clicking an item in the <select> element, selecting a user. Items are added as pages of users load
+$(document).on('click', '.user-select', function() {
 	// id='user-select-<id>'
 	var user_id = parseInt($(this).attr('id').substring(12));
 
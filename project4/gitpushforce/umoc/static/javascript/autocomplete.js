@@ -0,0 +1,41 @@
+/* Javascript autocomplete of trip names in the dashboard search box. Waits for typing to pause, then makes AJAX request to /trips/autocomplete and fills the box's datalist with the names returned. Responses may come from the browser's cache. */
+
+// milliseconds typing must pause for before names are requested
+var AUTOCOMPLETE_DELAY = 150;
+var autocompleteTimer = null;
+// prefix of the last request, so repeated keys (e.g. arrows) don't make another
+var lastPrefix = '';
+
+$(document).on('input', '#trip-search', function() {
+	var box = $(this);
+	clearTimeout(autocompleteTimer);
+	autocompleteTimer = setTimeout(function() {
+		loadNames(box);
+	}, AUTOCOMPLETE_DELAY);
+});
+
+// makes request for names matching what is in the given search box, and shows them as its suggestions
+function loadNames(box) {
+	var prefix = $.trim(box.val());
+	if (!prefix || prefix === lastPrefix)
+		return;
+	lastPrefix = prefix;
+	
+	$.ajax({
+		type: "get",
+		url: box.data('url'),
+		data: {'q': prefix},
+		success: function(data) {
+			// a newer request was made while this one was out
+			if (prefix !== lastPrefix)
+				return;
+			var list = $('#trip-names').empty();
+			$.each(data.names, function(i, name) {
+				list.append($('<option>').attr('value', name));
+			});
+		},
+		error: function() {
+			console.log("AJAX error: couldn't load trip names");
+		}
+	});
+}
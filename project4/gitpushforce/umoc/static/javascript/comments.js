@@ -43,27 +43,148 @@ $('#base-reply-btn').on('click', function() {
 	createReply(0, $('#base-reply-btn'));
 });
 
+// number of top-level threads to load per page, and replies to load per thread
+var comment_page_size = 20;
+var comment_reply_limit = 5;
+// number of digits per comment id in a comment's path
+var comment_path_step = 10;
+// id of the latest comment when comments were loaded or last polled, and milliseconds between polls for newer ones
+var latest_comment_id = null;
+var comment_poll_interval = 15000;
+
 $(document).ready(function(){
-	// query trip comments and append HTML
+	// query first page of trip comments and append HTML
 	$.ajax({
 		type: "get",
 		url: "http://localhost:8000/trip/" + trip_id + "/comments",
-		contentType: "application/json",
+		data: {'limit': comment_page_size, 'replies': comment_reply_limit},
 		success: function(data) {
 			// append rendered comment section below base-reply-btn element
 			$('#base-reply-btn').after(data);
 			
-			// create click handlers for each reply button
-			$('.comment-reply-btn').on('click', function() {
-				// extract comment id ("reply-btn-<id>")
-				var id = $(this).attr('id').substring(10);
-				
-				// remove reply button from parent comment
-				$(this).remove();
-				
-				// create reply and add it after comment's div
-				createReply(id, $('#comment-' + id));
-			});
+			// receive comments posted after this page was rendered
+			latest_comment_id = parseInt($('#comments-latest').attr('data-latest'), 10);
+			streamComments();
+		},
+		error: function(){
+			console.log('AJAX error');
+		}
+	});
+});
+
+// id returned by setInterval while polling for new comments
+var comment_poller = null;
+
+// receives new comments from the trip's server-sent event stream while it is open, polling for them otherwise. The stream is only available when the site runs under ASGI, otherwise the server closes it
+function streamComments() {
+	comment_poller = setInterval(pollComments, comment_poll_interval);
+	if (typeof(EventSource) === 'undefined')
+		return;
+	
+	var source = new EventSource("http://localhost:8000/trip/" + trip_id + "/comments/stream");
+	source.addEventListener('open', function() {
+		// catch up on anything posted while the stream was closed, then stop polling
+		pollComments();
+		clearInterval(comment_poller);
+		comment_poller = null;
+	});
+	source.addEventListener('error', function() {
+		if (comment_poller === null)
+			comment_poller = setInterval(pollComments, comment_poll_interval);
+	});
+	source.addEventListener('comment', function(event) {
+		var comment = JSON.parse(event.data);
+		latest_comment_id = Math.max(latest_comment_id, comment.id);
+		insertComment(comment);
+	});
+}
+
+// requests comments posted since the last poll and adds them to the page
+function pollComments() {
+	$.ajax({
+		type: "get",
+		url: "http://localhost:8000/trip/" + trip_id + "/comments",
+		data: {'since': latest_comment_id},
+		success: function(result) {
+			latest_comment_id = Math.max(latest_comment_id, result.latest);
+			result.comments.forEach(insertComment);
+		},
+		error: function(){
+			console.log('AJAX error');
+		}
+	});
+}
+
+// inserts a new comment from pollComments at its place in the thread. Skips comments already shown, and comments whose place is in a part of the thread that hasn't been loaded yet (they arrive when it is)
+function insertComment(comment) {
+	if ($('#comment-' + comment.id).length)
+		return;
+	
+	if (comment.parent == 0) {
+		// new top-level comments go last, so wait until the last page has been loaded
+		if ($('.more-comments').length)
+			return;
+	} else {
+		var thread_id = parseInt(comment.path.substring(0, comment_path_step), 10);
+		if (!$('#comment-' + comment.parent).length || $('.more-replies-btn[data-comment-id="' + thread_id + '"]').length)
+			return;
+	}
+	
+	// insert before the first comment shown that comes after it in display order, or at the end
+	var next = $('.comment-row').filter(function() {
+		return $(this).attr('data-path') > comment.path;
+	}).first();
+	
+	if (next.length) {
+		next.before(comment.html);
+	} else if ($('.comment-row, .more-replies').length) {
+		$('.comment-row, .more-replies').last().after(comment.html);
+	} else {
+		$('#base-reply-btn').after(comment.html);
+	}
+}
+
+// click handlers for each reply button, including those on comments loaded later
+$(document).on('click', '.comment-reply-btn', function() {
+	// extract comment id ("reply-btn-<id>")
+	var id = $(this).attr('id').substring(10);
+	
+	// remove reply button from parent comment
+	$(this).remove();
+	
+	// create reply and add it after comment's div
+	createReply(id, $('#comment-' + id));
+});
+
+// load the next page of top-level threads in place of the 'Load more comments' button
+$(document).on('click', '.more-comments-btn', function() {
+	var more_comments = $(this).closest('.more-comments');
+	$(this).prop('disabled', true);
+	
+	$.ajax({
+		type: "get",
+		url: "http://localhost:8000/trip/" + trip_id + "/comments",
+		data: {'limit': comment_page_size, 'replies': comment_reply_limit, 'after': $(this).attr('data-after')},
+		success: function(data) {
+			more_comments.replaceWith(data);
+		},
+		error: function(){
+			console.log('AJAX error');
+		}
+	});
+});
+
+// load more of a thread's replies in place of its 'Show more replies' button
+$(document).on('click', '.more-replies-btn', function() {
+	var more_replies = $(this).closest('.more-replies');
+	$(this).prop('disabled', true);
+	
+	$.ajax({
+		type: "get",
+		url: "http://localhost:8000/trip/" + trip_id + "/comments/" + $(this).attr('data-comment-id') + "/replies",
+		data: {'limit': comment_reply_limit, 'after': $(this).attr('data-after')},
+		success: function(data) {
+			more_replies.replaceWith(data);
 		},
 		error: function(){
 			console.log('AJAX error');
@@ -1,4 +1,4 @@
-/* Javascript Notification functionality. Makes AJAX request to /notifications/ and adds html to notifications dropdown. Allows dismissal of individual notifications, facilitated by AJAX. */
+/* Javascript Notification functionality. Shows the unread count from /notifications/count, and when the dropdown is first opened makes AJAX request to /notifications/ and adds html to notifications dropdown. Allows dismissal of individual notifications, facilitated by AJAX. */
 
 function getCookie(name) {  // TODO: IMPORT ON ALL SCRIPTS
     var cookieValue = null;
@@ -33,8 +33,67 @@ $.ajaxSetup({
     }
 });
 
+// whether the dropdown has been filled with notifications
+var notificationsLoaded = false;
+
 $(document).ready(function(){
-	// make request to load notifications from server
+	// show unread count, then listen for new notifications
+	loadUnreadCount();
+	streamNotifications();
+	
+	// only load the notifications themselves once the user looks at them, and mark them seen then
+	$('#notifications-dropdown').parent().on('show.bs.dropdown', function() {
+		if (!notificationsLoaded)
+			loadNotifications();
+		else
+			markSeen();
+	});
+});
+
+// makes request for the number of unread notifications, and shows it in the counter
+function loadUnreadCount() {
+	$.ajax({
+		type: "get",
+		url: "http://localhost:8000/notifications/count",
+		success: function(data) {
+			$('#notifications-counter').text(data.unread);
+		},
+		error: function() {
+			console.log("AJAX error: couldn't load number of notifications");
+		}
+	});
+}
+
+// returns ids of the notifications in the dropdown matching selector
+function getNotificationIds(selector) {
+	return $(selector).map(function() {
+		return $(this).attr('id').substring(16);
+	}).get();
+}
+
+// tells server the user has seen the notifications in the dropdown, with one request
+function markSeen() {
+	var ids = getNotificationIds('.notification-li:not(.seen)');
+	if (!ids.length)
+		return;
+	
+	$('.notification-li').addClass('seen');
+	$.ajax({
+		type: "POST",
+		url: "http://localhost:8000/notifications",
+		data: {'seen_ids': ids},
+		success: function(result) {
+			$('#notifications-counter').text(result.unread);
+		},
+		error: function() {
+			console.log("AJAX error: couldn't mark notifications seen");
+		}
+	});
+}
+
+// makes request to load notifications from server, replacing those in the dropdown
+function loadNotifications() {
+	notificationsLoaded = true;
 	$.ajax({
 		type: "get",
 		url: "http://localhost:8000/notifications",
@@ -44,43 +103,89 @@ $(document).ready(function(){
 			// console.log(data);
 			
 			// add rendered html to dropdown
+			$('#notifications-dropdown li').remove();
 			$('#notifications-dropdown').append(data);
+			if ($('.notification-li').length)
+				$('#notifications-dropdown').append('<li id="dismiss-all-li"><a href="#" id="dismiss-all-notifications-btn">Dismiss All</a></li>');
 			
-			// set number of notifications 
-			var num_notifications = $('.notification-li').length;
-			$('#notifications-counter').text(num_notifications);
-			
-			// click handlers for each dismiss-notification-btn
-			$('.dismiss-notification-btn').on('click', function() {
-				var id = $(this).attr('id').substring(21);
-				console.log('clicked to dismiss ' + id);
-				
-				// submit AJAX post saying notification was dismissed
-				$.ajax({
-					type: "POST",
-					url: "http://localhost:8000/notifications",
-					data: {'dismissed_id': id},
-					success: function(result) {
-						console.log(result);
-						console.log('Removing #notification-li-' + id);
-						// remove notification html
-						$('#notification-li-' + id).remove();
-						
-						// subtract one from number of notifications
-						$('#notifications-counter').text(parseInt($('#notifications-counter').text()) - 1);
-						
-					},
-					error: function(result) {
-						console.log('Error with POST');
-						console.log(result)
-						alert("Couldn't connect to server. Are you sure you're connected to the internet?");
-						//console.log(result.responseText);
-					}
-				})
-			});
+			if ($('#notifications-dropdown').parent().hasClass('open'))
+				markSeen();
 		},
 		error: function() {
 			console.log("AJAX error: couldn't load notifications");
 		}
 	});
-});
\ No newline at end of file
+}
+
+// click handlers for each dismiss-notification-btn, including those of notifications received later
+$(document).on('click', '.dismiss-notification-btn', function() {
+	var id = $(this).attr('id').substring(21);
+	console.log('clicked to dismiss ' + id);
+	
+	// submit AJAX post saying notification was dismissed
+	$.ajax({
+		type: "POST",
+		url: "http://localhost:8000/notifications",
+		data: {'dismissed_ids': [id]},
+		success: function(result) {
+			console.log(result);
+			console.log('Removing #notification-li-' + id);
+			// remove notification html
+			$('#notification-li-' + id).remove();
+			
+			// show updated number of notifications
+			$('#notifications-counter').text(result.unread);
+			
+		},
+		error: function(result) {
+			console.log('Error with POST');
+			console.log(result)
+			alert("Couldn't connect to server. Are you sure you're connected to the internet?");
+			//console.log(result.responseText);
+		}
+	})
+});
+
+// dismisses every notification with one request
+$(document).on('click', '#dismiss-all-notifications-btn', function(event) {
+	event.preventDefault();
+	$.ajax({
+		type: "POST",
+		url: "http://localhost:8000/notifications",
+		data: {'dismiss_all': 1},
+		success: function(result) {
+			$('#notifications-dropdown li').remove();
+			$('#notifications-dropdown').append('<li><a href="#">No Notifications</a></li>');
+			$('#notifications-counter').text(result.unread);
+		},
+		error: function() {
+			alert("Couldn't connect to server. Are you sure you're connected to the internet?");
+		}
+	});
+});
+
+// opens server-sent event stream of new notifications, updating the counter and, if it has been loaded, the dropdown. The stream is only available when the site runs under ASGI, otherwise the server closes it
+function streamNotifications() {
+	if (typeof(EventSource) === 'undefined')
+		return;
+	
+	var source = new EventSource("http://localhost:8000/notifications/stream");
+	source.addEventListener('notification', function(event) {
+		var notification = JSON.parse(event.data);
+		loadUnreadCount();
+		if (!notificationsLoaded || $('#notification-li-' + notification.id).length)
+			return;
+		
+		// remove 'No Notifications' placeholder
+		$('#notifications-dropdown li:not(.notification-li):not(#dismiss-all-li)').remove();
+		$('#notifications-dropdown').prepend(notification.html);
+		if (!$('#dismiss-all-li').length)
+			$('#notifications-dropdown').append('<li id="dismiss-all-li"><a href="#" id="dismiss-all-notifications-btn">Dismiss All</a></li>');
+	});
+	// sent when several notifications were created at once
+	source.addEventListener('refresh', function() {
+		loadUnreadCount();
+		if (notificationsLoaded)
+			loadNotifications();
+	});
+}
\ No newline at end of file
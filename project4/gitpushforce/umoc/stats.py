@@ -0,0 +1,49 @@
+"""
+Site statistics shown on the index page, served from the cache. Each count is computed once, then adjusted as users and trips are created or deleted (see the handlers in signals.py), so the homepage runs no COUNT queries.
+"""
+from django.core.cache import cache
+from django.db import transaction
+
+from .caching import add_cached_count, adjust_cached_count
+from .models import UserProfile, Trip
+
+
+# statistic -> function returning its exact value
+SITE_STATS = {
+	'num_users': lambda: UserProfile.objects.count(),
+	'num_trips': lambda: Trip.objects.count(),
+	'num_admins': lambda: UserProfile.objects.filter(admin_level__exact='a').count(),
+}
+# seconds statistics stay cached. They are adjusted as rows change, so this only limits how long a miscount could last
+SITE_STATS_TIMEOUT = 24 * 60 * 60
+
+
+# returns cache key of the statistic of given name
+def site_stat_key(name):
+	return 'umoc:stats:{}'.format(name)
+
+
+def get_site_stats():
+	"""
+	Returns dict of the site statistics in SITE_STATS, e.g. {'num_users': 120, ...}. Takes one cache lookup, and counts only the statistics that weren't cached.
+	"""
+	cached = cache.get_many([site_stat_key(name) for name in SITE_STATS])
+	stats = {}
+	for name, count in SITE_STATS.items():
+		stats[name] = cached.get(site_stat_key(name))
+		if stats[name] is None:
+			stats[name] = count()
+			add_cached_count(site_stat_key(name), stats[name], SITE_STATS_TIMEOUT)
+	return stats
+
+
+def adjust_site_stat(name, change):
+	"""
+	Once the current transaction commits, adds change to the cached statistic of given name. Statistics that aren't cached are left to be counted when next asked for, including any being counted right now (see adjust_cached_count).
+	"""
+	transaction.on_commit(lambda: adjust_cached_count(site_stat_key(name), change))
+
+
+# once the current transaction commits, drops the cached statistic of given name, so it is counted again when next asked for
+def reset_site_stat(name):
+	transaction.on_commit(lambda: cache.delete(site_stat_key(name)))
@@ -0,0 +1,116 @@
+"""
+Server-sent event streams, served natively by the ASGI application (see gitpushforce/asgi.py) rather than through Django views, so an idle open page only costs a queue and a coroutine. Events come from the in-process broker in umoc.events.
+/notifications/stream: 'notification' events for the signed-in user. Data is JSON with the notification's 'id' and rendered 'html'.
+/trip/<id>/comments/stream: 'comment' events for the trip. Data is JSON in the same format as trip_comments 'since' requests.
+"""
+import asyncio
+import re
+from http.cookies import SimpleCookie
+from importlib import import_module
+from types import SimpleNamespace
+
+from django.conf import settings
+from django.contrib import auth
+from django.db import connections
+
+from .events import broker, notification_channel, comment_channel
+from .models import UserProfile
+
+
+# seconds between keep-alive comments, which stop proxies from closing idle streams
+KEEPALIVE_INTERVAL = 30
+# milliseconds browsers wait before reconnecting a dropped stream
+RETRY_INTERVAL = 5000
+
+
+def get_profile_id(scope):
+	"""
+	Returns id of the UserProfile signed in with the session cookie sent with the given ASGI scope, or None. Runs blocking database queries, so call it from a worker thread.
+	"""
+	cookies = SimpleCookie()
+	for name, value in scope.get('headers', []):
+		if name == b'cookie':
+			cookies.load(value.decode('latin-1'))
+	if settings.SESSION_COOKIE_NAME not in cookies:
+		return None
+
+	try:
+		session = import_module(settings.SESSION_ENGINE).SessionStore(cookies[settings.SESSION_COOKIE_NAME].value)
+		user = auth.get_user(SimpleNamespace(session=session))
+		return UserProfile.objects.filter(user_id=user.id).values_list('id', flat=True).first() if user.is_authenticated else None
+	finally:
+		connections.close_all()
+
+
+# returns once the client has closed the connection
+async def wait_for_disconnect(receive):
+	while (await receive())['type'] != 'http.disconnect':
+		pass
+
+
+# answers with 204 No Content, which tells EventSource not to reconnect
+async def send_no_content(send):
+	await send({'type': 'http.response.start', 'status': 204, 'headers': []})
+	await send({'type': 'http.response.body', 'body': b''})
+
+
+async def stream_channel(channel, receive, send):
+	"""
+	Sends events published to channel as a text/event-stream response until the client disconnects.
+	"""
+	queue = broker.subscribe(channel)
+	disconnected = asyncio.ensure_future(wait_for_disconnect(receive))
+	try:
+		await send({
+			'type': 'http.response.start',
+			'status': 200,
+			'headers': [(b'content-type', b'text/event-stream'), (b'cache-control', b'no-cache'), (b'x-accel-buffering', b'no')],
+		})
+		await send({'type': 'http.response.body', 'body': 'retry: {}\n\n'.format(RETRY_INTERVAL).encode(), 'more_body': True})
+
+		while True:
+			next_event = asyncio.ensure_future(queue.get())
+			done, pending = await asyncio.wait([next_event, disconnected], timeout=KEEPALIVE_INTERVAL, return_when=asyncio.FIRST_COMPLETED)
+			if disconnected in done:
+				next_event.cancel()
+				break
+			elif next_event in done:
+				event, data = next_event.result()
+				message = 'event: {}\ndata: {}\n\n'.format(event, data)
+			else:
+				next_event.cancel()
+				message = ': keep-alive\n\n'
+			await send({'type': 'http.response.body', 'body': message.encode(), 'more_body': True})
+	finally:
+		broker.unsubscribe(channel, queue)
+		disconnected.cancel()
+
+
+async def notification_stream(scope, receive, send):
+	profile_id = await asyncio.get_event_loop().run_in_executor(None, get_profile_id, scope)
+	if profile_id is None:
+		await send_no_content(send)
+	else:
+		await stream_channel(notification_channel(profile_id), receive, send)
+
+
+async def comment_stream(scope, receive, send, pk):
+	await stream_channel(comment_channel(int(pk)), receive, send)
+
+
+# maps paths of event streams to their handlers. Named groups are passed to the handler as keyword arguments
+STREAMS = [
+	(re.compile(r'^/notifications/stream$'), notification_stream),
+	(re.compile(r'^/trip/(?P<pk>\d+)/comments/stream$'), comment_stream),
+]
+
+
+def find_stream(path):
+	"""
+	Returns (handler, kwargs) for the event stream served at path, or None if path isn't an event stream.
+	"""
+	for pattern, handler in STREAMS:
+		match = pattern.match(path)
+		if match:
+			return handler, match.groupdict()
+	return None
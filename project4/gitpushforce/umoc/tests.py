@@ -1,3 +1,1156 @@
-from django.test import TestCase
+from django.apps import apps as django_apps
+from django.conf import settings
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.core.management.sql import emit_post_migrate_signal
+from django.db import connection, transaction, IntegrityError, OperationalError
+from django.http import QueryDict
+from django.test import Client, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from unittest import skipUnless
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone, timedelta
+from importlib import import_module
+from io import StringIO
+import asyncio
+import json
+import re
+import time
 
-# Create your tests here.
+from gitpushforce.asgi import application
+
+from .admin import TripAdmin
+from .caching import add_cached_count, get_trips_version
+from .forms import AdminTripForm
+from .models import make_comment_path, UserProfile, Trip, Comment, Notification, LotteryEntry, ArchivedComment, ArchivedNotification
+from .reminders import send_trip_reminders
+from .events import broker, notification_channel, comment_channel
+from .search import search_available
+from .stats import SITE_STATS_TIMEOUT, get_site_stats, site_stat_key
+from .notifications import UNREAD_COUNT_TIMEOUT, unread_count_key, notify, enqueue_notification, deliver_queued_notifications, send_digests, get_unread_count, mark_notifications_seen, dismiss_notifications
+from .views import get_user_directory, get_upcoming_trips, get_trips_before, get_trips_after, get_trip_comments, get_active_notifications
+
+
+# returns SQLite's query plan for the given QuerySet, one step per line
+def explain(queryset):
+	sql, params = queryset.query.sql_with_params()
+	with connection.cursor() as cursor:
+		cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+		return '\n'.join(row[-1] for row in cursor.fetchall())
+
+
+@skipUnless(connection.vendor == 'sqlite', 'query plans are checked against SQLite')
+class QueryIndexTests(TestCase):
+	"""
+	Checks that the app's most frequent queries are answered from an index, without scanning the table or sorting the results separately. Update these if a view's QuerySet changes shape.
+	"""
+	def assertUsesIndex(self, queryset, index):
+		plan = explain(queryset)
+		self.assertIn('INDEX {}'.format(index), plan)
+		self.assertNotIn('TEMP B-TREE', plan)
+		
+	def test_upcoming_trips(self):
+		self.assertUsesIndex(get_upcoming_trips(), 'umoc_trip_start_time_idx')
+		
+	def test_trip_archive(self):
+		self.assertUsesIndex(get_trips_before((datetime.now(timezone.utc), 10)), 'umoc_trip_start_time_idx')
+		
+	def test_trip_finder(self):
+		self.assertUsesIndex(get_trips_after(Trip.objects.filter(start_time__gte=datetime.now(timezone.utc), tag='h')), 'umoc_trip_tag_start_idx')
+		
+	def test_user_directory(self):
+		self.assertUsesIndex(get_user_directory(after=10), 'umoc_profile_name_idx')
+		self.assertUsesIndex(get_user_directory(admin_level='l', after=10), 'umoc_profile_admin_level_idx')
+		
+	def test_trip_comments(self):
+		self.assertUsesIndex(get_trip_comments(1), 'umoc_comment_trip_path_idx')
+		self.assertUsesIndex(get_trip_comments(1, ArchivedComment), 'umoc_archcomment_path_idx')
+		
+	def test_active_notifications(self):
+		self.assertUsesIndex(get_active_notifications(1), 'umoc_notification_active_idx')
+		
+	def test_admins(self):
+		self.assertUsesIndex(UserProfile.objects.filter(admin_level__exact='a'), 'umoc_profile_admin_level_idx')
+		
+	def test_leader_choices(self):
+		self.assertUsesIndex(AdminTripForm.base_fields['leader'].queryset, 'umoc_profile_admin_level_idx')
+
+
+# creates and returns n UserProfiles (with Users) named user0, user1, ... or prefix0, prefix1, ...
+def create_profiles(n, prefix='user'):
+	profiles = []
+	for i in range(n):
+		user = User.objects.create(username='{}{}'.format(prefix, i))
+		profiles.append(UserProfile.objects.create(user=user, first_name='User', last_name=str(i), email='{}{}@example.com'.format(prefix, i)))
+	return profiles
+	
+	
+# creates and returns an upcoming Trip with the given capacity. Keyword arguments override other fields
+def create_trip(capacity, **kwargs):
+	start_time = datetime.now(timezone.utc) + timedelta(days=7)
+	fields = {'name': 'Trip', 'description': 'A trip', 'capacity': capacity, 'num_seats': capacity, 'start_time': start_time, 'end_time': start_time + timedelta(days=1)}
+	fields.update(kwargs)
+	return Trip.objects.create(**fields)
+
+
+# most times a user in test_parallel_joins_fill_trip_exactly tries to join, and the errors that make them try again
+JOIN_ATTEMPTS = 100
+LOCKED_PATTERN = re.compile(r'(database|table) is locked')
+
+
+class JoinTripTests(TransactionTestCase):
+	"""
+	Checks seat accounting when many users sign up for a trip at once.
+	"""
+	def test_parallel_joins_fill_trip_exactly(self):
+		trip = create_trip(20)
+		profiles = create_profiles(200)
+		
+		def join(profile):
+			try:
+				for attempt in range(JOIN_ATTEMPTS):
+					try:
+						return Trip.objects.get(pk=trip.pk).add_participant(profile)
+					except OperationalError as error:
+						# SQLite reports a table locked by another connection as an error. Try again shortly, as the user would, but fail on anything else or if it stays locked
+						if attempt == JOIN_ATTEMPTS - 1 or not LOCKED_PATTERN.search(str(error)):
+							raise
+						time.sleep(0.01)
+			finally:
+				connection.close()
+				
+		with ThreadPoolExecutor(max_workers=20) as pool:
+			results = list(pool.map(join, profiles))
+			
+		trip.refresh_from_db()
+		self.assertEqual(results.count(True), 20)
+		self.assertEqual(trip.participant_count, 20)
+		self.assertEqual(trip.participants.count(), 20)
+		self.assertEqual(trip.num_seats, 0)
+		
+	def test_leaving_frees_seat(self):
+		trip = create_trip(1)
+		first, second = create_profiles(2)
+		self.assertTrue(trip.add_participant(first))
+		self.assertFalse(trip.add_participant(second))
+		
+		trip.participants.remove(first)
+		trip.refresh_from_db()
+		self.assertEqual(trip.participant_count, 0)
+		self.assertEqual(trip.get_seats_remaining(), 1)
+		self.assertTrue(trip.add_participant(second))
+		
+		
+class WaitlistTests(TestCase):
+	"""
+	Checks waitlist ordering and promotion into full trips.
+	"""
+	def setUp(self):
+		self.trip = create_trip(1)
+		self.profiles = create_profiles(4)
+		self.trip.add_participant(self.profiles[0])
+		for profile in self.profiles[1:]:
+			self.trip.join_waitlist(profile)
+			
+	def test_positions(self):
+		self.assertEqual([self.trip.get_waitlist_position(profile) for profile in self.profiles], [None, 1, 2, 3])
+		self.trip.waitlist.filter(profile=self.profiles[1]).delete()
+		self.assertEqual(self.trip.get_waitlist_position(self.profiles[3]), 2)
+		with self.assertRaises(IntegrityError), transaction.atomic():
+			self.trip.join_waitlist(self.profiles[2])
+		
+	def test_promotes_head_of_queue(self):
+		self.trip.participants.remove(self.profiles[0])
+		self.assertEqual(self.trip.promote_waitlist(), [self.profiles[1]])
+		
+		self.trip.refresh_from_db()
+		self.assertEqual(list(self.trip.participants.all()), [self.profiles[1]])
+		self.assertEqual(self.trip.participant_count, 1)
+		self.assertEqual(self.trip.get_waitlist_position(self.profiles[2]), 1)
+		deliver_queued_notifications()
+		self.assertEqual(list(Notification.objects.values_list('recipient', flat=True)), [self.profiles[1].id])
+		# trip is full again, so nobody else moves up
+		self.assertEqual(self.trip.promote_waitlist(), [])
+		
+	def test_cancelled_trip_promotes_nobody(self):
+		Trip.objects.filter(pk=self.trip.pk).update(cancelled=True)
+		self.client.force_login(self.profiles[0].user)
+		self.client.get(reverse('trip_leave', args=[self.trip.pk]))
+		
+		self.assertFalse(self.trip.participants.exists())
+		self.assertEqual(self.trip.get_waitlist_position(self.profiles[1]), 1)
+		self.assertFalse(Notification.objects.filter(message__startswith='A seat opened up').exists())
+		
+	def test_cancelling_clears_waitlist(self):
+		leader = create_profiles(1, prefix='leader')[0]
+		Trip.objects.filter(pk=self.trip.pk).update(leader=leader)
+		self.client.force_login(leader.user)
+		self.client.get(reverse('trip_cancel', args=[self.trip.pk]))
+		deliver_queued_notifications()
+		
+		self.assertFalse(self.trip.waitlist.exists())
+		self.assertEqual(set(Notification.objects.filter(message='Trip was cancelled').values_list('recipient', flat=True)), {profile.id for profile in self.profiles})
+		
+	def test_constant_queries(self):
+		def count_queries(trip, profile):
+			with CaptureQueriesContext(connection) as position_queries:
+				trip.get_waitlist_position(profile)
+			trip.participants.clear()
+			with CaptureQueriesContext(connection) as promotion_queries:
+				trip.promote_waitlist()
+			return len(position_queries), len(promotion_queries)
+			
+		long_trip = create_trip(1, name='Long trip')
+		for profile in create_profiles(20, prefix='waiting'):
+			long_trip.join_waitlist(profile)
+		self.assertEqual(count_queries(self.trip, self.profiles[3]), count_queries(long_trip, profile))
+		self.assertEqual(count_queries(long_trip, profile)[0], 1)
+		
+		
+class LotteryTests(TestCase):
+	"""
+	Checks that lottery draws fill trips and waitlists exactly once, and are reproducible.
+	"""
+	def setUp(self):
+		self.trip = create_trip(3, lottery_closes=datetime.now(timezone.utc) - timedelta(minutes=1))
+		self.profiles = create_profiles(10)
+		for profile in self.profiles:
+			LotteryEntry.objects.create(trip=self.trip, profile=profile)
+			
+	def get_draw(self):
+		return list(self.trip.participants.order_by('pk')), [entry.profile for entry in self.trip.waitlist.select_related('profile')]
+		
+	def test_draw(self):
+		call_command('draw_lotteries', seed='test', stdout=StringIO())
+		participants, waitlist = self.get_draw()
+		self.trip.refresh_from_db()
+		self.assertTrue(self.trip.lottery_drawn)
+		self.assertEqual(len(participants), 3)
+		self.assertEqual(self.trip.participant_count, 3)
+		self.assertEqual(self.trip.num_seats, 0)
+		self.assertEqual(sorted(participants + waitlist, key=lambda profile: profile.pk), self.profiles)
+		self.assertEqual(self.trip.get_waitlist_position(waitlist[-1]), 7)
+		self.assertEqual(Notification.objects.count(), 10)
+		# already drawn
+		self.assertIsNone(self.trip.draw_lottery('test'))
+		
+	def test_cancelled_trip_not_drawn(self):
+		Trip.objects.filter(pk=self.trip.pk).update(cancelled=True)
+		call_command('draw_lotteries', seed='test', stdout=StringIO())
+		self.trip.refresh_from_db()
+		self.assertFalse(self.trip.lottery_drawn)
+		self.assertIsNone(self.trip.draw_lottery('test'))
+		self.assertEqual(self.get_draw(), ([], []))
+		self.assertFalse(Notification.objects.exists())
+		
+	def test_same_seed_same_draw(self):
+		self.trip.draw_lottery('test')
+		first_draw = self.get_draw()
+		
+		self.trip.participants.clear()
+		self.trip.waitlist.all().delete()
+		Trip.objects.filter(pk=self.trip.pk).update(lottery_drawn=False)
+		self.trip.refresh_from_db()
+		self.trip.draw_lottery('test')
+		self.assertEqual(self.get_draw(), first_draw)
+		
+		
+class NotificationFanOutTests(TestCase):
+	"""
+	Checks that notifying many users costs a constant number of queries, and that queued notifications are delivered once.
+	"""
+	def test_constant_queries(self):
+		profile_ids = [profile.id for profile in create_profiles(60)]
+		with CaptureQueriesContext(connection) as few:
+			notify(profile_ids[:5], 'Few')
+		with CaptureQueriesContext(connection) as many:
+			notify(profile_ids, 'Many')
+		self.assertEqual(len(few), len(many))
+		self.assertEqual(Notification.objects.filter(message='Many').count(), 60)
+		
+	def test_cancel_trip_notifies_participants(self):
+		admin, *participants = create_profiles(4)
+		admin.admin_level = 'a'
+		admin.save()
+		trip = create_trip(5)
+		for profile in participants:
+			trip.add_participant(profile)
+			
+		self.client.force_login(admin.user)
+		self.client.get(reverse('trip_cancel', args=[trip.pk]))
+		self.assertFalse(Notification.objects.exists())
+		self.assertEqual(deliver_queued_notifications(), 1)
+		self.assertEqual(set(Notification.objects.filter(message='Trip was cancelled').values_list('recipient_id', flat=True)), {profile.id for profile in participants})
+		
+	def test_outbox(self):
+		profile_ids = [profile.id for profile in create_profiles(3)]
+		with self.assertNumQueries(1):
+			enqueue_notification(profile_ids, 'Queued')
+		enqueue_notification(profile_ids[:1], 'Also queued')
+		UserProfile.objects.filter(pk=profile_ids[2]).delete()
+		
+		self.assertEqual(deliver_queued_notifications(batch_size=1), 1)
+		self.assertEqual(deliver_queued_notifications(), 1)
+		self.assertEqual(deliver_queued_notifications(), 0)
+		self.assertEqual(set(Notification.objects.filter(message='Queued').values_list('recipient_id', flat=True)), set(profile_ids[:2]))
+		self.assertEqual(Notification.objects.filter(message='Also queued').count(), 1)
+		
+		
+class NotificationCoalescingTests(TestCase):
+	"""
+	Checks that notifications of coalesced kinds are merged while undismissed, and daily digests.
+	"""
+	def setUp(self):
+		self.recipient, self.other = create_profiles(2)
+		
+	def reply(self, name, link='/trip/1/#comment-1'):
+		notify([self.recipient.id], '{} replied to your comment'.format(name), link, kind='reply', actor=name)
+		
+	def test_replies_merge(self):
+		for i in range(20):
+			self.reply('User {}'.format(i))
+		# a recent actor again
+		self.reply('User 18')
+		self.reply('Ann Lee', link='/trip/1/#comment-2')
+		notify([self.recipient.id], 'Unrelated')
+		
+		notifications = get_active_notifications(self.recipient.id)
+		self.assertEqual(len(notifications), 3)
+		merged = Notification.objects.get(kind='reply', link='/trip/1/#comment-1')
+		self.assertEqual(merged.count, 20)
+		self.assertEqual(merged.message, 'User 18 and 19 others replied to your comment')
+		self.assertEqual(merged.get_actors(), ['User 18', 'User 19', 'User 17'])
+		
+	def test_dismissed_not_merged(self):
+		self.reply('Ann Lee')
+		Notification.objects.update(dismissed=True)
+		self.reply('Bob Ray')
+		self.assertEqual(Notification.objects.get(dismissed=False).message, 'Bob Ray replied to your comment')
+		
+	def test_digest(self):
+		UserProfile.objects.filter(pk=self.recipient.pk).update(notification_digest=True)
+		self.reply('Ann Lee')
+		self.reply('Bob Ray')
+		notify([self.other.id], 'Not in a digest')
+		
+		self.assertEqual(send_digests(), 1)
+		self.assertEqual(len(mail.outbox), 1)
+		self.assertEqual(mail.outbox[0].to, [self.recipient.email])
+		self.assertIn('Bob Ray and Ann Lee replied to your comment', mail.outbox[0].body)
+		# nothing new since
+		self.assertEqual(send_digests(), 0)
+		
+	def test_digest_ends_at_newest_notification(self):
+		UserProfile.objects.filter(pk__in=[self.recipient.pk, self.other.pk]).update(notification_digest=True)
+		notify([self.recipient.id], 'First')
+		# created while the digest was being sent
+		notify([self.recipient.id], 'Second')
+		second = Notification.objects.get(message='Second')
+		Notification.objects.filter(pk=second.pk).update(time_stamp=second.time_stamp + timedelta(seconds=1))
+		
+		self.assertEqual(send_digests(), 1)
+		self.recipient.refresh_from_db()
+		self.other.refresh_from_db()
+		self.assertEqual(self.recipient.last_digest, second.time_stamp + timedelta(seconds=1))
+		# sent nothing, so it keeps its place
+		self.assertIsNone(self.other.last_digest)
+		self.assertEqual(send_digests(), 0)
+		self.assertEqual(len(mail.outbox), 1)
+		
+		
+class UnreadCountTests(TransactionTestCase):
+	"""
+	Checks that the cached unread count follows notifications as they are created, seen and dismissed, and that bulk updates run one query. A TransactionTestCase, since counts are adjusted once transactions commit.
+	"""
+	def setUp(self):
+		cache.clear()
+		self.profile, = create_profiles(1)
+		self.client.force_login(self.profile.user)
+		
+	def get_unread(self):
+		return self.client.get(reverse('notification_count')).json()['unread']
+		
+	def test_count(self):
+		self.assertEqual(self.get_unread(), 0)
+		notify([self.profile.id], 'First')
+		Notification(recipient=self.profile, message='Second').save()
+		notify([self.profile.id], 'Reply', kind='reply', actor='Ann Lee')
+		notify([self.profile.id], 'Reply', kind='reply', actor='Bob Ray')
+		
+		with CaptureQueriesContext(connection) as queries:
+			self.assertEqual(self.get_unread(), 3)
+		self.assertFalse([query for query in queries if 'umoc_notification' in query['sql']])
+		
+		response = self.client.post(reverse('notifications'), {'dismissed_id': Notification.objects.get(message='Second').id})
+		self.assertEqual(response.json()['unread'], 2)
+		self.assertEqual(get_unread_count(self.profile.id), Notification.objects.filter(dismissed=False, seen=False).count())
+		
+	def test_count_missing_a_change(self):
+		# counted before a notification committed, and cached after the notification found no count to adjust
+		stale = Notification.objects.filter(recipient=self.profile).count()
+		notify([self.profile.id], 'Missed')
+		add_cached_count(unread_count_key(self.profile.id), stale, UNREAD_COUNT_TIMEOUT)
+		self.assertEqual(self.get_unread(), 1)
+		
+	def test_count_missing_a_dismissal(self):
+		self.assertEqual(self.get_unread(), 0)
+		notify([self.profile.id] * 3, 'Stale')
+		self.assertEqual(self.get_unread(), 3)
+		# counted before the dismissal committed, and cached after it dropped the count
+		stale = Notification.objects.filter(recipient=self.profile, dismissed=False, seen=False).count()
+		dismiss_notifications(self.profile.id)
+		add_cached_count(unread_count_key(self.profile.id), stale, UNREAD_COUNT_TIMEOUT)
+		self.assertEqual(self.get_unread(), 0)
+		
+	def test_lottery(self):
+		self.assertEqual(self.get_unread(), 0)
+		trip = create_trip(1, lottery_closes=datetime.now(timezone.utc) - timedelta(minutes=1))
+		for profile in [self.profile] + create_profiles(2, prefix='other'):
+			LotteryEntry.objects.create(trip=trip, profile=profile)
+		trip.draw_lottery('test')
+		self.assertEqual(self.get_unread(), 1)
+		
+	def test_bulk_updates(self):
+		other, = create_profiles(1, prefix='other')
+		notify([self.profile.id] * 200 + [other.id], 'Stale')
+		ids = list(Notification.objects.filter(recipient=self.profile).values_list('id', flat=True))
+		other_id = Notification.objects.get(recipient=other).id
+		self.assertEqual(self.get_unread(), 200)
+		
+		with CaptureQueriesContext(connection) as queries:
+			mark_notifications_seen(self.profile.id, ids[:150] + [other_id])
+		self.assertEqual(len(queries), 1)
+		self.assertEqual(self.get_unread(), 50)
+		
+		response = self.client.post(reverse('notifications'), {'dismissed_ids[]': ids[:10] + [other_id]})
+		self.assertEqual(response.json()['unread'], 50)
+		with CaptureQueriesContext(connection) as queries:
+			self.assertEqual(dismiss_notifications(self.profile.id), 190)
+		self.assertEqual(len(queries), 1)
+		self.assertEqual(self.get_unread(), 0)
+		self.assertFalse(Notification.objects.get(pk=other_id).dismissed)
+		self.assertFalse(Notification.objects.get(pk=other_id).seen)
+		
+		
+class EventStreamTests(TransactionTestCase):
+	"""
+	Drives the ASGI application with fake scope, receive and send callables, checking that comments and notifications published once their transaction commits reach only the streams subscribed to them, and that streams unsubscribe when the client disconnects. A TransactionTestCase, since events are published on commit.
+	"""
+	def setUp(self):
+		cache.clear()
+		self.profile, self.other = create_profiles(2)
+		self.trip = create_trip(5)
+		self.other_trip = create_trip(5, name='Other trip')
+		self.loop = asyncio.new_event_loop()
+		asyncio.set_event_loop(self.loop)
+		
+	def tearDown(self):
+		self.loop.close()
+		asyncio.set_event_loop(None)
+		
+	# starts an ASGI request for given path with given cookie header, returning (task, queue of messages to receive, list of messages sent)
+	def open(self, path, cookie=''):
+		scope = {'type': 'http', 'method': 'GET', 'path': path, 'query_string': b'', 'headers': [(b'host', b'testserver')] + ([(b'cookie', cookie.encode())] if cookie else [])}
+		received = asyncio.Queue()
+		sent = []
+		
+		async def send(message):
+			sent.append(message)
+		return asyncio.ensure_future(application(scope, received.get, send)), received, sent
+		
+	# returns cookie header of a new session signed in as given UserProfile
+	def sign_in(self, profile):
+		client = Client()
+		client.force_login(profile.user)
+		return '{}={}'.format(settings.SESSION_COOKIE_NAME, client.cookies[settings.SESSION_COOKIE_NAME].value)
+		
+	# returns once every given channel has a subscriber, or fails after a few seconds
+	async def wait_for_subscribers(self, *channels):
+		for attempt in range(500):
+			if all(broker.has_subscribers(channel) for channel in channels):
+				return
+			await asyncio.sleep(0.01)
+		self.fail('Streams never subscribed to {}'.format(channels))
+		
+	# returns the events in the given sent messages, as (event, data) tuples
+	def get_events(self, sent):
+		body = b''.join(message.get('body', b'') for message in sent).decode()
+		return re.findall(r'event: (\w+)\ndata: (.*)\n\n', body)
+		
+	# disconnects the clients of given streams and waits for them to finish
+	async def close(self, *streams):
+		for task, received, sent in streams:
+			received.put_nowait({'type': 'http.disconnect'})
+		await asyncio.wait_for(asyncio.gather(*[task for task, received, sent in streams]), 5)
+		
+	def test_comment_stream(self):
+		async def run():
+			trip_stream = self.open('/trip/{}/comments/stream'.format(self.trip.pk))
+			other_stream = self.open('/trip/{}/comments/stream'.format(self.other_trip.pk))
+			await self.wait_for_subscribers(comment_channel(self.trip.pk), comment_channel(self.other_trip.pk))
+			
+			with transaction.atomic():
+				comment = Comment(author=self.profile, text='Hello', trip=self.trip, depth=0)
+				comment.save()
+				# nothing is published until the transaction commits
+				await asyncio.sleep(0.05)
+				self.assertEqual(self.get_events(trip_stream[2]), [])
+			await asyncio.sleep(0.05)
+			
+			await self.close(trip_stream, other_stream)
+			return comment, trip_stream[2], other_stream[2]
+			
+		comment, sent, other_sent = self.loop.run_until_complete(run())
+		self.assertEqual(sent[0]['headers'][0], (b'content-type', b'text/event-stream'))
+		events = self.get_events(sent)
+		self.assertEqual([event for event, data in events], ['comment'])
+		self.assertEqual(json.loads(events[0][1])['id'], comment.id)
+		self.assertEqual(self.get_events(other_sent), [])
+		self.assertFalse(broker.has_subscribers(comment_channel(self.trip.pk)))
+		self.assertFalse(broker.has_subscribers(comment_channel(self.other_trip.pk)))
+		
+	def test_notification_stream(self):
+		cookie, other_cookie = self.sign_in(self.profile), self.sign_in(self.other)
+		
+		async def run():
+			stream = self.open('/notifications/stream', cookie)
+			other_stream = self.open('/notifications/stream', other_cookie)
+			await self.wait_for_subscribers(notification_channel(self.profile.id), notification_channel(self.other.id))
+			
+			notification = Notification(recipient=self.profile, message='Hello')
+			notification.save()
+			notify([self.other.id], 'Many at once')
+			await asyncio.sleep(0.05)
+			
+			await self.close(stream, other_stream)
+			return notification, stream[2], other_stream[2]
+			
+		notification, sent, other_sent = self.loop.run_until_complete(run())
+		events = self.get_events(sent)
+		self.assertEqual([event for event, data in events], ['notification'])
+		self.assertEqual(json.loads(events[0][1])['id'], notification.id)
+		# bulk-created notifications can't be pushed one by one, so pages reload them instead
+		self.assertEqual(self.get_events(other_sent), [('refresh', '')])
+		self.assertFalse(broker.has_subscribers(notification_channel(self.profile.id)))
+		self.assertFalse(broker.has_subscribers(notification_channel(self.other.id)))
+		
+	def test_signed_out_and_other_requests(self):
+		async def run():
+			stream = self.open('/notifications/stream')
+			page = self.open(reverse('trip_autocomplete'))
+			page[1].put_nowait({'type': 'http.request', 'body': b''})
+			await asyncio.wait_for(asyncio.gather(stream[0], page[0]), 5)
+			return stream[2], page[2]
+			
+		sent, page_sent = self.loop.run_until_complete(run())
+		# no content tells EventSource not to reconnect
+		self.assertEqual(sent[0]['status'], 204)
+		# other requests are served by the WSGI application
+		self.assertEqual(page_sent[0]['status'], 200)
+		self.assertEqual(json.loads(page_sent[1]['body']), {'names': []})
+		
+		
+class SiteStatsTests(TransactionTestCase):
+	"""
+	Checks that the homepage statistics are served from the cache, and stay exact as users and trips come and go. A TransactionTestCase, since statistics are adjusted once transactions commit.
+	"""
+	def setUp(self):
+		cache.clear()
+		
+	def assertStatsExact(self):
+		self.assertEqual(get_site_stats(), {
+			'num_users': UserProfile.objects.count(),
+			'num_trips': Trip.objects.count(),
+			'num_admins': UserProfile.objects.filter(admin_level='a').count(),
+		})
+		
+	def test_stats(self):
+		# counted once, so the changes below are adjusted rather than left to a recount
+		get_site_stats()
+		leader, member = create_profiles(2)
+		self.assertStatsExact()
+		
+		admin, = create_profiles(1, prefix='admin')
+		admin.admin_level = 'a'
+		admin.save()
+		trip = create_trip(5, leader=leader)
+		self.assertStatsExact()
+		
+		with CaptureQueriesContext(connection) as queries:
+			response = self.client.get(reverse('index'))
+		self.assertEqual(response.context['num_admins'], 1)
+		self.assertFalse([query for query in queries if 'COUNT' in query['sql']])
+		
+		trip.delete()
+		member.delete()
+		admin.admin_level = 'u'
+		admin.save()
+		self.assertStatsExact()
+		
+	def test_count_missing_a_change(self):
+		# counted before a trip committed, and cached after the trip found no count to adjust
+		stale = Trip.objects.count()
+		create_trip(5)
+		add_cached_count(site_stat_key('num_trips'), stale, SITE_STATS_TIMEOUT)
+		self.assertStatsExact()
+		
+		
+class PageCacheTests(TransactionTestCase):
+	"""
+	Checks that logged-out visitors get trip pages from the cache, which is refreshed as soon as a trip, its roster or a name shown on it changes, while logged-in users still get their own page. A TransactionTestCase, since the cache is refreshed once transactions commit.
+	"""
+	def setUp(self):
+		cache.clear()
+		self.leader, self.member = create_profiles(2)
+		self.trip = create_trip(1, leader=self.leader)
+		
+	def test_anonymous(self):
+		self.client.get(reverse('dashboard'))
+		with CaptureQueriesContext(connection) as queries:
+			response = self.client.get(reverse('dashboard'))
+		# only the conditional GET lookup
+		self.assertEqual(len(queries), 1)
+		self.assertNotContains(response, "btn-danger'>Cancelled")
+		
+		self.trip.cancelled = True
+		self.trip.save()
+		self.assertContains(self.client.get(reverse('dashboard')), "btn-danger'>Cancelled")
+		
+		self.assertContains(self.client.get(reverse('trip_info', args=[self.trip.id])), '1 of 1 Seats Remaining')
+		self.trip.participants.add(self.member)
+		self.assertContains(self.client.get(reverse('trip_info', args=[self.trip.id])), '0 of 1 Seats Remaining')
+		
+	def test_profile_edits(self):
+		version = get_trips_version()
+		self.leader.phone_num = '5555555555'
+		self.leader.save()
+		self.member.last_name = 'Ray'
+		self.member.save(update_fields=['last_name'])
+		self.leader.save(update_fields=['phone_num'])
+		# nobody on a trip page changed
+		self.assertEqual(get_trips_version(), version)
+		
+		self.assertContains(self.client.get(reverse('dashboard')), '>User 0<')
+		self.leader.last_name = 'Lee'
+		self.leader.save()
+		self.assertContains(self.client.get(reverse('dashboard')), '>User Lee<')
+		
+		# changes what the member's own trip pages offer them
+		version = get_trips_version()
+		self.member.can_join_trip = True
+		self.member.save()
+		self.assertNotEqual(get_trips_version(), version)
+		
+	def test_csrf(self):
+		client = Client(enforce_csrf_checks=True)
+		self.client.get(reverse('index'))
+		response = client.get(reverse('index'))
+		token = re.search('name="csrfmiddlewaretoken" value="([^"]+)"', response.content.decode()).group(1)
+		# the visitor's token is accepted, where the first visitor's would be refused
+		self.assertNotEqual(client.post(reverse('login'), {'csrfmiddlewaretoken': token, 'username': 'user0', 'password': 'wrong'}).status_code, 403)
+		
+	def test_authenticated(self):
+		self.client.get(reverse('dashboard'))
+		self.client.force_login(self.member.user)
+		self.assertContains(self.client.get(reverse('dashboard')), 'Log Out')
+		
+		
+class ConditionalGetTests(TestCase):
+	"""
+	Checks that trip pages are answered with a 304, after one query, until the trip's page changes.
+	"""
+	def setUp(self):
+		cache.clear()
+		self.leader, self.member = create_profiles(2)
+		self.trip = create_trip(2, leader=self.leader)
+		self.client.force_login(self.member.user)
+		
+	# returns the response to a GET of given url, conditional on the given earlier response
+	def get_again(self, url, response):
+		return self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'], HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+		
+	def test_not_modified(self):
+		for url in [reverse('dashboard'), reverse('all_trips'), reverse('trip_info', args=[self.trip.id]), reverse('trip_comments', args=[self.trip.id])]:
+			response = self.client.get(url)
+			self.assertEqual(response.status_code, 200)
+			with CaptureQueriesContext(connection) as queries:
+				self.assertEqual(self.get_again(url, response).status_code, 304)
+			# besides loading the session and user
+			self.assertEqual(len([query for query in queries if 'umoc_trip' in query['sql']]), 1)
+			
+	def test_always_revalidated(self):
+		url = reverse('trip_comments', args=[self.trip.id])
+		response = self.client.get(url, {'since': 0})
+		self.assertEqual(set(response['Cache-Control'].split(', ')), {'no-cache', 'private'})
+		response = self.get_again(url + '?since=0', response)
+		self.assertEqual(response.status_code, 304)
+		self.assertEqual(set(response['Cache-Control'].split(', ')), {'no-cache', 'private'})
+		
+		self.client.logout()
+		response = self.client.get(reverse('dashboard'))
+		self.assertEqual(response['Cache-Control'], 'no-cache')
+		response = self.get_again(reverse('dashboard'), response)
+		self.assertEqual(response.status_code, 304)
+		self.assertEqual(response['Cache-Control'], 'no-cache')
+		
+	def test_modified(self):
+		url = reverse('trip_info', args=[self.trip.id])
+		response = self.client.get(url)
+		time.sleep(0.01)
+		Comment.objects.create(author=self.leader, text='Hello', trip=self.trip, depth=0)
+		response = self.get_again(url, response)
+		self.assertEqual(response.status_code, 200)
+		
+		self.trip.participants.add(self.member)
+		self.assertEqual(self.get_again(url, response).status_code, 200)
+		
+		# another user's page differs
+		response = self.client.get(url)
+		self.client.force_login(self.leader.user)
+		self.assertEqual(self.get_again(url, response).status_code, 200)
+		
+		
+class TripListingTests(TestCase):
+	"""
+	Checks that trip listings run the same number of queries however many trips they show.
+	"""
+	def setUp(self):
+		self.leader, self.member = create_profiles(2)
+		self.client.force_login(self.member.user)
+		
+	# adds n upcoming trips, some joined by self.member and some full, and returns the number of queries the dashboard and all_trips then run
+	def count_queries(self, n):
+		start_time = datetime.now(timezone.utc) + timedelta(days=7)
+		Trip.objects.all().delete()
+		Trip.objects.bulk_create([Trip(name='Trip {}'.format(i), description='A trip', capacity=5, num_seats=5, start_time=start_time, end_time=start_time + timedelta(days=1), leader=self.leader) for i in range(n)])
+		# the first and last, so both are on the first pages of the dashboard (oldest first) and all_trips (newest first)
+		trips = list(Trip.objects.order_by('id'))
+		for trip in (trips[0], trips[-1]):
+			trip.participants.add(self.member)
+		Trip.objects.filter(pk__in=[trips[1].pk, trips[-2].pk]).update(participant_count=5)
+		
+		counts = []
+		for url in [reverse('dashboard'), reverse('all_trips')]:
+			# rendered afresh, not from cached fragments
+			cache.clear()
+			with CaptureQueriesContext(connection) as queries:
+				response = self.client.get(url)
+			self.assertContains(response, '>Joined<')
+			self.assertContains(response, '>Full<')
+			counts.append(len(queries))
+		return counts
+		
+	def test_constant_queries(self):
+		self.assertEqual(self.count_queries(10), self.count_queries(1000))
+		
+		
+class TripArchiveTests(TestCase):
+	"""
+	Checks that the trip archive pages through every trip in order, each page costing the same, and jumps to months.
+	"""
+	def setUp(self):
+		cache.clear()
+		start_time = datetime(2020, 1, 1, 12, tzinfo=timezone.utc)
+		# pairs of trips starting at the same time, across several months
+		Trip.objects.bulk_create([Trip(name='Trip {}'.format(i), description='A trip', capacity=5, num_seats=5, start_time=start_time + timedelta(days=i // 2 * 10), end_time=start_time + timedelta(days=i // 2 * 10 + 1)) for i in range(45)])
+		
+	def test_pages(self):
+		seen = []
+		counts = []
+		url = reverse('all_trips')
+		while url:
+			with CaptureQueriesContext(connection) as queries:
+				response = self.client.get(url)
+			counts.append(len(queries))
+			seen.extend(trip.id for trip in response.context['trips'])
+			url = '{}?{}'.format(reverse('all_trips'), response.context['next_query']) if response.context['next_query'] else None
+		self.assertEqual(seen, list(Trip.objects.order_by('-start_time', '-id').values_list('id', flat=True)))
+		self.assertEqual(len(counts), 3)
+		# the first page also counted the months
+		self.assertEqual(counts[1], counts[2])
+		self.assertLessEqual(counts[1], counts[0])
+		
+	def test_months(self):
+		response = self.client.get(reverse('all_trips'), {'month': '2020-02'})
+		self.assertEqual(response.context['trips'][0].start_time.month, 2)
+		years = response.context['years']
+		self.assertEqual(years[0]['year'], 2020)
+		self.assertEqual(sum(month['count'] for year in years for month in year['months']), 45)
+		self.assertEqual(self.client.get(reverse('all_trips'), {'month': '2020-13'}).status_code, 404)
+		self.assertEqual(self.client.get(reverse('all_trips'), {'after': 'x_1'}).status_code, 404)
+		
+		
+class TripFinderTests(TestCase):
+	"""
+	Checks that the Trip Finder filters trips and counts its facets, with the same number of queries however many trips there are.
+	"""
+	def setUp(self):
+		cache.clear()
+		self.leader, = create_profiles(1)
+		self.leader.admin_level = 'l'
+		self.leader.save()
+		
+	# adds n upcoming trips, alternating between hiking and biking, in two months, the first of them led by self.leader and cancelled
+	def add_trips(self, n):
+		start_time = datetime.now(timezone.utc).replace(day=1, hour=12) + timedelta(days=40)
+		Trip.objects.bulk_create([Trip(name='Trip {}'.format(i), description='A trip', tag='hb'[i % 2], capacity=5, num_seats=5, start_time=start_time + timedelta(days=i % 2 * 31), end_time=start_time + timedelta(days=i % 2 * 31 + 1)) for i in range(n)])
+		Trip.objects.filter(pk=Trip.objects.order_by('id')[0].pk).update(leader=self.leader, cancelled=True)
+		
+	def test_filters(self):
+		self.add_trips(10)
+		response = self.client.get(reverse('dashboard'), {'tag': 'h'})
+		self.assertEqual({trip.tag for trip in response.context['trips']}, {'h'})
+		self.assertEqual([(tag['tag'], tag['count']) for tag in response.context['tags']], [('h', 5), ('b', 5)])
+		self.assertEqual([month['count'] for month in response.context['months']], [5])
+		
+		response = self.client.get(reverse('dashboard'), {'leader': self.leader.id, 'cancelled': 'yes'})
+		self.assertEqual(len(response.context['trips']), 1)
+		self.assertEqual(len(self.client.get(reverse('dashboard'), {'cancelled': 'no', 'seats': 'on'}).context['trips']), 9)
+		self.assertEqual(self.client.get(reverse('dashboard'), {'tag': 'x'}).status_code, 404)
+		
+	def test_month_links_find_what_they_count(self):
+		self.add_trips(4)
+		now = datetime.now(timezone.utc)
+		# earlier this month, so only found from a start date before now
+		create_trip(5, start_time=now - timedelta(minutes=1), end_time=now + timedelta(hours=1))
+		create_trip(5, start_time=now + timedelta(hours=1), end_time=now + timedelta(hours=2))
+		
+		self.client.force_login(self.leader.user)
+		for params in ({}, {'start': (now - timedelta(days=1)).date().isoformat()}):
+			months = self.client.get(reverse('dashboard'), params).context['months']
+			self.assertEqual(sum(month['count'] for month in months), 5 + bool(params))
+			for month in months:
+				self.assertEqual(len(self.client.get(reverse('dashboard'), QueryDict(month['query'])).context['trips']), month['count'])
+				
+	def test_constant_queries(self):
+		counts = []
+		for n in (10, 200):
+			self.add_trips(n)
+			cache.clear()
+			with CaptureQueriesContext(connection) as queries:
+				response = self.client.get(reverse('dashboard'), {'tag': 'b', 'cancelled': 'no'})
+			counts.append(len(queries))
+		self.assertEqual(counts[0], counts[1])
+		self.assertEqual(len(response.context['trips']), 20)
+		
+		# the next page continues where the first ended
+		after = self.client.get(reverse('dashboard'), QueryDict(response.context['next_query']))
+		ids = [trip.id for trip in response.context['trips'] + after.context['trips']]
+		self.assertEqual(ids, list(Trip.objects.filter(tag='b').order_by('start_time', 'id').values_list('id', flat=True)[:40]))
+		
+		
+@skipUnless(search_available(), 'trip search uses SQLite FTS5')
+class TripSearchTests(TestCase):
+	"""
+	Checks that the full-text index follows trips as they are added, renamed and deleted, and ranks matches in names first.
+	"""
+	def setUp(self):
+		cache.clear()
+		self.rag = create_trip(5, name='Old Rag', description='A classic rock scramble')
+		self.seneca = create_trip(5, name='Seneca Rocks', description='Climbing trip, old-school style')
+		create_trip(5, name='Quabbin', description='Paddle')
+		# logged in, so pages aren't served from the cache
+		self.client.force_login(create_profiles(1)[0].user)
+		
+	def search(self, text):
+		return [trip.id for trip in self.client.get(reverse('trip_search'), {'q': text}).context['trips']]
+		
+	def test_search(self):
+		self.assertEqual(self.search('old'), [self.rag.id, self.seneca.id])
+		self.assertEqual(self.search('seneca roc'), [self.seneca.id])
+		self.assertEqual(self.search('"rock" OR'), [])
+		self.assertEqual(self.search(''), [])
+		
+		self.rag.name = 'Whiteface'
+		self.rag.save()
+		Trip.objects.filter(pk=self.seneca.pk).delete()
+		self.assertEqual(self.search('old'), [])
+		self.assertEqual(self.search('whiteface'), [self.rag.id])
+		
+	def test_lost_triggers(self):
+		# as when a migration rebuilds umoc_trip
+		with connection.cursor() as cursor:
+			cursor.execute('DROP TRIGGER umoc_trip_search_update')
+		with self.assertRaisesMessage(ImproperlyConfigured, 'umoc_trip_search_update'):
+			emit_post_migrate_signal(0, False, 'default')
+			
+		Trip.objects.filter(pk=self.rag.pk).update(name='Whiteface')
+		call_command('rebuild_trip_search', stdout=StringIO())
+		emit_post_migrate_signal(0, False, 'default')
+		self.assertEqual(self.search('whiteface'), [self.rag.id])
+		
+	def test_admin(self):
+		queryset, duplicates = TripAdmin(Trip, admin.site).get_search_results(None, Trip.objects.all(), 'rocks')
+		self.assertEqual(list(queryset), [self.seneca])
+		
+		
+class AutocompleteTests(TransactionTestCase):
+	"""
+	Checks that trip names are completed from memory, and that the index is rebuilt once a trip is created or renamed, but not when its roster changes. A TransactionTestCase, since the trip names version changes once transactions commit.
+	"""
+	def setUp(self):
+		cache.clear()
+		for name in ['Old Rag', 'Seneca Rocks', 'Rumney', 'Ragged Mountain']:
+			create_trip(5, name=name)
+			
+	def complete(self, prefix):
+		response = self.client.get(reverse('trip_autocomplete'), {'q': prefix})
+		self.assertIn('max-age', response['Cache-Control'])
+		return response.json()['names']
+		
+	def test_complete(self):
+		self.assertEqual(self.complete('rag'), ['Ragged Mountain', 'Old Rag'])
+		with CaptureQueriesContext(connection) as queries:
+			self.assertEqual(self.complete('SEN'), ['Seneca Rocks'])
+		self.assertEqual(len(queries), 0)
+		self.assertEqual(self.complete(' '), [])
+		
+		create_trip(5, name='Rag Doll')
+		self.assertEqual(self.complete('rag'), ['Rag Doll', 'Ragged Mountain', 'Old Rag'])
+		
+	def test_rebuilt_on_rename_only(self):
+		self.complete('rag')
+		trip = Trip.objects.get(name='Rumney')
+		trip.add_participant(create_profiles(1)[0])
+		trip.description = 'Sport climbing'
+		trip.save()
+		with CaptureQueriesContext(connection) as queries:
+			self.complete('rum')
+		self.assertEqual(len(queries), 0)
+		
+		trip.name = 'Rumney Rattlesnake'
+		trip.save(update_fields=['name'])
+		self.assertEqual(self.complete('ratt'), ['Rumney Rattlesnake'])
+		Trip.objects.filter(name='Old Rag').delete()
+		self.assertEqual(self.complete('rag'), ['Ragged Mountain'])
+		
+		
+class UserDirectoryTests(TestCase):
+	"""
+	Checks that the admin user directory pages through matching users in name order, one query per page.
+	"""
+	def setUp(self):
+		self.admin, = create_profiles(1, prefix='admin')
+		self.admin.admin_level = 'a'
+		self.admin.save()
+		self.client.force_login(self.admin.user)
+		# several users share each name
+		for i, profile in enumerate(create_profiles(25)):
+			profile.last_name = 'Lee' if i % 2 else 'Ray'
+			profile.first_name = 'Ann' if i % 3 else 'Bob'
+			profile.admin_level = 'l' if i % 5 == 0 else 'u'
+			profile.save()
+			
+	# returns the users listed page by page by admin_users with the given parameters, checking each page is one query
+	def list_users(self, **params):
+		users = []
+		params['limit'] = 4
+		while True:
+			with CaptureQueriesContext(connection) as queries:
+				result = self.client.get(reverse('admin_users'), params).json()
+			self.assertEqual(len([query for query in queries if 'ORDER BY' in query['sql']]), 1)
+			users.extend(user['id'] for user in result['users'])
+			if result['next'] is None:
+				return users
+			params['after'] = result['next']
+			
+	def test_pages(self):
+		self.assertContains(self.client.get(reverse('admin_management')), 'Leader')
+		self.assertEqual(self.list_users(), list(UserProfile.objects.order_by('last_name', 'first_name', 'id').values_list('id', flat=True)))
+		self.assertEqual(self.list_users(q='ann le', admin_level='l'), list(UserProfile.objects.filter(first_name='Ann', last_name='Lee', admin_level='l').order_by('id').values_list('id', flat=True)))
+		self.assertEqual(self.list_users(q='admin0@'), [self.admin.id])
+		
+		result = self.client.get(reverse('admin_users'), {'limit': 1}).json()
+		self.assertEqual(set(result['users'][0]), {'id', 'first_name', 'last_name', 'href', 'email', 'admin_level'})
+		self.assertEqual(self.client.get(reverse('admin_users'), {'admin_level': 'x'}).status_code, 404)
+		
+	def test_admins_only(self):
+		self.client.force_login(UserProfile.objects.filter(admin_level='u').first().user)
+		self.assertEqual(self.client.get(reverse('admin_users')).status_code, 404)
+		
+		
+class CommentPathBackfillTests(TestCase):
+	"""
+	Checks that migration 0011_backfill_comment_path gives existing comments the paths new comments get, with a constant number of queries.
+	"""
+	def test_backfill(self):
+		author, = create_profiles(1)
+		trip = create_trip(5)
+		
+		def add_comment(parent=None, depth=0):
+			comment = Comment(author=author, parent=parent, text='Comment', trip=trip, depth=depth)
+			comment.save()
+			return comment
+			
+		thread = add_comment()
+		reply = add_comment(thread, 1)
+		deleted = add_comment(reply, 2)
+		# older comments have the default depth, whatever their place in the thread
+		deep_reply = add_comment(deleted)
+		other_thread = add_comment()
+		late_reply = add_comment(reply)
+		deleted.delete()
+		expected = [
+			make_comment_path('', thread.id),
+			reply.path,
+			# its parent was deleted, and nothing records which thread it was in, so it becomes a thread of its own
+			make_comment_path('', deep_reply.id),
+			make_comment_path('', other_thread.id),
+			make_comment_path(reply.path, late_reply.id),
+		]
+		
+		Comment.objects.update(path='')
+		backfill_comment_paths = import_module('umoc.migrations.0011_backfill_comment_path').backfill_comment_paths
+		with CaptureQueriesContext(connection) as queries:
+			backfill_comment_paths(django_apps, None)
+		self.assertEqual([comment.path for comment in Comment.objects.order_by('id')], expected)
+		self.assertEqual(len(queries), 2)
+		
+		
+class CommentPageTests(TestCase):
+	"""
+	Checks that comments are rendered in thread order, that pages of comments offer the next page only when there is another thread to show, and that polls return only the comments posted since the last one.
+	"""
+	def setUp(self):
+		self.author, = create_profiles(1)
+		self.trip = create_trip(5)
+		self.client.force_login(self.author.user)
+		
+	def add_comment(self, text, parent=None):
+		comment = Comment(author=self.author, parent=parent, text=text, trip=self.trip, depth=parent.depth + 1 if parent else 0)
+		comment.save()
+		return comment
+		
+	def get_next_cursor(self):
+		return self.client.get(reverse('trip_comments', args=[self.trip.pk]), {'limit': 1}).context['next_cursor']
+		
+	def test_thread_order(self):
+		a, b = self.add_comment('A'), self.add_comment('B')
+		a1 = self.add_comment('A1', a)
+		b1 = self.add_comment('B1', b)
+		a2 = self.add_comment('A2', a)
+		a1a = self.add_comment('A1a', a1)
+		self.add_comment('B1a', b1)
+		self.add_comment('C')
+		self.add_comment('A1b', a1)
+		self.add_comment('A2a', a2)
+		self.add_comment('A1a1', a1a)
+		
+		# the order comments were rendered in before threads had paths: each comment, then each of its replies' threads, in order of posting
+		replies = {}
+		for comment in Comment.objects.order_by('time_stamp', 'id'):
+			replies.setdefault(comment.parent_id, []).append(comment.id)
+		def unravel(comment_id):
+			return [comment_id] + [reply_id for reply in replies.get(comment_id, []) for reply_id in unravel(reply)]
+		expected = [comment_id for top in replies[None] for comment_id in unravel(top)]
+		
+		url = reverse('trip_comments', args=[self.trip.pk])
+		for params in ({}, {'limit': 10, 'replies': 20}):
+			html = self.client.get(url, params).content.decode()
+			self.assertEqual([int(comment_id) for comment_id in re.findall(r'id="comment-(\d+)"', html)], expected)
+		self.assertEqual([Comment.objects.get(pk=comment_id).text for comment_id in expected], ['A', 'A1', 'A1a', 'A1a1', 'A1b', 'A2', 'A2a', 'B', 'B1', 'B1a', 'C'])
+		
+	def test_since(self):
+		url = reverse('trip_comments', args=[self.trip.pk])
+		thread = self.add_comment('Thread')
+		reply = self.add_comment('Reply', thread)
+		second = self.add_comment('Second thread')
+		late_reply = self.add_comment('Late reply', thread)
+		
+		result = self.client.get(url, {'since': thread.id}).json()
+		self.assertEqual(result['latest'], late_reply.id)
+		# in thread order, each with its parent
+		self.assertEqual([(comment['id'], comment['parent']) for comment in result['comments']], [(reply.id, thread.id), (late_reply.id, thread.id), (second.id, 0)])
+		self.assertEqual([comment['path'] for comment in result['comments']], sorted(comment['path'] for comment in result['comments']))
+		self.assertIn('Late reply', result['comments'][1]['html'])
+		
+		self.assertEqual(self.client.get(url, {'since': late_reply.id}).json(), {'latest': late_reply.id, 'comments': []})
+		newest = self.add_comment('Newest', second)
+		result = self.client.get(url, {'since': late_reply.id}).json()
+		self.assertEqual(result['latest'], newest.id)
+		self.assertEqual([(comment['id'], comment['parent']) for comment in result['comments']], [(newest.id, second.id)])
+		
+		self.assertEqual(self.client.get(url, {'since': 'abc'}).status_code, 404)
+		
+	def test_orphaned_replies(self):
+		thread = self.add_comment('Thread')
+		reply = self.add_comment('Reply', thread)
+		for i in range(3):
+			self.add_comment('Reply to reply', reply)
+		# its replies lose their parent, but stay in the thread
+		reply.delete()
+		self.assertIsNone(self.get_next_cursor())
+		
+		self.add_comment('Next thread')
+		self.assertEqual(self.get_next_cursor(), thread.path)
+		
+		
+class ArchiveTests(TestCase):
+	"""
+	Checks that old rows move to the archive tables and stay readable.
+	"""
+	def test_archive(self):
+		author, = create_profiles(1)
+		long_ago = datetime.now(timezone.utc) - timedelta(days=800)
+		old_trip = create_trip(5, start_time=long_ago, end_time=long_ago + timedelta(days=1))
+		new_trip = create_trip(5)
+		for trip in (old_trip, new_trip):
+			parent = None
+			for i in range(5):
+				parent = Comment(author=author, parent=parent, text='Comment {}'.format(i), trip=trip, depth=i)
+				parent.save()
+		notify([author.id] * 3, 'Old')
+		Notification.objects.filter(pk__in=Notification.objects.values('pk')[:2]).update(dismissed=True, time_stamp=long_ago)
+		
+		call_command('archive_old_data', batch_size=2, stdout=StringIO())
+		self.assertEqual(Notification.objects.count(), 1)
+		self.assertEqual(ArchivedNotification.objects.count(), 2)
+		self.assertFalse(Comment.objects.filter(trip=old_trip).exists())
+		self.assertEqual(Comment.objects.filter(trip=new_trip).count(), 5)
+		
+		# still shown in full, with the same ids
+		archived = list(get_trip_comments(old_trip.pk))
+		self.assertEqual([comment.text for comment in archived], ['Comment {}'.format(i) for i in range(5)])
+		self.assertEqual([comment.parent_id for comment in archived[1:]], [comment.id for comment in archived[:-1]])
+		response = self.client.get(reverse('trip_comments', args=[old_trip.pk]), {'limit': 10, 'replies': 2})
+		self.assertContains(response, 'Comment 2')
+		self.assertNotContains(response, 'comment-reply-btn')
+		
+		# replying to an archived comment, or one that doesn't exist, is not found rather than an error
+		self.client.force_login(author.user)
+		response = self.client.post(reverse('trip_comments', args=[old_trip.pk]), {'text': 'Reply', 'parent': archived[-1].id})
+		self.assertEqual(response.status_code, 404)
+		response = self.client.post(reverse('trip_comments', args=[new_trip.pk]), {'text': 'Reply', 'parent': archived[-1].id})
+		self.assertEqual(response.status_code, 404)
+		self.assertEqual(Comment.objects.count(), 5)
+		
+		
+class ReminderTests(TestCase):
+	"""
+	Checks that participants and drivers of upcoming trips are reminded once per window.
+	"""
+	def test_reminders(self):
+		profiles = create_profiles(4)
+		now = datetime.now(timezone.utc)
+		soon = create_trip(5, name='Soon', start_time=now + timedelta(hours=5), end_time=now + timedelta(hours=10))
+		next_week = create_trip(5, name='Next week', start_time=now + timedelta(days=3), end_time=now + timedelta(days=4))
+		create_trip(5, name='Later', start_time=now + timedelta(days=10), end_time=now + timedelta(days=11))
+		for profile in profiles[:3]:
+			soon.add_participant(profile)
+		soon.drivers.add(profiles[3], profiles[0])
+		next_week.add_participant(profiles[0])
+		
+		self.assertEqual(send_trip_reminders(now), 5)
+		self.assertEqual(send_trip_reminders(now), 0)
+		deliver_queued_notifications()
+		self.assertEqual(Notification.objects.filter(message__startswith='Reminder: Soon').count(), 4)
+		self.assertEqual(Notification.objects.filter(message__startswith='Reminder: Next week').count(), 1)
+		
+		# next week's trip comes within a day
+		self.assertEqual(send_trip_reminders(now + timedelta(days=2, hours=1)), 1)
+		self.assertEqual(send_trip_reminders(now + timedelta(days=2, hours=2)), 0)
@@ -5,23 +5,33 @@ from django.conf.urls import url
 urlpatterns = [
     path('', views.index, name='index'),
 	path('notifications', views.notifications, name='notifications'),
+	path('notifications/count', views.notification_count, name='notification_count'),
+	path('notifications/stream', views.event_stream_unavailable, name='notification_stream'),
     path('dashboard/', views.dashboard, name='dashboard'),
     path('register/', views.register, name='register'),
     path('profile/', views.profile, name='profile'),
     url(r'^profile/(?P<pk>\d+)/$', views.public_profile, name='public_profile'),
     url(r'^trip/(?P<pk>\d+)/$', views.trip_info, name='trip_info'),
     url(r'^trip/(?P<pk>\d+)/comments$', views.trip_comments, name='trip_comments'),
+    url(r'^trip/(?P<pk>\d+)/comments/(?P<comment_id>\d+)/replies$', views.comment_replies, name='comment_replies'),
+    url(r'^trip/(?P<pk>\d+)/comments/stream$', views.event_stream_unavailable, name='comment_stream'),
     path('waiver/', views.waiver, name = 'waiver'),
     path('administration/', views.admin_management, name='admin_management'),
 	path('administration_edit/', views.admin_edit, name='admin_edit'),
+	path('administration/users/', views.admin_users, name='admin_users'),
     path('trip/create/', views.TripCreate.as_view(), name='trip_create'),
     path('trip/<int:pk>/edit/', views.TripUpdate.as_view(), name='trip_update'),
     path('trip/<int:pk>/cancel/', views.cancel_trip, name='trip_cancel'),
 	path('trip/<int:pk>/join/', views.join_trip, name='trip_join'),
 	path('trip/<int:pk>/leave/', views.leave_trip, name='trip_leave'),
+	path('trip/<int:pk>/lottery/enter/', views.enter_lottery, name='trip_lottery_enter'),
+	path('trip/<int:pk>/waitlist/join/', views.join_waitlist, name='trip_waitlist_join'),
+	path('trip/<int:pk>/waitlist/leave/', views.leave_waitlist, name='trip_waitlist_leave'),
 	path('trip/<int:pk>/report/', views.trip_report, name='trip_report'),
     path('trip/<int:pk>/delete/', views.TripDelete.as_view(), name='trip_delete'),
     path('trips', views.all_trips, name='all_trips'),
+	path('trips/search', views.trip_search, name='trip_search'),
+	path('trips/autocomplete', views.trip_autocomplete, name='trip_autocomplete'),
 ]
 
 urlpatterns += [
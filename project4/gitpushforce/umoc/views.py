@@ -3,28 +3,40 @@ from django.urls import reverse, reverse_lazy
 from django.http import JsonResponse, HttpResponseRedirect, HttpResponse, Http404
 from django.views import generic
 from django.shortcuts import render, redirect, get_object_or_404
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Exists, F, Max, OuterRef, Q, Subquery
+from django.db.models.functions import ExtractMonth, ExtractYear, Greatest
 from django.contrib.auth import login, authenticate
 from django.contrib.auth.mixins import PermissionRequiredMixin
 from django.contrib.auth.decorators import permission_required, login_required
 from django.core.exceptions import ValidationError, PermissionDenied
 from django.views.generic.edit import CreateView, UpdateView, DeleteView
+from django.views.decorators.cache import cache_control
+from django.core.cache import cache
+from django.utils.timezone import make_aware, localdate
 
-from datetime import datetime, timezone
+from datetime import date, datetime, timezone, timedelta
+from collections import Counter
+from itertools import groupby
 import json
 
-from .models import UserProfile, Trip, Comment, Notification
+from .models import ADMIN_LEVELS, UserProfile, Trip, Comment, ArchivedComment, Notification, Waitlist, LotteryEntry, COMMENT_PATH_END
 from .forms import *
+from .notifications import enqueue_notification, get_unread_count, mark_notifications_seen, dismiss_notifications
+from .stats import get_site_stats
+from .search import search_trip_ids, trip_name_index
+from .caching import cache_anonymous_page, get_trips_version
+from .conditional import conditional_page, get_dashboard_state, get_all_trips_state, get_trip_state
+from .comments import ProcessedComment, build_comment_threads, serialize_comment
 
 
+@cache_anonymous_page
 def index(request):
-	num_users = UserProfile.objects.all().count()
-	num_trips = Trip.objects.all().count()
-	num_admins = UserProfile.objects.filter(admin_level__exact='a').count()
-	
+	# num_users, num_trips and num_admins, from the cache
 	return render(
 		request,
 		'index.html',
-		context={'num_users': num_users, 'num_trips': num_trips, 'num_admins': num_admins}
+		context=get_site_stats()
 	)
 
 
@@ -48,7 +60,7 @@ def register(request):
 			userpro.save()
 			
 			# create a welcome notification
-			Notification(recipient=userpro, message='Welcome to UMOC! Click here to fill out your profile', link=reverse('profile')).save()
+			enqueue_notification([userpro.id], 'Welcome to UMOC! Click here to fill out your profile', reverse('profile'))
 			
 			login(request, user)
 			return redirect('dashboard')
@@ -81,6 +93,7 @@ def profile(request):
 			profile.profile_img = form.cleaned_data['profile_image']
 			profile.contact_name = form.cleaned_data['contact_name']
 			profile.contact_phone = form.cleaned_data['contact_number']
+			profile.notification_digest = form.cleaned_data['notification_digest']
 			profile.save()
 			
 			return HttpResponseRedirect(reverse('dashboard'))
@@ -92,7 +105,8 @@ def profile(request):
 										  'date_of_birth': profile.dob,
 										  'phone_number': profile.phone_num,
 										  'contact_name': profile.contact_name,
-										  'contact_number': profile.contact_phone})
+										  'contact_number': profile.contact_phone,
+										  'notification_digest': profile.notification_digest})
 
 	return render(request, 'profile.html', {'form': form})
 
@@ -124,23 +138,158 @@ def waiver(request):
 	return render(request, 'waiver.html', {'form': form})
 
 
+# returns QuerySet of trips starting after the current time, in order of start time. Served by the Trip start_time index
+def get_upcoming_trips():
+	return Trip.objects.filter(start_time__gte=datetime.now(timezone.utc)).order_by('start_time')
+
+
+# returns the given Trip QuerySet with each trip's leader loaded in the same query, and, if the given user is logged in, 'is_member' set to whether they are signed up for it. Trips already carry their participant_count, so listings need no other query
+def get_trip_listing(trips, user):
+	if user.is_authenticated:
+		trips = trips.annotate(is_member=Exists(Trip.participants.through.objects.filter(trip_id=OuterRef('pk'), userprofile_id=user.profile.pk)))
+	return trips.select_related('leader')
+
+
+# returns query string of the given QueryDict with the given parameters changed (or removed, if None), for the first page of results
+def change_query(params, **changes):
+	params = params.copy()
+	params.pop('after', None)
+	for name, value in changes.items():
+		if value is None:
+			params.pop(name, None)
+		else:
+			params[name] = value
+	return params.urlencode()
+	
+	
+def filter_trips(filters):
+	"""
+	Returns QuerySet of the trips matching the cleaned data of a TripFinderForm, except its tag, which is left to the caller so facets can count every tag. Trips start from the 'start' date, or from the current time if not given.
+	"""
+	if filters['start']:
+		trips = Trip.objects.filter(start_time__gte=make_aware(datetime.combine(filters['start'], datetime.min.time())))
+	else:
+		trips = Trip.objects.filter(start_time__gte=datetime.now(timezone.utc))
+	if filters['end']:
+		trips = trips.filter(start_time__lt=make_aware(datetime.combine(filters['end'] + timedelta(days=1), datetime.min.time())))
+	if filters['leader']:
+		trips = trips.filter(leader=filters['leader'])
+	if filters['cancelled']:
+		trips = trips.filter(cancelled=filters['cancelled'] == 'yes')
+	if filters['seats']:
+		trips = trips.filter(participant_count__lt=F('capacity'))
+	return trips
+	
+	
+def get_trip_facets(trips, tag, start, params):
+	"""
+	Returns (tags, months): the number of trips in the given QuerySet of each tag, as a list of {'tag', 'name', 'color', 'count', 'query'}, and of the given tag (or of any, if '') starting in each month, as a list of {'month': date of its first day, 'count', 'query'}, in order. 'query' is the query string narrowing the Trip Finder given by QueryDict params to that facet. start is the Trip Finder's 'start' date, or None if trips start from the current time. Counted with one grouped query.
+	"""
+	rows = trips.annotate(year=ExtractYear('start_time'), month=ExtractMonth('start_time')).values('tag', 'year', 'month').annotate(count=Count('*')).order_by('year', 'month')
+	tag_counts = Counter()
+	month_counts = {}
+	for row in rows:
+		tag_counts[row['tag']] += row['count']
+		if not tag or row['tag'] == tag:
+			month = date(row['year'], row['month'], 1)
+			month_counts[month] = month_counts.get(month, 0) + row['count']
+			
+	tags = [
+		{'tag': code, 'name': name, 'color': Trip.TAGS[code][1], 'count': tag_counts[code], 'query': change_query(params, tag=code)}
+		for code, name in Trip.TAG_CHOICES if tag_counts[code]
+	]
+	# the month the trips start in keeps their lower bound, so its link finds as many trips as it counts
+	first_month = (start or localdate()).replace(day=1)
+	months = [
+		# from the first (or the lower bound) to the last day of the month
+		{'month': month, 'count': count, 'query': change_query(params, start=month.isoformat() if month > first_month else params.get('start'), end=((month + timedelta(days=31)).replace(day=1) - timedelta(days=1)).isoformat())}
+		for month, count in month_counts.items()
+	]
+	return tags, months
+	
+	
+# returns the given Trip QuerySet in order of start time, starting after the trip at the given (start_time, id) cursor, or from the first if cursor is None
+def get_trips_after(trips, cursor=None):
+	trips = trips.order_by('start_time', 'id')
+	if cursor:
+		start_time, trip_id = cursor
+		trips = trips.filter(start_time__gte=start_time).exclude(start_time=start_time, id__lte=trip_id)
+	return trips
+	
+	
+@conditional_page(get_dashboard_state)
+@cache_anonymous_page
 def dashboard(request):
 	""" 
-	Renders page with menu of upcoming trips, in order of start time.
+	Renders page with menu of upcoming trips, in order of start time, TRIP_PAGE_SIZE at a time. The Trip Finder narrows them by the fields of TripFinderForm, passed as GET parameters, and shows how many trips there are of each tag and in each month. Pass the 'after' cursor of a page to get the next one. Raises 404 if the filters are malformed.
 	"""
-	# filter trips by those starting after current time, and order by start time
-	return render(request, 'dashboard.html', {'trips': Trip.objects.filter(start_time__gte=datetime.now(timezone.utc)).order_by('start_time')})
+	form = TripFinderForm(request.GET)
+	if not form.is_valid():
+		raise Http404('Invalid trip filters')
+	trips = filter_trips(form.cleaned_data)
+	tags, months = get_trip_facets(trips, form.cleaned_data['tag'], form.cleaned_data['start'], request.GET)
+	if form.cleaned_data['tag']:
+		trips = trips.filter(tag=form.cleaned_data['tag'])
+		
+	# one more trip than shown, to tell whether there is another page
+	trips = list(get_trip_listing(get_trips_after(trips, get_trip_cursor_param(request.GET, 'after')), request.user)[:TRIP_PAGE_SIZE + 1])
+	return render(request, 'dashboard.html', {
+		'trips': trips[:TRIP_PAGE_SIZE],
+		'trips_version': get_trips_version(),
+		'next_query': change_query(request.GET, after=make_trip_cursor(trips[TRIP_PAGE_SIZE - 1])) if len(trips) > TRIP_PAGE_SIZE else None,
+		'form': form,
+		'tags': tags,
+		'months': months,
+		'all_query': change_query(request.GET, tag=None),
+	})
+
+
+@cache_anonymous_page
+def trip_search(request):
+	"""
+	Renders dashboard page with the trips whose name or description contains every word of GET 'q' (the last word may be unfinished), best match first. Matches are found and ranked by the full-text index (see search.py), with one query.
+	"""
+	query = request.GET.get('q', '')
+	ids = search_trip_ids(query)
+	trips = {trip.id: trip for trip in get_trip_listing(Trip.objects.filter(pk__in=ids), request.user)}
+	return render(request, 'dashboard.html', {
+		'trips': [trips[trip_id] for trip_id in ids if trip_id in trips],
+		'trips_version': get_trips_version(),
+		'query': query,
+	})
+	
+	
+# seconds browsers and proxies may reuse an autocomplete response
+AUTOCOMPLETE_MAX_AGE = 60
+# longest prefix autocompleted
+AUTOCOMPLETE_PREFIX_MAX = 40
 
+
+@cache_control(public=True, max_age=AUTOCOMPLETE_MAX_AGE)
+def trip_autocomplete(request):
+	"""
+	Returns JSON of the trip names with a word starting with GET 'q', for the dashboard search box: 'names' lists up to AUTOCOMPLETE_LIMIT of them. Served from the in-process TripNameIndex, without a query unless trips changed. The same for every user, so browsers and proxies may cache it.
+	"""
+	return JsonResponse({'names': trip_name_index.complete(request.GET.get('q', '')[:AUTOCOMPLETE_PREFIX_MAX])})
+	
 		
+@conditional_page(get_trip_state)
+@cache_anonymous_page
 def trip_info(request, pk):
 	"""
 	Info page for a trip. Allows users to sign up, withdraw, and comment. Trip's leader and admins can edit or cancel the trip.
 	"""
 	try:
+		trip = Trip.objects.get(pk=pk)
 		return render(
 			request,
 			'trip_info.html',
-			context={'trip': Trip.objects.get(pk=pk)}
+			context={
+				'trip': trip,
+				'is_participant': request.user.is_authenticated and trip.has_participant(request.user.profile),
+				'waitlist_position': trip.get_waitlist_position(request.user.profile) if request.user.is_authenticated else None,
+				'in_lottery': request.user.is_authenticated and trip.is_lottery_pending() and trip.lottery_entries.filter(profile=request.user.profile).exists(),
+			}
 		)
 	except Trip.DoesNotExist:
 		raise Http404('Sorry! That trip does not exist')
@@ -157,74 +306,179 @@ def public_profile(request, pk):
 		raise Http404("UserProfile does not exist")
 
 
-class ProcessedComment:
-	# initialize with a Comment var
-	def __init__(self, comment, parent=None):
-		self.id = comment.id
-		self.author = comment.author
-		self.text = comment.text
-		self.time_stamp = comment.time_stamp
-		self.depth = comment.depth
-		self.href = comment.author.get_absolute_url()
-		self.replies = []
-		self.parent = parent
-		
-	# Unravels child comments and threads, running recursively and returning a list of ordered comments. Sets depth for each. 
-	def unravel(self):
-		ordered = [self]
-		for comment in self.replies:
-			# comment.depth = self.depth + 1
-			ordered += comment.unravel()
-		return ordered
-		
-	def get_padding(self):
-		return self.depth * 30
+# number of trips shown per page of the dashboard and the trip archive
+TRIP_PAGE_SIZE = 20
+# seconds the number of trips per month stays cached. It is also counted again when the trips version changes
+TRIP_MONTHS_TIMEOUT = 24 * 60 * 60
+# trip cursors count microseconds from here
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+# number of top-level threads and replies per thread rendered per page of comments, unless requested otherwise
+COMMENT_PAGE_SIZE = 20
+COMMENT_REPLY_LIMIT = 5
+# largest page size a request may ask for
+COMMENT_PAGE_MAX = 100
+
+
+def get_int_param(params, name, default, maximum):
+	"""
+	Reads a non-negative integer parameter from the given QueryDict, returning default if it isn't present. Raises Http404 if the value is malformed. Values are capped at maximum.
+	"""
+	try:
+		value = int(params.get(name, default))
+	except ValueError:
+		raise Http404('Invalid value for {}'.format(name))
+	if value < 0:
+		raise Http404('Invalid value for {}'.format(name))
+	return min(value, maximum)
+	
+
+def get_id_list_param(params, name, maximum):
+	"""
+	Reads a list of ids from the given QueryDict, sent as several values of name (jQuery sends arrays as name[]). Raises Http404 if any is malformed or there are more than maximum.
+	"""
+	values = params.getlist(name)
+	if len(values) > maximum or not all(value.isdigit() for value in values):
+		raise Http404('Invalid value for {}'.format(name))
+	return [int(value) for value in values]
+	
+
+def get_path_param(params, name):
+	"""
+	Reads a comment thread path cursor from the given QueryDict. Returns '' if not present, and raises Http404 if malformed.
+	"""
+	path = params.get(name, '')
+	if path and not path.isdigit():
+		raise Http404('Invalid value for {}'.format(name))
+	return path
+
+
+def get_trip_cursor_param(params, name):
+	"""
+	Reads a trip cursor, as made by make_trip_cursor(), from the given QueryDict. Returns (start_time, id) of the trip it points at, or None if not present, and raises Http404 if malformed.
+	"""
+	cursor = params.get(name)
+	if cursor is None:
+		return None
+	parts = cursor.split('_')
+	if len(parts) != 2 or not all(part.isdigit() for part in parts):
+		raise Http404('Invalid value for {}'.format(name))
+	try:
+		return EPOCH + timedelta(microseconds=int(parts[0])), int(parts[1])
+	except OverflowError:
+		raise Http404('Invalid value for {}'.format(name))
+	
+	
+def get_month_param(params, name):
+	"""
+	Reads a month as 'YYYY-MM' from the given QueryDict. Returns the start of the month after it in the current time zone, or None if not present, and raises Http404 if malformed.
+	"""
+	month = params.get(name)
+	if month is None:
+		return None
+	try:
+		month = datetime.strptime(month, '%Y-%m')
+		return make_aware(month.replace(year=month.year + month.month // 12, month=month.month % 12 + 1))
+	except ValueError:
+		raise Http404('Invalid value for {}'.format(name))
 		
-	def __repr__(self):
-		return 'ProcessedComment(id="{}", author="{}", text="{}", time_stamp="{}". {} replies'.format(self.id, self.author, self.text, self.time_stamp, len(self.replies))
+
+# returns the cursor pointing at given Trip, for paginating trips by (start_time, id)
+def make_trip_cursor(trip):
+	return '{}_{}'.format((trip.start_time - EPOCH) // timedelta(microseconds=1), trip.id)
+	
+	
+def fetch_replies(comment, limit, after=''):
+	"""
+	Returns a tuple of (replies, more): up to limit Comments from the thread under the given Comment in display order, starting after the given path (the start of the thread by default), and whether the thread has more replies after those. Runs one query.
+	"""
+	replies = list(comment.get_descendants().filter(path__gt=after or comment.path).select_related('author', 'parent__author')[:limit + 1])
+	return replies[:limit], len(replies) > limit
+
+
+# returns the model storing comments on the trip of given id: ArchivedComment once they have been archived (see umoc/archive.py), otherwise Comment
+def get_comment_model(pk):
+	return ArchivedComment if Trip.objects.filter(pk=pk, comments_archived=True).exists() else Comment
+
+
+# returns QuerySet of all comments on the trip of given id in display order, with their authors. Served by the (trip, path) index. Pass model to skip looking up where they are stored
+def get_trip_comments(pk, model=None):
+	return (model or get_comment_model(pk)).objects.filter(trip_id=pk).select_related('author').order_by('path')
 
 
+@conditional_page(get_trip_state)
 def trip_comments(request, pk):
 	""" 
 	Manages comments for a trip of given id (/trip/<id>/comments). Only available via AJAX on properly authenticated users.
-	GET: Renders HTML comment section for given trip
-	POST: Creates the added comment. Requires a 'text' field storing the text body of the comment and a 'parent' field storing the id of the comment the new comment is replying to (0 if none). Returns 'success': boolean and 'message': string (will be empty if success=True) 
+	GET: Renders HTML comment section for given trip. Pass 'limit' to render one page of it instead: up to 'limit' top-level threads following the thread whose path is 'after' (from the start if not given), each with at most 'replies' replies. Threads with more replies end with a button to load them from comment_replies, and a button to load the next page is rendered if there is one. The first page also records the id of the trip's latest comment, for use with 'since'.
+	GET 'since': Returns JSON of the comments posted after the comment with id 'since', for live updates: 'latest' is the id to pass as 'since' next time, and 'comments' lists each new comment's 'id', 'parent' (id or 0), 'path' and rendered 'html', in display order.
+	POST: Creates the added comment. Requires a 'text' field storing the text body of the comment and a 'parent' field storing the id of the comment the new comment is replying to (0 if none), which must be on the same trip. Returns 'success': boolean and 'message': string (will be empty if success=True) 
+	Comments on archived trips are read from the archive, and can't be added to.
 	"""
-	if request.method == 'GET':
-		print ('Retrieving comments for trip id {}'.format(pk))
-		# TODO: CHECK IF TRIP IS IN DATABASE
+	if request.method == 'GET' and 'since' in request.GET:
+		since = get_int_param(request.GET, 'since', 0, 2 ** 63 - 1)
 		
-		# map id->ProcessedComment
-		processed_comments = {}
-		# top-level comments
-		top_level_comments = []
+		# index range scan on (trip, id). Take the oldest new comments first so 'latest' never skips any, then put them in thread order
+		new_comments = list(get_comment_model(pk).objects.filter(trip_id=pk, id__gt=since).select_related('author', 'parent__author').order_by('id')[:COMMENT_PAGE_MAX])
+		latest = new_comments[-1].id if new_comments else since
+		new_comments.sort(key=lambda comment: comment.path)
 		
-		# retrieve comments on given trip in order of posting
-		trip_comments = Comment.objects.filter(trip_id=pk).order_by('time_stamp')
-
-		for comment in trip_comments:
-			# create ProcessedComment wrapper and add to dictionary
-			processed = ProcessedComment(comment)
-			print (processed.href)
-			processed_comments[comment.id] = processed
+		return JsonResponse({
+			'latest': latest,
+			'comments': [serialize_comment(processed) for processed in build_comment_threads(new_comments)],
+		})
+	elif request.method == 'GET' and 'limit' in request.GET:
+		limit = max(1, get_int_param(request.GET, 'limit', COMMENT_PAGE_SIZE, COMMENT_PAGE_MAX))
+		reply_limit = get_int_param(request.GET, 'replies', COMMENT_REPLY_LIMIT, COMMENT_PAGE_MAX)
+		after = get_path_param(request.GET, 'after')
+		model = get_comment_model(pk)
+		context = {'archived': model is ArchivedComment}
+		# read before the comments, so one posted while they are read is polled for later rather than missed. Comments the page already shows are skipped by comments.js
+		if not after:
+			context['latest_id'] = model.objects.filter(trip_id=pk).aggregate(latest=Max('id'))['latest'] or 0
+		
+		# top-level comments past the end of the last thread shown, plus one more to tell whether there is another page
+		threads = model.objects.filter(trip_id=pk, parent__isnull=True, path__gt=after + COMMENT_PATH_END if after else '').select_related('author').order_by('path')[:limit + 1]
+		
+		comments = []
+		shown = []
+		next_cursor = None
+		for thread in threads:
+			# a reply whose parent was deleted has no parent, but is still shown inside its original thread
+			if shown and thread.path.startswith(shown[-1].path):
+				continue
+			if len(shown) == limit:
+				next_cursor = shown[-1].path
+				break
+			shown.append(thread)
 			
-			if comment.parent:
-				# set comment's parent and add comment as reply to parent
-				processed.parent = processed_comments[comment.parent.id]
-				processed_comments[comment.parent.id].replies.append(processed)
-			else:
-				# comment must be top-level
-				top_level_comments.append(processed)
-				
-		# unravel top-level comments, creating list of ordered ProcessedComments
-		ordered_comments = []
-		for processed_comment in top_level_comments:
-			ordered_comments += processed_comment.unravel()
+			# render thread's comment followed by its first replies, one query per thread
+			replies, more = fetch_replies(thread, reply_limit)
+			processed = build_comment_threads([thread] + replies)
+			if more:
+				processed[-1].more_replies = thread.id
+			comments.extend(processed)
 			
+		# every row was shown or skipped as a reply, but rows past the extra one weren't read: look for another thread after them
+		if next_cursor is None and len(threads) > limit and model.objects.filter(trip_id=pk, parent__isnull=True, path__gt=shown[-1].path + COMMENT_PATH_END).exists():
+			next_cursor = shown[-1].path
+		context['comments'] = comments
+		context['next_cursor'] = next_cursor
+		
 		return render(
 			request,
 			'trip_comments.html',
-			context={'comments': ordered_comments}
+			context=context
+		)
+	elif request.method == 'GET':
+		print ('Retrieving comments for trip id {}'.format(pk))
+		# TODO: CHECK IF TRIP IS IN DATABASE
+		
+		model = get_comment_model(pk)
+		return render(
+			request,
+			'trip_comments.html',
+			context={'comments': build_comment_threads(get_trip_comments(pk, model)), 'archived': model is ArchivedComment}
 		)
 		#return JsonResponse(data, safe=False)
 	elif request.method == 'POST' and request.user.is_authenticated: # and request.is_ajax()
@@ -232,10 +486,13 @@ def trip_comments(request, pk):
 		print (request.POST)
 		# TODO: COULD BE A VULNERABILITY (NOT ENOUGH DATA VALIDATION)
 		
-		# retrieve relevant database records
+		# retrieve relevant database records. The trip's comments may have been archived, parent and all, so check before looking the parent up
 		author = UserProfile.objects.get(pk=request.user.profile.id)
-		parent_comment = Comment.objects.get(pk=request.POST['parent']) if request.POST['parent'] != '0' else None
-		trip = Trip.objects.get(pk=pk)
+		trip = get_object_or_404(Trip, pk=pk)
+		if trip.comments_archived:
+			raise Http404('Comments on this trip have been archived')
+		parent_id = get_int_param(request.POST, 'parent', 0, 2 ** 63 - 1)
+		parent_comment = get_object_or_404(Comment, pk=parent_id, trip_id=pk) if parent_id else None
 		
 		# enforce maximumum depth of 6?
 		
@@ -244,11 +501,13 @@ def trip_comments(request, pk):
 		comment.save()
 		
 		# create Notification for comment's parent if one exists and author is not equal to current signed-in user
+		# replies to one comment, and comments on one trip, are merged into one notification while it is undismissed, so both link to what they have in common
+		author_name = '{} {}'.format(author.first_name, author.last_name)
 		if parent_comment and request.user.profile.id != parent_comment.author.id:
-			Notification(recipient=parent_comment.author, message='{} {} replied to your comment'.format(author.first_name, author.last_name), link=comment.get_absolute_url()).save()
+			enqueue_notification([parent_comment.author_id], '{} replied to your comment'.format(author_name), parent_comment.get_absolute_url(), kind='reply', actor=author_name)
 		# no parent: create notification for trip leader 
 		elif not parent_comment and request.user.profile.id != trip.leader.id:
-			Notification(recipient=trip.leader, message='{} {} commented on one of your trips'.format(author.first_name, author.last_name), link=comment.get_absolute_url()).save()
+			enqueue_notification([trip.leader_id], '{} commented on one of your trips'.format(author_name), trip.get_absolute_url(), kind='comment', actor=author_name)
 		
 		# return rendered comment
 		return render(
@@ -261,30 +520,84 @@ def trip_comments(request, pk):
 		raise Http404('Access Denied')
 
 
+def comment_replies(request, pk, comment_id):
+	"""
+	Renders more of the thread under a comment, for the paginated comment section (/trip/<id>/comments/<comment_id>/replies). Only available via AJAX.
+	GET: Renders up to 'limit' replies in the comment's thread that come after the reply whose path is 'after'. Ends with a button to load more if the thread still isn't finished.
+	"""
+	if request.method != 'GET':
+		raise Http404('Access Denied')
+	
+	model = get_comment_model(pk)
+	comment = get_object_or_404(model, pk=comment_id, trip_id=pk)
+	limit = max(1, get_int_param(request.GET, 'limit', COMMENT_REPLY_LIMIT, COMMENT_PAGE_MAX))
+	replies, more = fetch_replies(comment, limit, get_path_param(request.GET, 'after'))
+	
+	processed = build_comment_threads(replies)
+	if more:
+		processed[-1].more_replies = comment.id
+	
+	return render(
+		request,
+		'trip_comments.html',
+		context={'comments': processed, 'archived': model is ArchivedComment}
+	)
+
+
+def event_stream_unavailable(request, pk=None):
+	"""
+	Answers requests for event streams (/notifications/stream, /trip/<id>/comments/stream) when running under WSGI. The streams are only served by the ASGI application (see umoc.streams); 204 No Content tells the browser to stop reconnecting, and pages fall back to fetching updates themselves.
+	"""
+	return HttpResponse(status=204)
+
+
+# most notifications updated by one request
+NOTIFICATION_IDS_MAX = 500
+
+
+# returns QuerySet of the notifications the UserProfile of given id hasn't dismissed, newest first. Served by the Notification (recipient, dismissed, time_stamp) index
+def get_active_notifications(profile_id):
+	return Notification.objects.filter(recipient_id=profile_id, dismissed=False).order_by('-time_stamp')
+
+
 @login_required
 def notifications(request):
 	"""
-	AJAX handler managing currently signed in user's notifications. Only accessible via AJAX requests. Returns rendered HTML of user's notifications, for insertion into the navbar on GET. POST accepts 'dismissed_id': <int:id> as the id of the notification the user has dismissed. 
+	AJAX handler managing currently signed in user's notifications. Only accessible via AJAX requests. Returns rendered HTML of user's notifications, for insertion into the navbar on GET. POST accepts one of 'dismissed_id': <int:id> as the id of the notification the user has dismissed, 'dismissed_ids[]': <list of ids> to dismiss several, 'dismiss_all': 1 to dismiss all of them, or 'seen_ids[]': <list of ids> for notifications the user has now seen. Each POST runs one UPDATE of the user's own notifications, and returns JSON with the new 'unread' count.
 	"""
+	profile_id = request.user.profile.id
 	if request.method == 'GET':
 		print ('Retrieving notifications for user {}'.format(request.user.id))
 		return render(
 			request,
 			'notifications.html',
-			context={'notifications': Notification.objects.filter(recipient_id=request.user.profile.id, dismissed=False).order_by('-time_stamp')}
+			context={'notifications': get_active_notifications(profile_id)}
 		)
 	elif request.method == 'POST':
-		print ('Received request to dismiss notification {}'.format(request.POST))
-		requested = Notification.objects.get(pk=request.POST['dismissed_id'])
-		print (requested)
-		requested.dismissed = True
-		requested.save()
-		print (requested)
-		return JsonResponse({'success': True})
+		print ('Received notifications update {}'.format(request.POST))
+		if 'seen_ids[]' in request.POST:
+			mark_notifications_seen(profile_id, get_id_list_param(request.POST, 'seen_ids[]', NOTIFICATION_IDS_MAX))
+		elif 'dismissed_ids[]' in request.POST:
+			dismiss_notifications(profile_id, get_id_list_param(request.POST, 'dismissed_ids[]', NOTIFICATION_IDS_MAX))
+		elif 'dismissed_id' in request.POST:
+			dismiss_notifications(profile_id, get_id_list_param(request.POST, 'dismissed_id', 1))
+		elif 'dismiss_all' in request.POST:
+			dismiss_notifications(profile_id)
+		else:
+			raise Http404('Nothing to update')
+		return JsonResponse({'success': True, 'unread': get_unread_count(profile_id)})
 	else:
 		raise Http404('Access Denied')
 		
 
+@login_required
+def notification_count(request):
+	"""
+	AJAX handler returning JSON {'unread': <int>}, the number of notifications the signed in user hasn't seen, for the navbar badge. Served from the cache (see get_unread_count), so it doesn't count or render notifications.
+	"""
+	return JsonResponse({'unread': get_unread_count(request.user.profile.id)})
+		
+
 @login_required
 def admin_management(request):
 	"""
@@ -293,13 +606,63 @@ def admin_management(request):
 	if request.user.profile.admin_level != 'a':
 		raise Http404('You do not have access to this page')
 	else:
+		# users are listed by AJAX calls to admin_users
 		return render(
 			request,
 			'admin_management.html',
-			context={'users': UserProfile.objects.all().order_by('last_name')}
+			context={'admin_levels': ADMIN_LEVELS}
 		)
 
 
+# number of users listed per page of the user directory, unless requested otherwise, and the most a request may ask for
+USER_PAGE_SIZE = 50
+USER_PAGE_MAX = 200
+# longest search text used
+USER_SEARCH_MAX = 100
+
+
+def get_user_directory(search='', admin_level='', after=None):
+	"""
+	Returns QuerySet of the users matching the given search text and admin level, in order of name, starting after the UserProfile of id after (from the first if None), as the dicts admin_users returns. Every word of the search text must start the first name, last name or email of a user. Served by the name index, or the admin level index if filtered by level, and looks up the cursor's name in the same query.
+	"""
+	users = UserProfile.objects.all()
+	for word in search.split():
+		users = users.filter(Q(first_name__istartswith=word) | Q(last_name__istartswith=word) | Q(email__istartswith=word))
+	if admin_level:
+		users = users.filter(admin_level=admin_level)
+	if after is not None:
+		cursor = UserProfile.objects.filter(pk=after)
+		last_name = Subquery(cursor.values('last_name')[:1])
+		first_name = Subquery(cursor.values('first_name')[:1])
+		# past (last_name, first_name, id) of the cursor
+		users = users.filter(last_name__gte=last_name).exclude(Q(last_name=last_name) & (Q(first_name__lt=first_name) | Q(first_name=first_name, id__lte=after)))
+	return users.order_by('last_name', 'first_name', 'id').values('id', 'first_name', 'last_name', 'email', 'admin_level')
+
+
+@login_required
+def admin_users(request):
+	"""
+	Lists users for the admin page, as JSON. IMPORTANT: This must only be accessible by admins. GET 'q' searches by name or email, 'admin_level' (a/l/u) filters by level, and 'after' continues from the user of that id. Returns 'users': up to 'limit' (USER_PAGE_SIZE by default) users in order of name, each with the 'id', 'first_name', 'last_name', 'href', 'email' and 'admin_level' that administration.js shows, and 'next': the 'after' of the next page, or null if there is none. Runs one query per page.
+	"""
+	if request.user.profile.admin_level != 'a':
+		raise Http404('You do not have access to this page')
+		
+	admin_level = request.GET.get('admin_level', '')
+	if admin_level and admin_level not in dict(ADMIN_LEVELS):
+		raise Http404('Invalid value for admin_level')
+	limit = max(1, get_int_param(request.GET, 'limit', USER_PAGE_SIZE, USER_PAGE_MAX))
+	after = get_int_param(request.GET, 'after', 0, 2 ** 63 - 1) if 'after' in request.GET else None
+	
+	# one more user than listed, to tell whether there is another page
+	users = list(get_user_directory(request.GET.get('q', '')[:USER_SEARCH_MAX], admin_level, after)[:limit + 1])
+	for user in users:
+		user['href'] = reverse('public_profile', args=[str(user['id'])])
+	return JsonResponse({
+		'users': users[:limit],
+		'next': users[limit - 1]['id'] if len(users) > limit else None,
+	})
+
+
 @login_required
 def admin_edit(request):
 	"""
@@ -323,7 +686,7 @@ def admin_edit(request):
 			print('Set {} to {}'.format(user, user.admin_level))
 			
 			# send user a notification
-			Notification(recipient=user, message='Your admin level was set to {}'.format({'a': 'Admin', 'l': 'Leader', 'u': 'User'}[user.admin_level])).save()
+			enqueue_notification([user.id], 'Your admin level was set to {}'.format({'a': 'Admin', 'l': 'Leader', 'u': 'User'}[user.admin_level]))
 			return JsonResponse({'success': True});
 		except UserProfile.DoesNotExist:
 			return JsonResponse({'success': False})  # todo: return error
@@ -334,7 +697,7 @@ def admin_edit(request):
 
 class TripCreate(CreateView):
 	model = Trip
-	fields = ('name', 'description', 'capacity', 'start_time', 'end_time', 'tag', 'leader')
+	fields = ('name', 'description', 'capacity', 'start_time', 'end_time', 'tag', 'leader', 'lottery_closes')
 	template_name = 'umoc/trip_form.html'
 
 	def get(self, request):
@@ -358,7 +721,7 @@ class TripCreate(CreateView):
 
 class TripUpdate(UpdateView):
 	model = Trip
-	fields = ('name', 'description', 'capacity', 'start_time', 'end_time', 'tag', 'leader')
+	fields = ('name', 'description', 'capacity', 'start_time', 'end_time', 'tag', 'leader', 'lottery_closes')
 	template_name = 'umoc/trip_form.html'
 		
 	def get(self, request, pk):
@@ -369,7 +732,8 @@ class TripUpdate(UpdateView):
 									  'start_time': trip_instance.start_time.replace(tzinfo=timezone.utc).astimezone(tz=None).strftime('%Y-%m-%d %I:%M %p'),
 									  'end_time': trip_instance.end_time.replace(tzinfo=timezone.utc).astimezone(tz=None).strftime('%Y-%m-%d %I:%M %p'),
 									  'tag': trip_instance.tag,
-									  'leader': trip_instance.leader})
+									  'leader': trip_instance.leader,
+									  'lottery_closes': trip_instance.lottery_closes and trip_instance.lottery_closes.replace(tzinfo=timezone.utc).astimezone(tz=None).strftime('%Y-%m-%d %I:%M %p')})
 		
 		return render(request, self.template_name, {'form': form})
 		
@@ -381,13 +745,17 @@ class TripUpdate(UpdateView):
 			if form.is_valid():
 				trip.name = form.cleaned_data['name']
 				trip.description = form.cleaned_data['description']
-				trip.num_seats = trip.num_seats - trip.capacity + form.cleaned_data['capacity']
 				trip.capacity = form.cleaned_data['capacity']
 				trip.start_time = form.cleaned_data['start_time']
 				trip.end_time = form.cleaned_data['end_time']
 				trip.tag = form.cleaned_data['tag']
 				trip.leader = form.cleaned_data['leader']
-				trip.save()
+				trip.lottery_closes = form.cleaned_data['lottery_closes']
+				# leave participant_count alone, in case someone joined since it was read
+				trip.save(update_fields=['name', 'description', 'capacity', 'start_time', 'end_time', 'tag', 'leader', 'lottery_closes', 'updated_at'])
+				Trip.objects.filter(pk=pk).update(num_seats=Greatest(F('capacity') - F('participant_count'), 0))
+				# fill any seats added by raising the capacity
+				trip.promote_waitlist()
 				return HttpResponseRedirect(reverse('dashboard'))
 		
 		else:
@@ -403,7 +771,7 @@ class TripDelete(DeleteView):
 @login_required
 def cancel_trip(request, pk):
 	""" 
-	Cancels trip of the given id. Requires requesting user to be trip leader or an admin. Returns 404 if the trip is over or has already been canceled. Creates notification for each user who had been signed up to participate.
+	Cancels trip of the given id. Requires requesting user to be trip leader or an admin. Returns 404 if the trip is over or has already been canceled. Creates notification for each user who had been signed up to participate or was on the waitlist, and clears the waitlist.
 	"""
 	try:
 		trip = Trip.objects.get(pk=pk)
@@ -412,12 +780,14 @@ def cancel_trip(request, pk):
 		elif request.user.profile.admin_level != 'a' and request.user.profile != trip.leader:
 			raise Http404("You do not have permission")
 		else:  # success
-			trip.cancelled = True
-			trip.save()
-			
-			# create notifications
-			for participant in trip.participants.all():
-				Notification(recipient=participant, message='{} was cancelled'.format(trip.name), link=trip.get_absolute_url()).save()
+			with transaction.atomic():
+				trip.cancelled = True
+				trip.save(update_fields=['cancelled', 'updated_at'])
+				
+				# queue notifications for participants and waitlisted users, without loading them, and empty the waitlist, as nobody can move up anymore
+				recipient_ids = list(trip.participants.values_list('id', flat=True)) + list(trip.waitlist.values_list('profile_id', flat=True))
+				enqueue_notification(recipient_ids, '{} was cancelled'.format(trip.name), trip.get_absolute_url())
+				trip.waitlist.all().delete()
 				
 			return redirect('trip_info', pk=pk)
 	except Trip.DoesNotExist:
@@ -433,43 +803,97 @@ def join_trip(request, pk):
 		trip = Trip.objects.get(pk=pk)
 		if trip.is_over():
 			raise Http404("You can't join a trip that is over")
-		elif request.user.profile in trip.participants.all():
+		elif trip.is_lottery_pending():
+			raise Http404('Seats on this trip are given out by lottery. Enter the lottery instead')
+		elif trip.has_participant(request.user.profile):
 			raise Http404('You are already signed up!')
-		elif not trip.num_seats:
-			raise Http404('This trip is full')
+		elif not trip.add_participant(request.user.profile):
+			raise Http404('This trip is full. Join the waitlist instead')
 		else:  # success
-			trip.participants.add(request.user.profile)
-			trip.num_seats -= 1
-			trip.save()
-			
 			# create notification
-			Notification(recipient=request.user.profile, message='You joined {} successfully!'.format(trip.name), link=trip.get_absolute_url()).save()
+			enqueue_notification([request.user.profile.id], 'You joined {} successfully!'.format(trip.name), trip.get_absolute_url())
 			
 			return redirect('trip_info', pk=pk)
 	except Trip.DoesNotExist:
 		raise Http404('Sorry, that trip does not exist')
+	except IntegrityError:
+		# user signed up in another request at the same time
+		raise Http404('You are already signed up!')
 	
 
 @login_required	
 def leave_trip(request, pk):
 	"""
-	Removes user from specified trip. Trip must exist and have capacity for another user, and user must not already be signed up. Returns 404 if this is not the case (it shouldn't be). Reloads trip page on success.
+	Removes user from specified trip. Trip must exist and have capacity for another user, and user must not already be signed up. Returns 404 if this is not the case (it shouldn't be). The freed seat goes to the head of the trip's waitlist, who is signed up and notified in the same transaction. Reloads trip page on success.
 	"""
 	try:
 		trip = Trip.objects.get(pk=pk)
 		if trip.is_over():
 			raise Http404("You can't leave a trip that is over")
-		elif request.user.profile not in trip.participants.all():
+		elif not trip.has_participant(request.user.profile):
 			raise Http404("You aren't signed up for this trip")
 		elif request.user.profile == trip.leader:
 			raise Http404("You're the leader, you can't leave! You must cancel the trip or have an admin switch you out.")
 		else:  # success
-			trip.participants.remove(request.user.profile)
-			trip.num_seats += 1
-			trip.save()
+			with transaction.atomic():
+				# participant_count is updated by the participants m2m_changed handler
+				trip.participants.remove(request.user.profile)
+				trip.promote_waitlist()
+			return redirect('trip_info', pk=pk)
+	except Trip.DoesNotExist:
+		raise Http404('Sorry, that trip does not exist')
+		
+
+@login_required
+def join_waitlist(request, pk):
+	"""
+	Adds user to the end of the waitlist for specified trip. Trip must exist, not be over or cancelled, and be full, and user must not already be signed up or waiting. Returns 404 if this is not the case. Sends user a notification with their place in line and reloads trip page on success.
+	"""
+	try:
+		trip = Trip.objects.get(pk=pk)
+		if trip.is_over() or trip.cancelled:
+			raise Http404("You can't join the waitlist of a trip that is over or cancelled")
+		elif trip.is_lottery_pending():
+			raise Http404('The waitlist for this trip is filled by its lottery')
+		elif trip.has_participant(request.user.profile):
+			raise Http404('You are already signed up!')
+		elif trip.get_seats_remaining():
+			raise Http404('This trip has open seats. Join it instead')
+		else:  # success
+			trip.join_waitlist(request.user.profile)
+			enqueue_notification([request.user.profile.id], 'You are #{} on the waitlist for {}'.format(trip.get_waitlist_position(request.user.profile), trip.name), trip.get_absolute_url())
 			return redirect('trip_info', pk=pk)
 	except Trip.DoesNotExist:
 		raise Http404('Sorry, that trip does not exist')
+	except IntegrityError:
+		raise Http404('You are already on the waitlist!')
+		
+
+@login_required
+def enter_lottery(request, pk):
+	"""
+	Enters user in the sign-up lottery for specified trip, which must exist and have an open lottery. Returns 404 if this is not the case, or user has already entered. Entering is a single insert, so it stays cheap when everyone enters the moment a trip is posted. Reloads trip page on success.
+	"""
+	try:
+		trip = Trip.objects.get(pk=pk)
+		if trip.cancelled or not trip.is_lottery_open():
+			raise Http404('This trip has no open lottery')
+		LotteryEntry.objects.create(trip=trip, profile=request.user.profile)
+		return redirect('trip_info', pk=pk)
+	except Trip.DoesNotExist:
+		raise Http404('Sorry, that trip does not exist')
+	except IntegrityError:
+		raise Http404('You have already entered the lottery!')
+		
+
+@login_required
+def leave_waitlist(request, pk):
+	"""
+	Removes user from the waitlist for specified trip. Returns 404 if the trip doesn't exist or user isn't on its waitlist. Reloads trip page on success.
+	"""
+	if not Waitlist.objects.filter(trip_id=pk, profile=request.user.profile).delete()[0]:
+		raise Http404("You aren't on the waitlist for this trip")
+	return redirect('trip_info', pk=pk)
 		
 
 @login_required
@@ -487,8 +911,47 @@ def trip_report(request, pk):
 		raise Http404('Sorry, that trip does not exist')
 		
 	
+# returns QuerySet of trips that start before the given (start_time, id) cursor, newest first, or of all trips if cursor is None. Served by the Trip start_time index (which SQLite extends with the id), however far back the cursor is
+def get_trips_before(cursor=None):
+	trips = Trip.objects.order_by('-start_time', '-id')
+	if cursor:
+		start_time, trip_id = cursor
+		trips = trips.filter(start_time__lte=start_time).exclude(start_time=start_time, id__gte=trip_id)
+	return trips
+	
+	
+def get_trip_months():
+	"""
+	Returns a list of years that have trips, newest first, each as {'year': year, 'months': list of {'month': date of its first day, 'count': number of trips starting in it}}, newest first. Counted with one grouped query, in the current time zone, and cached until the trips version changes.
+	"""
+	key = 'umoc:trips:months:{}'.format(get_trips_version())
+	years = cache.get(key)
+	if years is None:
+		years = []
+		months = Trip.objects.annotate(year=ExtractYear('start_time'), month=ExtractMonth('start_time')).values('year', 'month').annotate(count=Count('*')).order_by('-year', '-month')
+		for year, group in groupby(months, key=lambda month: month['year']):
+			years.append({'year': year, 'months': [{'month': date(year, month['month'], 1), 'count': month['count']} for month in group]})
+		cache.set(key, years, TRIP_MONTHS_TIMEOUT)
+	return years
+	
+	
+@conditional_page(get_all_trips_state)
+@cache_anonymous_page
 def all_trips(request):
 	"""
-	Renders dashboard page, but with all trips that have ever happened from newest to oldest.
+	Renders dashboard page, but with every trip that has ever happened from newest to oldest, TRIP_PAGE_SIZE at a time, and links to the trips of each month. Pass the 'after' cursor of a page to get the next one, or a 'month' ('YYYY-MM') to start from its last trip.
 	"""
-	return render(request, 'dashboard.html', {'trips': Trip.objects.all().order_by('-start_time')})
\ No newline at end of file
+	cursor = get_trip_cursor_param(request.GET, 'after')
+	month = get_month_param(request.GET, 'month')
+	if cursor is None and month is not None:
+		# before the first trip of the next month
+		cursor = (month, 0)
+		
+	# one more trip than shown, to tell whether there is another page
+	trips = list(get_trip_listing(get_trips_before(cursor), request.user)[:TRIP_PAGE_SIZE + 1])
+	return render(request, 'dashboard.html', {
+		'trips': trips[:TRIP_PAGE_SIZE],
+		'trips_version': get_trips_version(),
+		'next_query': change_query(request.GET, after=make_trip_cursor(trips[TRIP_PAGE_SIZE - 1]), month=None) if len(trips) > TRIP_PAGE_SIZE else None,
+		'years': get_trip_months(),
+	})
\ No newline at end of file